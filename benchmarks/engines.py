@@ -0,0 +1,213 @@
+# Copyright 2021 D-Wave Systems Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Time the generation engines and backends and recalibrate the rules used by
+``engine='auto'``.
+
+Run with
+
+    python benchmarks/engines.py [--timeout SECONDS] [--repeat N]
+
+The timings are printed for each problem, followed by a rule table that can
+replace :data:`penaltymodel.generation.ENGINE_RULES`.
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+import dimod
+import networkx as nx
+import numpy as np
+
+from penaltymodel import ImpossiblePenaltyModel
+from penaltymodel.generation import BACKENDS, EngineRule, generate, select_engine
+
+# (engine, backend) pairs, the backend only matters for the LP engines
+CONFIGURATIONS = ([('lp', name) for name in sorted(BACKENDS)]
+                  + [('lazy', None), ('milp', None), ('tree', None)])
+
+
+def table_to_sampleset(table, decision):
+    return dimod.SampleSet.from_samples((list(table), decision), 'SPIN', list(table.values()))
+
+
+def problems():
+    """Yield (name, graph, samples) for a set of typical problems."""
+    AND = {(-1, -1, -1): 0, (-1, +1, -1): 0, (+1, -1, -1): 0, (+1, +1, +1): 0}
+    XOR = {(-1, -1, -1): 0, (-1, +1, +1): 0, (+1, -1, +1): 0, (+1, +1, -1): 0}
+    NAE3SAT = {config: 0 for config in itertools.product((-1, +1), repeat=3)
+               if len(set(config)) > 1}
+
+    yield 'AND K3', nx.complete_graph(3), table_to_sampleset(AND, (0, 1, 2))
+    yield 'AND K4', nx.complete_graph(4), table_to_sampleset(AND, (0, 1, 2))
+    yield 'XOR K4', nx.complete_graph(4), table_to_sampleset(XOR, (0, 1, 2))
+    yield 'XOR K5', nx.complete_graph(5), table_to_sampleset(XOR, (0, 1, 2))
+    yield 'NAE3SAT C4', nx.cycle_graph(4), table_to_sampleset(NAE3SAT, (0, 1, 2))
+    EQUAL = {(-1, -1, -1): 0, (+1, +1, +1): 0}
+    yield 'equal C10', nx.cycle_graph(10), table_to_sampleset(EQUAL, (0, 1, 5))
+    yield 'equal C12', nx.cycle_graph(12), table_to_sampleset(EQUAL, (0, 1, 6))
+    yield 'equal P20', nx.path_graph(20), table_to_sampleset({(-1,)*20: 0, (+1,)*20: 0}, range(20))
+
+    # random tables over complete graphs with a few auxiliary variables
+    rng = np.random.default_rng(5)
+    for num_decision, num_auxiliary in [(3, 2), (4, 2), (4, 3), (5, 2), (5, 3)]:
+        states = list(itertools.product((-1, +1), repeat=num_decision))
+        feasible = rng.choice(len(states), len(states) // 2, replace=False)
+        table = {states[i]: 0 for i in sorted(feasible)}
+        yield (f'random {num_decision}+{num_auxiliary}',
+               nx.complete_graph(num_decision + num_auxiliary),
+               table_to_sampleset(table, range(num_decision)))
+
+
+def shape(graph: nx.Graph, samples: dimod.SampleSet) -> Tuple[int, int, int, int]:
+    return (len(graph.nodes), len(graph.nodes) - len(samples.variables), len(samples),
+            len(graph.edges))
+
+
+def run(graph, samples, engine, backend) -> float:
+    t = time.perf_counter()
+    try:
+        generate(graph, samples, engine=engine, backend=backend)
+    except ImpossiblePenaltyModel:
+        pass
+    return time.perf_counter() - t
+
+
+def _run_child(connection, graph, samples, engine, backend):
+    try:
+        result = run(graph, samples, engine, backend)
+    except Exception as err:
+        result = err
+    connection.send(result)
+    connection.close()
+
+
+def time_configuration(graph, samples, engine, backend, *, timeout: float, repeat: int) -> float:
+    # run each in its own process so that slow configurations can be
+    # terminated
+    best = float('inf')
+    for _ in range(repeat):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_run_child,
+                                          args=(sender, graph, samples, engine, backend))
+        process.start()
+        sender.close()
+        try:
+            if not receiver.poll(timeout):
+                return float('inf')
+            result = receiver.recv()
+        finally:
+            process.terminate()
+            process.join()
+            receiver.close()
+
+        if isinstance(result, Exception):
+            raise result
+        best = min(best, result)
+    return best
+
+
+def calibrate(results: List[Tuple[Tuple[int, int, int, int], Dict[str, float]]],
+              *,
+              tolerance: float = 1.5,
+              ) -> List[EngineRule]:
+    """Make a rule table from the shape of each problem and the time taken by
+    each engine.
+
+    An engine is good enough for a problem if it is within ``tolerance``
+    times the fastest. Rules are chosen greedily: each is the rule, with the
+    shape of a problem as its limits, whose engine is good enough for the
+    most problems it matches and for all of them. Limits that exclude none
+    of the problems left are dropped. The engine that is good enough for the
+    most problems that are left is the fallback.
+    """
+    remaining = [(problem_shape, times,
+                  {engine for engine, t in times.items() if t <= tolerance*min(times.values())})
+                 for problem_shape, times in results if min(times.values()) < float('inf')]
+
+    rules = []
+    while remaining:
+        # the most problems matched, then the least time taken on them
+        best = None
+        for corner, _, engines in remaining:
+            for engine in engines:
+                matched = [(times, good) for problem_shape, times, good in remaining
+                           if all(value <= limit for value, limit in zip(problem_shape, corner))]
+                if not all(engine in good for _, good in matched):
+                    continue
+                key = (-len(matched), sum(times[engine] for times, _ in matched))
+                if best is None or key < best[0]:
+                    best = key, engine, corner
+
+        if best is None or -best[0][0] == len(remaining):
+            break
+        _, engine, corner = best
+
+        largest = np.max([problem_shape for problem_shape, _, _ in remaining], axis=0)
+        rules.append(EngineRule(engine, *(None if limit >= most else limit
+                                          for limit, most in zip(corner, largest))))
+        remaining = [item for item in remaining
+                     if not all(value <= limit for value, limit in zip(item[0], corner))]
+
+    if remaining:
+        # good enough for the most, then the least time taken
+        fallback = min({engine for _, _, good in remaining for engine in good},
+                       key=lambda engine: (-sum(engine in good for _, _, good in remaining),
+                                           sum(times[engine] for _, times, _ in remaining)))
+    else:
+        fallback = 'lp'
+    rules.append(EngineRule(fallback))
+    return rules
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--timeout', type=float, default=60,
+                        help="seconds before a configuration is abandoned")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="the best of this many runs is reported")
+    args = parser.parse_args(argv)
+
+    names = [f'{engine}/{backend}' if backend else engine for engine, backend in CONFIGURATIONS]
+    print(f"{'problem':<14} {'shape':<16} " + ' '.join(f'{name:>12}' for name in names) + "   auto")
+
+    results = []
+    for name, graph, samples in problems():
+        times = [time_configuration(graph, samples, engine, backend,
+                                    timeout=args.timeout, repeat=args.repeat)
+                 for engine, backend in CONFIGURATIONS]
+        problem_shape = shape(graph, samples)
+
+        # the rules only pick the engine, so take the best of its backends
+        engine_times: Dict[str, float] = dict()
+        for (engine, _), t in zip(CONFIGURATIONS, times):
+            engine_times[engine] = min(t, engine_times.get(engine, t))
+        results.append((problem_shape, engine_times))
+
+        print(f"{name:<14} {str(problem_shape):<16} " + ' '.join(f'{t:>12.4f}' for t in times)
+              + f"   {select_engine(*problem_shape)}")
+
+    print()
+    print("ENGINE_RULES = [")
+    for rule in calibrate(results):
+        print(f"    {rule!r},")
+    print("]")
+
+
+if __name__ == '__main__':
+    main()
@@ -21,7 +21,7 @@ import struct
 import tempfile
 import threading
 
-from typing import Dict, Iterator, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+from typing import Dict, Iterable, Iterator, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
 
 import dimod
 import homebase
@@ -409,28 +409,13 @@ class PenaltyModelCache(contextlib.AbstractContextManager):
         for bqm_data in self.conn.execute("SELECT bqm_data FROM binary_quadratic_model;"):
             yield self.decode_bqm(bqm_data)
 
-    def insert_penalty_model(
+    def encode_penalty_model(
             self,
             bqm: dimod.BinaryQuadraticModel,
             samples_like,
             classical_gap: float,
-            ):
-        """Insert a penalty model into the database.
-
-        Args:
-            bqm: A binary quadratic model.
-
-            samples_like: Samples to add to the database.
-                'samples_like' is an extension of NumPy's array_like_.
-                See :func:`dimod.as_samples`.
-
-            classical_gap: The classical gap. This is not checked for
-                correctness.
-
-        .. _array_like: https://numpy.org/doc/stable/user/basics.creation.html
-
-        """
-
+            ) -> Dict[str, Union[int, float, str, bytes]]:
+        """Encode a penalty model to be stored in the cache."""
         samples, decision = samples_like = dimod.as_samples(samples_like)
 
         # do some input checking
@@ -444,7 +429,8 @@ class PenaltyModelCache(contextlib.AbstractContextManager):
             mapping = {v: i for i, v in enumerate(decision)}
             mapping.update((v, i) for i, v in enumerate(bqm.variables ^ decision, len(mapping)))
 
-            return self.insert_penalty_model(bqm.relabel_variables(mapping, inplace=False), samples, classical_gap)
+            return self.encode_penalty_model(bqm.relabel_variables(mapping, inplace=False),
+                                             samples, classical_gap)
 
         parameters = self.encode_graph(bqm)
         parameters.update(self.encode_bqm(bqm))
@@ -453,12 +439,53 @@ class PenaltyModelCache(contextlib.AbstractContextManager):
             decision_variables=json.dumps(decision, separators=(',', ':')),
             classical_gap=classical_gap,
             )
+        return parameters
+
+    def insert_penalty_model(
+            self,
+            bqm: dimod.BinaryQuadraticModel,
+            samples_like,
+            classical_gap: float,
+            ):
+        """Insert a penalty model into the database.
+
+        Args:
+            bqm: A binary quadratic model.
+
+            samples_like: Samples to add to the database.
+                'samples_like' is an extension of NumPy's array_like_.
+                See :func:`dimod.as_samples`.
+
+            classical_gap: The classical gap. This is not checked for
+                correctness.
+
+        .. _array_like: https://numpy.org/doc/stable/user/basics.creation.html
+
+        """
+        self.insert_penalty_models([(bqm, samples_like, classical_gap)])
+
+    def insert_penalty_models(
+            self,
+            penalty_models: Iterable[Tuple[dimod.BinaryQuadraticModel, object, float]],
+            ):
+        """Insert several penalty models into the database in one transaction.
+
+        Args:
+            penalty_models: An iterable of 3-tuples of the form
+                ``(bqm, samples_like, classical_gap)``. See
+                :meth:`.insert_penalty_model`.
+
+        """
+        # encode everything first so that a bad penalty model does not leave
+        # us with a partial transaction
+        encoded = [self.encode_penalty_model(*pm) for pm in penalty_models]
 
         with self.conn as cur:
-            cur.execute(self.insert_graph_statement, parameters)
-            cur.execute(self.insert_bqm_statement, parameters)
-            cur.execute(self.insert_sampleset_statement, parameters)
-            cur.execute(self.insert_penalty_model_statement, parameters)
+            for parameters in encoded:
+                cur.execute(self.insert_graph_statement, parameters)
+                cur.execute(self.insert_bqm_statement, parameters)
+                cur.execute(self.insert_sampleset_statement, parameters)
+                cur.execute(self.insert_penalty_model_statement, parameters)
 
     def iter_penalty_models(self) -> Iterator[PenaltyModel]:
         """Iterate over all of the penalty models in the database."""
@@ -28,3 +28,11 @@ class ImpossiblePenaltyModel(FactoryException):
 
 class MissingPenaltyModel(FactoryException):
     """PenaltyModel is missing from the cache or otherwise unavailable."""
+
+
+class PenaltyModelTimeout(FactoryException, TimeoutError):
+    """PenaltyModel generation ran out of time."""
+
+
+class SuboptimalPenaltyModelWarning(UserWarning):
+    """PenaltyModel generation ran out of time before maximizing the classical gap."""
@@ -14,17 +14,38 @@
 
 """The module is considered internal."""
 
-from collections import OrderedDict
-from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+import concurrent.futures
+import functools
+import itertools
+import multiprocessing
+import multiprocessing.shared_memory
+import multiprocessing.synchronize
+import os
+import tempfile
+import threading
+import time
+import warnings
+
+from collections import OrderedDict, defaultdict
+from typing import (Callable, Dict, FrozenSet, Hashable, Iterable, List, Mapping, NamedTuple,
+                    Optional, Sequence, Set, Tuple, Union)
 
 import dimod
 import networkx as nx
+import networkx.algorithms.approximation
 import numpy as np
 import scipy.optimize
+import scipy.sparse
+
+try:
+    import highspy
+except ImportError:
+    highspy = None
 
 from dimod.typing import GraphLike, Variable
 
-from penaltymodel.exceptions import ImpossiblePenaltyModel
+from penaltymodel.exceptions import (ImpossiblePenaltyModel, PenaltyModelTimeout,
+                                     SuboptimalPenaltyModelWarning)
 from penaltymodel.utils import as_graph
 
 __all__ = []
@@ -72,11 +93,24 @@ class Index:
                     linear_bound: Tuple[float, float],
                     quadratic_bound: Tuple[float, float],
                     ) -> Sequence[Tuple[Optional[float], Optional[float]]]:
-        bounds = [(min_classical_gap, None), (None, None)]
+        bounds: List[Tuple[Optional[float], Optional[float]]] = [(min_classical_gap, None),
+                                                                 (None, None)]
         bounds.extend(linear_bound for _ in range(self.num_variables()))
         bounds.extend(quadratic_bound for _ in range(len(bounds), len(self)))
         return bounds
 
+    def max_gap(self,
+                linear_bound: Tuple[float, float],
+                quadratic_bound: Tuple[float, float],
+                ) -> float:
+        """An upper bound on any finite classical gap.
+
+        The gap is at most the largest energy difference between two states,
+        which the bounds on the biases limit.
+        """
+        return 2*(self.num_variables()*max(map(abs, linear_bound))
+                  + len(self._interactions)*max(map(abs, quadratic_bound)))
+
     @staticmethod
     def offset() -> int:
         return 1
@@ -94,183 +128,2975 @@ class Index:
         return range(2, 2 + self.num_variables())
 
 
-def all_possible(num_variables: int) -> np.ndarray:
-    """Create an array of all possible spin configurations."""
-    assert 0 <= num_variables < 1 << 8
-    a = np.unpackbits(np.arange(1 << num_variables, dtype=np.uint8).reshape(1 << num_variables, 1),
-                      axis=1, count=num_variables, bitorder='little').astype(np.int8)
+CHUNKSIZE = 1 << 16
+"""The number of rows of the constraint matrix processed at a time."""
+
+
+def all_possible(num_variables: int, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+    """Create an array of all possible spin configurations.
+
+    Row ``i`` is the configuration with state code ``start + i``, where bit
+    ``k`` of the state code is set if variable ``k`` is +1.
+    Only the configurations with state codes in ``[start, stop)`` are
+    created. ``stop`` defaults to ``1 << num_variables``.
+    """
+    if stop is None:
+        stop = 1 << num_variables
+    return code_spins(np.arange(start, stop, dtype=np.int64), num_variables)
+
+
+def code_spins(codes: np.ndarray, num_variables: int) -> np.ndarray:
+    """Get the spins of an array of state codes, with a new last axis over
+    the variables.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    a = ((codes[..., np.newaxis] >> np.arange(num_variables, dtype=np.int64)) & 1).astype(np.int8)
     a *= 2
     a -= 1
     return a
 
 
-def next_auxiliary(state: Tuple[int, ...]) -> Tuple[int, ...]:
-    s = list(state)
-    for i in range(len(s)-1, -1, -1):
-        if s[i] <= 0:
-            s[i] = 1
-            break
+def constraint_matrix(indexer: Index,
+                      interactions: Iterable[Tuple[Variable, Variable]],
+                      *,
+                      out: Optional[np.ndarray] = None,
+                      chunksize: int = CHUNKSIZE,
+                      ) -> np.ndarray:
+    """Create the LP constraint matrix, one row per state code.
+
+    The matrix is built ``chunksize`` rows at a time so that no temporary
+    array is larger than a chunk. ``out``, e.g. a :class:`numpy.memmap`, can
+    be given to control where it is stored.
+
+    The gap column is left as 0.
+    """
+    num_variables = indexer.num_variables()
+    num_rows = 1 << num_variables
+
+    if out is None:
+        out = np.empty((num_rows, len(indexer)), dtype=np.int8)
+
+    interactions = [(indexer.interaction(u, v), indexer.variable(u), indexer.variable(v))
+                    for u, v in interactions]
+
+    for start in range(0, num_rows, chunksize):
+        A = out[start:start+chunksize]
+        A[:, indexer.gap()] = 0
+        A[:, indexer.offset()] = 1
+        A[:, indexer.variables()] = all_possible(num_variables, start, start + len(A))
+        for uv, u, v in interactions:
+            np.multiply(A[:, u], A[:, v], out=A[:, uv])
+
+    return out
+
+
+def extend_constraint_matrix(A: np.ndarray,
+                             indexer: Index,
+                             decision: Sequence[Variable],
+                             auxiliary: Sequence[Variable],
+                             interactions: Sequence[Tuple[Variable, Variable]],
+                             *,
+                             chunksize: int = CHUNKSIZE,
+                             ) -> Tuple[np.ndarray, Index]:
+    """Create the LP constraint matrix for another auxiliary variable from
+    the one without it.
+
+    ``A`` and ``indexer`` are for ``decision``, all but the last of
+    ``auxiliary`` and the interactions that do not involve the last auxiliary
+    variable. The new variable is the highest bit of the state codes, so the
+    first half of the rows are those of ``A`` with it -1 and the second half
+    are a copy with it +1. Only the columns of its interactions are computed.
+
+    The gap column is left as 0.
+
+    Returns:
+        The new constraint matrix and its :class:`Index`.
+
+    """
+    v = auxiliary[-1]
+    extended = Index(decision, auxiliary, interactions)
+
+    old_columns = [indexer.gap(), indexer.offset()]
+    old_columns.extend(map(indexer.variable, itertools.chain(decision, auxiliary[:-1])))
+    new_columns = [extended.gap(), extended.offset()]
+    new_columns.extend(map(extended.variable, itertools.chain(decision, auxiliary[:-1])))
+    products = []
+    for u, w in interactions:
+        if v == u or v == w:
+            products.append((extended.interaction(u, w), extended.variable(w if v == u else u)))
         else:
-            s[i] = -1
-    return tuple(s)
+            old_columns.append(indexer.interaction(u, w))
+            new_columns.append(extended.interaction(u, w))
 
+    half = A.shape[0]
+    out = np.empty((2*half, len(extended)), dtype=np.int8)
+    for start in range(0, half, chunksize):
+        stop = min(start + chunksize, half)
+        out[start:stop, new_columns] = A[start:stop, old_columns]
+    out[half:] = out[:half]
 
-def generate(graph_like: GraphLike,
-             samples_like,
-             *,
-             linear_bound: Tuple[float, float] = (-2, 2),
-             quadratic_bound: Tuple[float, float] = (-1, 1),
-             min_classical_gap: float = 2,
-             ) -> Tuple[dimod.BinaryQuadraticModel, float, Dict[Tuple[int, ...], Tuple[int, ...]]]:
-    """Generate a penalty model.
+    column = extended.variable(v)
+    out[:half, column] = -1
+    out[half:, column] = +1
+    for uv, u in products:
+        np.multiply(out[:, u], out[:, column], out=out[:, uv])
+
+    return out, extended
+
+
+class GapColumnMatrix:
+    """A read-only constraint matrix with the gap column of a table, which is
+    only set on the rows as they are indexed.
+
+    The matrix itself does not depend on the table, so it can be shared, e.g.
+    by :class:`ConstraintMatrixCache` or :class:`SharedConstraintMatrices`,
+    without each table needing its own copy.
+
+    It supports the indexing that a :class:`LinearProgram`, the
+    :class:`AuxiliarySearch` and :func:`solve_milp` use: a row, a slice or an
+    array of rows. The rows returned are new arrays.
+
+    Args:
+        A: The constraint matrix, its gap column is ignored.
+        gap_column: The gap column of each decision state code, it repeats
+            for every auxiliary state.
 
-    This function is considered internal, it is recommended to use
-    :func:`~penaltymodel.get_penalty_model` with ``use_cache=False`` instead.
     """
-    graph = as_graph(graph_like)
-    samples, decision = dimod.as_samples(samples_like)
+    dtype = np.dtype(np.int8)
+    ndim = 2
 
-    if any(v not in graph.nodes for v in decision):
-        raise ValueError("the decision variables must be a subset of the graph nodes")
+    def __init__(self, A: np.ndarray, gap_column: np.ndarray):
+        self.A = A
+        self.gap_column = np.asarray(gap_column, dtype=np.int8)
+        self.shape = A.shape
 
-    # let's make things easier for ourselves by casting the samples into -1, +1
-    if (samples == 0).any():
-        samples = 2*samples - 1
-    if not ((samples == +1) ^ (samples == -1)).all():
-        raise ValueError("given samples should be 0/1 or -1/+1")
+    def __len__(self) -> int:
+        return self.shape[0]
 
-    auxiliaries = list(graph.nodes - decision)
-    num_samples = samples.shape[0]
-    num_variables = len(graph.nodes)
-    num_auxiliary = num_variables - len(decision)
+    def __getitem__(self, rows) -> np.ndarray:
+        if isinstance(rows, slice):
+            rows = np.arange(*rows.indices(len(self)), dtype=np.int64)
+        elif isinstance(rows, np.ndarray) and rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        codes = np.asarray(rows, dtype=np.int64)
 
-    if isinstance(samples_like, dimod.SampleSet):
-        energies = samples_like.record.energy
-    else:
-        energies = np.zeros(num_samples)
+        A = self._rows(codes)
+        A[..., Index.gap()] = self.gap_column[codes % len(self.gap_column)]
+        return A
 
-    # construct the table
-    if len(energies):
-        table = {tuple(map(int, state)): energy for state, energy in zip(samples, energies)}
-    else:
-        table = {}
+    def _rows(self, codes: np.ndarray) -> np.ndarray:
+        # indexing with an array always copies
+        return self.A[codes.ravel()].reshape(codes.shape + (self.shape[1],))
 
-    # todo: more correctness checks, max variables==8
 
-    # some edge cases we can easily eliminate
-    if not table or not decision:
-        bqm = dimod.BinaryQuadraticModel('SPIN')
-        bqm.add_linear_from((v, 0) for v in graph.nodes)
-        bqm.add_quadratic_from((u, v, 0) for u, v in graph.edges)
-        return bqm, float('inf'), {}
+class ImplicitConstraintMatrix(GapColumnMatrix):
+    """A :class:`GapColumnMatrix` whose rows are built when they are indexed,
+    rather than looked up.
 
-    # create an object to track the columns in the LP matrix
+    Rows never checked are never built, so with a
+    :attr:`LinearProgram.separate` the matrix can have many more rows than
+    would fit in memory.
 
-    indexer = Index(decision, auxiliaries, graph.edges)
+    Args:
+        indexer: The columns.
+        interactions: The interactions, in the order of their columns.
+        gap_column: The gap column of each decision state code, it repeats
+            for every auxiliary state.
 
-    # we'll use this to track where the ground states are. Note that we could
-    # avoiding needing to store this in memory with some clever indexing, but
-    # let's not worry too much about that unless it becomes a problem later
-    ground: Dict[Tuple[int, ...], Dict[Tuple[int, ...], int]] = dict()
+    """
+    def __init__(self,
+                 indexer: Index,
+                 interactions: Iterable[Tuple[Variable, Variable]],
+                 gap_column: np.ndarray,
+                 ):
+        self.indexer = indexer
+        self.gap_column = np.asarray(gap_column, dtype=np.int8)
+        self.shape = (1 << indexer.num_variables(), len(indexer))
 
-    # ok, let's build our matrices for the LP
+        self._interactions = [(indexer.interaction(u, v), indexer.variable(u), indexer.variable(v))
+                              for u, v in interactions]
 
-    b = np.full(1 << num_variables, max(table.values(), default=0), dtype=float)
+    def _rows(self, codes: np.ndarray) -> np.ndarray:
+        indexer = self.indexer
+        A = np.empty(codes.shape + (self.shape[1],), dtype=np.int8)
+        A[..., indexer.offset()] = 1
+        A[..., indexer.variables()] = code_spins(codes, indexer.num_variables())
+        for uv, u, v in self._interactions:
+            np.multiply(A[..., u], A[..., v], out=A[..., uv])
+        return A
 
-    A = np.empty((1 << len(graph), len(indexer)), dtype=np.int8)
-    A[:, indexer.variables()] = all_possible(num_variables)
-    for u, v in graph.edges:
-        A[:, indexer.interaction(u, v)] = A[:, indexer.variable(u)] * A[:, indexer.variable(v)]
-    A[:, indexer.offset()] = 1
 
-    # the gap and b are how we distinguish between values in the table and
-    # not
-    for i in range(1 << num_variables):
-        decision_state = tuple(A[i, indexer.decisions()])
+class TiledVector:
+    """A read-only vector of ``values`` repeated to ``length``, like
+    :func:`numpy.tile`, whose entries are only looked up when they are
+    indexed.
+    """
+    def __init__(self, values: np.ndarray, length: int):
+        self.values = np.asarray(values)
+        self.dtype = self.values.dtype
+        self.shape = (length,)
 
-        if decision_state in table:
-            A[i, indexer.gap()] = 0
-            b[i] = table[decision_state]
-            ground.setdefault(decision_state, {})[tuple(A[i, indexer.auxiliaries()])] = i
-        else:
-            A[i, indexer.gap()] = -1
+    def __len__(self) -> int:
+        return self.shape[0]
 
-    # for now we're just trying to find feasibility, we'll optimize at the end
-    c = np.zeros(len(indexer))
+    def __getitem__(self, rows) -> np.ndarray:
+        if isinstance(rows, slice):
+            rows = np.arange(*rows.indices(len(self)), dtype=np.int64)
+        elif isinstance(rows, np.ndarray) and rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        return self.values[np.asarray(rows, dtype=np.int64) % len(self.values)]
 
-    # bounds are fixed
-    bounds = indexer.make_bounds(min_classical_gap, linear_bound, quadratic_bound)
 
-    # ok, we have everything in hand to start solving!
-    upper_bound = list(range(A.shape[0]))
-    equality: List[int] = []
-    auxiliary_configurations: Dict[Tuple[int, ...], Tuple[int, ...]] = OrderedDict()
+class ConstraintMatrixCache:
+    """A bounded, thread-safe, least recently used cache of constraint
+    matrices.
 
-    # WLOG, we can fix one right away
-    decision_state = next(state for state in ground if state not in auxiliary_configurations)
-    auxiliary_configurations[decision_state] = auxiliary_state = (-1,)*num_auxiliary
-    i = ground[decision_state][auxiliary_state]
-    upper_bound.remove(i)
-    equality.append(i)
+    The constraint matrix and :class:`Index` only depend on the decision
+    variables, the auxiliary variables and the interactions, in order, so
+    they can be shared between tables. The cached matrices are read-only,
+    wrap them in a :class:`GapColumnMatrix` to set the gap column.
 
-    while True:
-        A_eq = A[equality, :]
-        b_eq = b[equality]
-        A_ub = -A[upper_bound, :]  # negate because we want A_ub <= b_ub
-        b_ub = -b[upper_bound]
+    The cache used by :func:`generate` is returned by
+    :func:`constraint_matrix_cache`.
 
-        res = scipy.optimize.linprog(c, A_ub, b_ub, A_eq, b_eq, bounds=bounds, method='highs')
+    Args:
+        maxsize: The maximum number of matrices kept.
+        max_bytes: The maximum total size of the matrices kept. Matrices
+            that do not own their memory, such as those in shared memory,
+            do not count toward it.
 
-        if res.success:
-            if len(auxiliary_configurations) == len(table):
-                break
-
-            # fix a new state
-            decision_state = next(state for state in ground if state not in auxiliary_configurations)
-            auxiliary_configurations[decision_state] = auxiliary_state = (-1,)*num_auxiliary
-            i = ground[decision_state][auxiliary_state]
-            upper_bound.remove(i)
-            equality.append(i)
-        else:
-            # ok, we didn't succeed. So first try changing the aux state of the
-            # last set
+    """
+    def __init__(self, maxsize: int = 32, max_bytes: int = 1 << 28):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._cache: Dict[Hashable, Tuple[np.ndarray, Index]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    @property
+    def nbytes(self) -> int:
+        """The total size of the matrices kept that counts toward
+        ``max_bytes``.
+        """
+        return self._nbytes
+
+    @staticmethod
+    def _size(A: np.ndarray) -> int:
+        return A.nbytes if A.flags.owndata else 0
+
+    def clear(self):
+        """Drop all of the matrices."""
+        with self._lock:
+            self._cache.clear()
+            self._nbytes = 0
+
+    def resize(self, maxsize: Optional[int] = None, max_bytes: Optional[int] = None):
+        """Change the limits, dropping the least recently used matrices
+        until the cache is within them.
+        """
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def lookup(self,
+               decision: Sequence[Variable],
+               auxiliary: Sequence[Variable],
+               interactions: Sequence[Tuple[Variable, Variable]],
+               ) -> Optional[Tuple[np.ndarray, Index]]:
+        """Get the constraint matrix and its :class:`Index` if they are
+        cached, without building them or counting a hit or miss.
+        """
+        key = (tuple(decision), tuple(auxiliary), tuple(map(tuple, interactions)))
+        with self._lock:
+            return self._cache.get(key)
+
+    def _evict(self):
+        # the lock must be held
+        while self._cache and (len(self._cache) > self.maxsize or self._nbytes > self.max_bytes):
+            A, _ = self._cache.popitem(last=False)[1]
+            self._nbytes -= self._size(A)
+
+    def get(self,
+            decision: Sequence[Variable],
+            auxiliary: Sequence[Variable],
+            interactions: Sequence[Tuple[Variable, Variable]],
+            ) -> Tuple[np.ndarray, Index]:
+        """Get the constraint matrix and its :class:`Index`, building them if
+        they are not cached.
+        """
+        key = (tuple(decision), tuple(auxiliary), tuple(map(tuple, interactions)))
+
+        with self._lock:
             try:
-                decision_state, auxiliary_state = auxiliary_configurations.popitem()
-                upper_bound.append(equality.pop())  # put it back into inequality
-                while all(s == 1 for s in auxiliary_state):
-                    decision_state, auxiliary_state = auxiliary_configurations.popitem()
-                    upper_bound.append(equality.pop())  # put it back into inequality
+                value = self._cache[key]
             except KeyError:
-                raise ImpossiblePenaltyModel("There is no BQM that can encode the given constraint") from None
-
-            # iterate the auxiliary state
-            auxiliary_configurations[decision_state] = auxiliary_state = next_auxiliary(auxiliary_state)
-            i = ground[decision_state][auxiliary_state]
-            upper_bound.remove(i)
-            equality.append(i)
-
-    assert res.success
-
-    # having found something feasible, let's do one last run, this time optimizing the gap
-    c[indexer.gap()] = -1
-    res_opt = scipy.optimize.linprog(c, A_ub, b_ub, A_eq, b_eq, bounds=bounds, method='highs')
-    if res_opt.success:
-        res = res_opt
-        gap = res.x[indexer.gap()]
-    elif res_opt.status == 3:
-        # error code 3 is unbounded objective, which can happen for a fully
-        # specified problem
-        gap = float('inf')
-    else:
-        raise RuntimeError("something went wrong")
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return value
 
-    # let's make the BQM!
-    bqm = dimod.BinaryQuadraticModel('SPIN')
-    bqm.add_linear_from((v, res.x[indexer.variable(v)]) for v in graph.nodes)
-    bqm.add_quadratic_from((u, v, res.x[indexer.interaction(u, v)]) for u, v in graph.edges)
-    bqm.offset = res.x[indexer.offset()]
+        # build outside of the lock, other threads might build it too but
+        # that is harmless
+        indexer = Index(decision, auxiliary, interactions)
+        A = constraint_matrix(indexer, interactions)
+        A.flags.writeable = False
 
-    # return which auxiliary variables are which
-    aux = dict((state, dict(zip(auxiliaries, aux))) for state, aux in auxiliary_configurations.items())
+        if self._size(A) <= self.max_bytes:
+            self.put(decision, auxiliary, interactions, A, indexer)
 
-    return bqm, gap, aux
+        return A, indexer
+
+    def put(self,
+            decision: Sequence[Variable],
+            auxiliary: Sequence[Variable],
+            interactions: Sequence[Tuple[Variable, Variable]],
+            A: np.ndarray,
+            indexer: Index,
+            ):
+        """Add a read-only constraint matrix and its :class:`Index`, then drop
+        the least recently used matrices until the cache is within its
+        limits.
+        """
+        key = (tuple(decision), tuple(auxiliary), tuple(map(tuple, interactions)))
+        with self._lock:
+            if key in self._cache:
+                self._nbytes -= self._size(self._cache[key][0])
+            self._cache[key] = A, indexer
+            self._cache.move_to_end(key)
+            self._nbytes += self._size(A)
+            self._evict()
+
+
+_constraint_matrices = ConstraintMatrixCache()
+
+
+def constraint_matrix_cache() -> ConstraintMatrixCache:
+    """Get the cache of constraint matrices used by :func:`generate` in this
+    process, for instance to :meth:`~ConstraintMatrixCache.clear` it or to
+    :meth:`~ConstraintMatrixCache.resize` it.
+    """
+    return _constraint_matrices
+
+
+class SharedMatrixHandle(NamedTuple):
+    """Identifies a constraint matrix in shared memory, see
+    :class:`SharedConstraintMatrices`.
+    """
+    name: str
+    decision: Tuple[Variable, ...]
+    auxiliary: Tuple[Variable, ...]
+    interactions: Tuple[Tuple[Variable, Variable], ...]
+
+
+class SharedConstraintMatrices:
+    """Constraint matrices built once in shared memory, for worker processes
+    to use without copies.
+
+    Pass :meth:`handles` to :func:`attach_constraint_matrices` in each
+    worker, e.g. as the initializer of a process pool. The workers must be
+    done before the matrices are closed, which unlinks the shared memory.
+    """
+    def __init__(self):
+        self._blocks: Dict[SharedMatrixHandle, multiprocessing.shared_memory.SharedMemory] = dict()
+
+    def __enter__(self) -> 'SharedConstraintMatrices':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def close(self):
+        """Release the shared memory."""
+        while self._blocks:
+            _, block = self._blocks.popitem()
+            block.close()
+            block.unlink()
+
+    def handles(self) -> List[SharedMatrixHandle]:
+        return list(self._blocks)
+
+    def publish(self,
+                decision: Sequence[Variable],
+                auxiliary: Sequence[Variable],
+                interactions: Sequence[Tuple[Variable, Variable]],
+                ):
+        """Build a constraint matrix in shared memory, if it is not already."""
+        decision = tuple(decision)
+        auxiliary = tuple(auxiliary)
+        interactions = tuple(map(tuple, interactions))
+        if any(handle[1:] == (decision, auxiliary, interactions) for handle in self._blocks):
+            return
+
+        indexer = Index(decision, auxiliary, interactions)
+        shape = (1 << indexer.num_variables(), len(indexer))
+        block = multiprocessing.shared_memory.SharedMemory(create=True,
+                                                           size=max(shape[0]*shape[1], 1))
+        constraint_matrix(indexer, interactions,
+                          out=np.ndarray(shape, dtype=np.int8, buffer=block.buf))
+
+        self._blocks[SharedMatrixHandle(block.name, decision, auxiliary, interactions)] = block
+
+
+# the shared memory attached by attach_constraint_matrices(), kept open for
+# as long as the process uses the matrices
+_attached: Dict[str, multiprocessing.shared_memory.SharedMemory] = dict()
+_attached_lock = threading.Lock()
+
+
+def attach_constraint_matrices(handles: Iterable[SharedMatrixHandle]):
+    """Use constraint matrices in shared memory, see
+    :class:`SharedConstraintMatrices`.
+
+    The matrices are added, read-only, to the cache used by :func:`generate`
+    in this process.
+    """
+    for handle in handles:
+        with _attached_lock:
+            if handle.name in _attached:
+                # replacing the block would unmap matrices that are still in use
+                continue
+
+            # workers share the resource tracker of the parent process, so the
+            # memory is only unlinked by SharedConstraintMatrices.close()
+            block = multiprocessing.shared_memory.SharedMemory(handle.name)
+            _attached[handle.name] = block
+
+        indexer = Index(handle.decision, handle.auxiliary, handle.interactions)
+        shape = (1 << indexer.num_variables(), len(indexer))
+        A = np.ndarray(shape, dtype=np.int8, buffer=block.buf)
+        A.flags.writeable = False
+        _constraint_matrices.put(handle.decision, handle.auxiliary, handle.interactions, A, indexer)
+
+
+def matvec(A: np.ndarray,
+           x: np.ndarray,
+           *,
+           out: Optional[np.ndarray] = None,
+           chunksize: int = CHUNKSIZE,
+           ) -> np.ndarray:
+    """Calculate ``A @ x`` without converting all of ``A`` to float at once."""
+    if out is None:
+        out = np.empty(A.shape[0], dtype=float)
+    for start in range(0, A.shape[0], chunksize):
+        np.matmul(A[start:start+chunksize], x, out=out[start:start+chunksize])
+    return out
+
+
+def sparse_rows(A: np.ndarray,
+                rows: Optional[np.ndarray] = None,
+                *,
+                chunksize: int = CHUNKSIZE,
+                ) -> scipy.sparse.csr_matrix:
+    """Get rows of the constraint matrix, by default all of them, as a float
+    CSR matrix.
+
+    The nonzeros are found in the integer matrix a chunk at a time, so only
+    they are converted to float. Every state has a nonzero in each variable
+    and interaction column, so the zeros are those of the gap column.
+    """
+    if rows is None:
+        rows = np.arange(A.shape[0])
+    chunks = [scipy.sparse.csr_matrix(A[rows[start:start+chunksize]]).astype(float)
+              for start in range(0, max(len(rows), 1), chunksize)]
+    if len(chunks) == 1:
+        return chunks[0]
+    return scipy.sparse.vstack(chunks, format='csr')
+
+
+def state_codes(states: np.ndarray) -> np.ndarray:
+    """Get the state code of each row of a 2D array of spins.
+
+    Bit ``k`` of the state code is set if variable ``k`` is +1, see
+    :func:`all_possible`.
+    """
+    states = np.asarray(states)
+    weights = np.int64(1) << np.arange(states.shape[1], dtype=np.int64)
+    return (states > 0).astype(np.int64) @ weights
+
+
+def spins(code: int, num_variables: int) -> Tuple[int, ...]:
+    """Get the spins of a state code, the inverse of :func:`state_codes`."""
+    return tuple(+1 if code >> k & 1 else -1 for k in range(num_variables))
+
+
+def next_auxiliary(code: int) -> int:
+    """Get the auxiliary state code following ``code`` in reflected binary
+    Gray code order.
+
+    Consecutive states differ in exactly one variable. The sequence starts
+    at 0 (all -1) and ends at :func:`last_auxiliary`.
+    """
+    if bin(code).count('1') % 2:
+        # flip the variable after the first +1
+        return code ^ ((code & -code) << 1)
+    return code ^ 1
+
+
+def last_auxiliary(num_auxiliary: int) -> int:
+    """Get the final auxiliary state code in the order given by :func:`next_auxiliary`."""
+    if not num_auxiliary:
+        return 0
+    return 1 << (num_auxiliary - 1)
+
+
+class GenerationStats:
+    """Statistics collected while generating a penalty model.
+
+    Pass an instance to :func:`generate` or
+    :func:`~penaltymodel.get_penalty_model` to have it filled in.
+
+    Attributes:
+        num_solves: The number of linear programs solved. In lazy mode each
+            re-solve after adding rows counts.
+        num_backtracks: The number of conflicts the auxiliary search moved
+            on from.
+        matrix_time: Seconds spent building the constraint matrix.
+        solve_time: Seconds spent in the solver.
+        num_iterations: The total solver iteration count.
+        max_rows: The most constraint rows in any linear program solved.
+        unbounded_gap: Whether the gap is unbounded, so it was returned as
+            infinite. The linear program maximizing the gap is either
+            unbounded or, when the gap is capped, reaches the cap.
+        cache_hit: Whether :func:`~penaltymodel.get_penalty_model` found the
+            model in the cache, or None if the cache was not used.
+
+    """
+    def __init__(self):
+        self.num_solves = 0
+        self.num_backtracks = 0
+        self.matrix_time = 0.
+        self.solve_time = 0.
+        self.num_iterations = 0
+        self.max_rows = 0
+        self.unbounded_gap = False
+        self.cache_hit: Optional[bool] = None
+
+    def __repr__(self) -> str:
+        return '{}({})'.format(type(self).__name__,
+                               ', '.join(f'{key}={value!r}' for key, value in vars(self).items()))
+
+    def add(self, other: 'GenerationStats'):
+        """Add the statistics of another generation, e.g. of a worker."""
+        self.num_solves += other.num_solves
+        self.num_backtracks += other.num_backtracks
+        self.matrix_time += other.matrix_time
+        self.solve_time += other.solve_time
+        self.num_iterations += other.num_iterations
+        self.max_rows = max(self.max_rows, other.max_rows)
+        self.unbounded_gap |= other.unbounded_gap
+
+
+class LPResult(NamedTuple):
+    # status uses the codes of scipy.optimize.linprog. 0: optimal,
+    # 1: limit reached, 2: infeasible, 3: unbounded, 4: numerical difficulties
+    status: int
+    x: Optional[np.ndarray]
+    nit: int
+
+    @property
+    def success(self) -> bool:
+        return self.status == 0
+
+
+class LinearProgram:
+    """A sequence of linear programs over the rows of a constraint matrix.
+
+    Each row ``i`` of ``A`` is the constraint ``A[i] @ x >= b[i]`` or, once
+    fixed, ``A[i] @ x == b[i]``.
+
+    If ``lazy`` is true, inequality rows are only added to the linear program
+    once a solution violates them.
+    Subclasses implement the solver-specific methods.
+    """
+
+    max_cuts: int = 64
+    """The maximum number of violated rows added after each lazy solve."""
+
+    tolerance: float = 1e-9
+    """How much a row may be violated before it is added."""
+
+    deadline: Optional[float] = None
+    """The :func:`time.monotonic` time after which solving raises
+    :exc:`~penaltymodel.PenaltyModelTimeout`, or None for no limit."""
+
+    stats: Optional[GenerationStats] = None
+    """If given, the solves are recorded in it."""
+
+    separate: Optional[Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]] = None
+    """If given, in lazy mode it is called with a solution to get candidate
+    rows and their slacks, instead of checking every row. It must return
+    every row that is violated, or one no less violated than it, e.g.
+    :class:`TreeSeparator`."""
+
+    def __init__(self,
+                 A: np.ndarray,
+                 b: np.ndarray,
+                 bounds: Sequence[Tuple[Optional[float], Optional[float]]],
+                 *,
+                 lazy: bool = False,
+                 ):
+        self.A = A
+        self.b = b
+        self.bounds = bounds
+        self.lazy = lazy
+
+        self.is_fixed = np.zeros(len(b), dtype=bool)
+        self.is_active = np.zeros(len(b), dtype=bool) if lazy else np.ones(len(b), dtype=bool)
+
+        # reused by violated(), allocated there since with a separator it is
+        # not needed
+        self._slack: Optional[np.ndarray] = None
+
+    def activate(self, rows: Sequence[int]):
+        """Add the given rows to the linear program as inequality constraints."""
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[~self.is_active[rows]]
+        self._activate(rows)
+        self.is_active[rows] = True
+
+    def fix(self, i: int):
+        """Make row ``i`` an equality constraint."""
+        if not self.is_active[i]:
+            self.activate([i])
+        self._fix(i)
+        self.is_fixed[i] = True
+
+    def release(self, i: int):
+        """Make row ``i`` an inequality constraint again."""
+        self._release(i)
+        self.is_fixed[i] = False
+
+    def solve(self, c: np.ndarray) -> LPResult:
+        """Minimize ``c @ x`` subject to the current constraints.
+
+        In lazy mode, rows violated by the solution are added and the linear
+        program is re-solved until no row is violated.
+
+        Raises:
+            PenaltyModelTimeout: If the deadline passes.
+
+        """
+        while True:
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                raise PenaltyModelTimeout("ran out of time")
+
+            if self.stats is None:
+                res = self._solve(c)
+            else:
+                t = time.perf_counter()
+                res = self._solve(c)
+                self.stats.solve_time += time.perf_counter() - t
+                self.stats.num_solves += 1
+                self.stats.num_iterations += res.nit
+                self.stats.max_rows = max(self.stats.max_rows, int(self.is_active.sum()))
+
+            if res.status == 1 and self.deadline is not None:
+                raise PenaltyModelTimeout("ran out of time")
+
+            if not self.lazy or self.is_active.all():
+                return res
+
+            if res.status == 3 and self.separate is None:
+                # missing rows can make the objective look unbounded, so we
+                # need to check with everything, unless there are too many
+                # rows to, which is why there is a separator
+                self.activate(np.flatnonzero(~self.is_active))
+                continue
+
+            if not res.success:
+                # a relaxation is infeasible so the full problem is too
+                return res
+
+            rows = self.violated(res.x)
+            if not len(rows):
+                return res
+            self.activate(rows)
+
+    def violated(self, x: np.ndarray) -> np.ndarray:
+        """Get the most violated inactive rows for the solution ``x``."""
+        if self.separate is None:
+            if self._slack is None:
+                self._slack = np.empty(len(self.b), dtype=float)
+            slack = matvec(self.A, x, out=self._slack)
+            slack -= self.b
+            slack[self.is_active] = 0
+
+            rows = np.flatnonzero(slack < -self.tolerance)
+            slack = slack[rows]
+        else:
+            rows, slack = self.separate(x)
+            violated = (slack < -self.tolerance) & ~self.is_active[rows]
+            rows, slack = rows[violated], slack[violated]
+
+        if len(rows) > self.max_cuts:
+            rows = rows[np.argpartition(slack, self.max_cuts)[:self.max_cuts]]
+        return rows
+
+    def certificate(self) -> Optional[np.ndarray]:
+        """Get the fixed rows used by a certificate of infeasibility of the
+        last linear program solved, if the solver provides one.
+        """
+        return None
+
+    def time_remaining(self) -> Optional[float]:
+        """Get the seconds left before the deadline, if there is one."""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def _activate(self, rows: np.ndarray):
+        pass
+
+    def _fix(self, i: int):
+        pass
+
+    def _release(self, i: int):
+        pass
+
+    def _solve(self, c: np.ndarray) -> LPResult:
+        raise NotImplementedError
+
+
+class LinprogSession(LinearProgram):
+    """Solve each linear program from scratch with
+    :func:`scipy.optimize.linprog`.
+
+    The active rows are kept as a prefix of a float buffer of inequalities,
+    and the fixed rows as a prefix of another buffer of equalities, so the
+    solver is passed views rather than fresh copies. Without ``lazy`` every
+    row is active and the inequalities are allocated up front, otherwise they
+    grow as rows are activated. Fixed rows stay in the inequalities, where
+    they are redundant.
+
+    ``method`` is passed to :func:`scipy.optimize.linprog`.
+    """
+    def __init__(self,
+                 A: np.ndarray,
+                 b: np.ndarray,
+                 bounds: Sequence[Tuple[Optional[float], Optional[float]]],
+                 *,
+                 lazy: bool = False,
+                 method: str = 'highs',
+                 ):
+        super().__init__(A, b, bounds, lazy=lazy)
+        self.method = method
+
+        num_rows, num_columns = A.shape
+
+        # negate once, because linprog wants A_ub @ x <= b_ub
+        if lazy:
+            self.A_ub = np.empty((16, num_columns), dtype=float)
+            self.b_ub = np.empty(16, dtype=float)
+            self.num_ub = 0
+        else:
+            self.A_ub = np.empty((num_rows, num_columns), dtype=float)
+            for start in range(0, num_rows, CHUNKSIZE):
+                np.negative(A[start:start+CHUNKSIZE], out=self.A_ub[start:start+CHUNKSIZE])
+            self.b_ub = np.negative(b, dtype=float)
+            self.num_ub = num_rows
+
+        # grown as needed, usually there are few fixed rows
+        self.A_eq = np.empty((16, num_columns), dtype=float)
+        self.b_eq = np.empty(16, dtype=float)
+        self.num_eq = 0
+        self.eq_rows = np.empty(num_rows, dtype=np.int64)
+        self.eq_position = np.empty(num_rows, dtype=np.int64)
+
+    def _activate(self, rows: np.ndarray):
+        # only called in lazy mode, so append to the inequalities
+        start = self.num_ub
+        stop = start + len(rows)
+        if stop > len(self.b_ub):
+            size = max(stop, 2*len(self.b_ub))
+            self.A_ub = np.concatenate(
+                (self.A_ub, np.empty((size - len(self.b_ub), self.A_ub.shape[1]))))
+            self.b_ub = np.concatenate((self.b_ub, np.empty(size - len(self.b_ub))))
+        np.negative(self.A[rows], out=self.A_ub[start:stop])
+        np.negative(self.b[rows], out=self.b_ub[start:stop])
+        self.num_ub = stop
+
+    def _fix(self, i: int):
+        if self.num_eq == len(self.b_eq):
+            self.A_eq = np.concatenate((self.A_eq, np.empty_like(self.A_eq)))
+            self.b_eq = np.concatenate((self.b_eq, np.empty_like(self.b_eq)))
+        self.A_eq[self.num_eq] = self.A[i]
+        self.b_eq[self.num_eq] = self.b[i]
+        self.eq_rows[self.num_eq] = i
+        self.eq_position[i] = self.num_eq
+        self.num_eq += 1
+
+    def _release(self, i: int):
+        # move the last equality into its place
+        self.num_eq -= 1
+        p = self.eq_position[i]
+        if p != self.num_eq:
+            j = self.eq_rows[self.num_eq]
+            self.A_eq[p] = self.A_eq[self.num_eq]
+            self.b_eq[p] = self.b_eq[self.num_eq]
+            self.eq_rows[p] = j
+            self.eq_position[j] = p
+
+    def _solve(self, c: np.ndarray) -> LPResult:
+        num_ub = self.num_ub
+        num_eq = self.num_eq
+
+        res = scipy.optimize.linprog(
+            c,
+            self.A_ub[:num_ub] if num_ub else None, self.b_ub[:num_ub] if num_ub else None,
+            self.A_eq[:num_eq] if num_eq else None, self.b_eq[:num_eq] if num_eq else None,
+            bounds=self.bounds, method=self.method,
+            options=None if self.deadline is None else dict(time_limit=self.time_remaining()))
+
+        return LPResult(res.status, res.x, res.nit)
+
+
+class HighsSession(LinearProgram):
+    """Solve all of the linear programs with a single persistent
+    :class:`highspy.Highs` model.
+
+    Fixing or releasing a row only changes the bounds of that row, so each
+    solve is warm-started from the basis of the previous one.
+
+    ``solver`` is the HiGHS ``solver`` option, e.g. ``'simplex'`` or
+    ``'ipm'``. The interior point method is not warm-started and does not
+    provide certificates of infeasibility.
+    """
+    def __init__(self,
+                 A: np.ndarray,
+                 b: np.ndarray,
+                 bounds: Sequence[Tuple[Optional[float], Optional[float]]],
+                 *,
+                 lazy: bool = False,
+                 solver: str = 'simplex',
+                 ):
+        super().__init__(A, b, bounds, lazy=lazy)
+
+        # the HiGHS row of each row of A
+        self.row = np.full(len(b), -1, dtype=np.int32)
+
+        self.highs = h = highspy.Highs()
+        h.setOptionValue('output_flag', False)
+        h.setOptionValue('solver', solver)
+
+        inf = highspy.kHighsInf
+        h.addVars(len(bounds),
+                  np.array([-inf if lb is None else lb for lb, _ in bounds], dtype=float),
+                  np.array([+inf if ub is None else ub for _, ub in bounds], dtype=float))
+
+        if not lazy:
+            self._add_rows(np.arange(len(b)))
+
+    def _add_rows(self, rows: np.ndarray):
+        self.row[rows] = np.arange(len(rows)) + self.highs.getNumRow()
+
+        # add in chunks to limit the size of the float copies
+        for start in range(0, len(rows), CHUNKSIZE):
+            chunk = rows[start:start+CHUNKSIZE]
+            M = sparse_rows(self.A, chunk)
+            self.highs.addRows(len(chunk),
+                               np.asarray(self.b[chunk], dtype=float),
+                               np.full(len(chunk), highspy.kHighsInf),
+                               M.nnz, M.indptr.astype(np.int32), M.indices.astype(np.int32), M.data)
+
+    def _activate(self, rows: np.ndarray):
+        self._add_rows(rows)
+
+    def certificate(self) -> Optional[np.ndarray]:
+        # the rows with a nonzero multiplier in the Farkas dual ray
+        _, has_ray, ray = self.highs.getDualRay()
+        if not has_ray:
+            return None
+        fixed = np.flatnonzero(self.is_fixed)
+        ray = np.abs(np.asarray(ray)[self.row[fixed]])
+        return fixed[ray > 1e-9 * max(ray.max(initial=0), 1)]
+
+    def _fix(self, i: int):
+        self.highs.changeRowBounds(int(self.row[i]), self.b[i], self.b[i])
+
+    def _release(self, i: int):
+        self.highs.changeRowBounds(int(self.row[i]), self.b[i], highspy.kHighsInf)
+
+    def _solve(self, c: np.ndarray) -> LPResult:
+        h = self.highs
+        h.changeColsCost(len(c), np.arange(len(c), dtype=np.int32), np.asarray(c, dtype=float))
+
+        # the time limit is on the total run time of the model
+        remaining = self.time_remaining()
+        h.setOptionValue('time_limit',
+                         highspy.kHighsInf if remaining is None else h.getRunTime() + remaining)
+
+        h.run()
+
+        status = h.getModelStatus()
+        if status == highspy.HighsModelStatus.kUnboundedOrInfeasible:
+            # presolve cannot always tell which, so ask the simplex
+            h.setOptionValue('presolve', 'off')
+            h.run()
+            h.setOptionValue('presolve', 'choose')
+            status = h.getModelStatus()
+
+        nit = h.getInfo().simplex_iteration_count
+
+        if status == highspy.HighsModelStatus.kOptimal:
+            return LPResult(0, np.array(h.getSolution().col_value), nit)
+        elif status == highspy.HighsModelStatus.kInfeasible:
+            return LPResult(2, None, nit)
+        elif status == highspy.HighsModelStatus.kUnbounded:
+            return LPResult(3, None, nit)
+        elif status in (highspy.HighsModelStatus.kTimeLimit,
+                        highspy.HighsModelStatus.kIterationLimit):
+            return LPResult(1, None, nit)
+        else:
+            return LPResult(4, None, nit)
+
+
+BACKENDS: Dict[str, Callable[..., LinearProgram]] = dict()
+"""The linear programming backends by name, see :func:`register_backend`."""
+
+
+def register_backend(name: str, factory: Callable[..., LinearProgram]):
+    """Register a linear programming backend.
+
+    ``factory`` is called as ``factory(A, b, bounds, lazy=lazy)`` and
+    returns a :class:`LinearProgram`.
+    """
+    BACKENDS[name] = factory
+
+
+if highspy is not None:
+    register_backend('highs', functools.partial(HighsSession, solver='simplex'))
+    register_backend('highs-ipm', functools.partial(HighsSession, solver='ipm'))
+register_backend('linprog', functools.partial(LinprogSession, method='highs'))
+register_backend('linprog-ipm', functools.partial(LinprogSession, method='highs-ipm'))
+
+
+def linear_program(A: np.ndarray,
+                   b: np.ndarray,
+                   bounds: Sequence[Tuple[Optional[float], Optional[float]]],
+                   *,
+                   lazy: bool = False,
+                   backend: Optional[str] = None,
+                   ) -> LinearProgram:
+    """Create a solver session for the given constraints.
+
+    ``backend`` is the name of a registered backend, see :data:`BACKENDS`.
+    By default a persistent HiGHS model is used if :mod:`highspy` is
+    installed, otherwise each linear program is solved from scratch by
+    :func:`scipy.optimize.linprog`.
+    """
+    if backend is None:
+        backend = 'linprog' if highspy is None else 'highs'
+    try:
+        factory = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"unknown backend {backend!r}, "
+                         f"expected one of {sorted(BACKENDS)}") from None
+    return factory(A, b, bounds, lazy=lazy)
+
+
+def solve_milp(A: np.ndarray,
+               b: np.ndarray,
+               bounds: Sequence[Tuple[Optional[float], Optional[float]]],
+               ground: Sequence[int],
+               num_decision: int,
+               num_auxiliary: int,
+               *,
+               big_m: float,
+               fix_first: bool = False,
+               time_limit: Optional[float] = None,
+               chunksize: int = CHUNKSIZE,
+               ) -> Tuple[LPResult, Dict[int, int]]:
+    """Maximize the gap over every choice of auxiliary ground states with one
+    mixed-integer program.
+
+    Each feasible decision state gets a binary selector for each of its
+    auxiliary states, exactly one of which is set. The row of the selected
+    state is forced to equality by
+
+        A[row] @ x + big_m * z <= b[row] + big_m
+
+    so ``big_m`` must bound ``A[row] @ x - b[row]`` over the feasible rows.
+    The energies of two auxiliary states of a decision state differ only in
+    the biases that involve auxiliary variables, so their bounds give one.
+
+    If ``fix_first`` is true, the first decision state in ``ground`` selects
+    auxiliary state 0, which is without loss of generality when the
+    auxiliary variables can be flipped.
+
+    The selected rows only hold to within the solver's tolerances, so the
+    solution should be polished by a linear program with them fixed.
+
+    If ``time_limit`` seconds pass, the status is 1 and the result is the
+    best feasible solution found, if any.
+
+    Returns:
+        A 2-tuple of the result, with the gap maximized, and the selected
+        auxiliary state of each feasible decision state.
+
+    """
+    try:
+        from scipy.optimize import milp, Bounds, LinearConstraint
+    except ImportError:
+        raise RuntimeError("the 'milp' engine requires scipy>=1.9") from None
+
+    num_rows, num_columns = A.shape
+    num_completions = 1 << num_auxiliary
+    num_selectors = len(ground) * num_completions
+
+    # the row of each selector, in decision state major order
+    rows = (np.asarray(ground, dtype=np.int64)[:, np.newaxis]
+            | (np.arange(num_completions, dtype=np.int64) << num_decision)).ravel()
+
+    # A can be memory-mapped, so convert it a chunk at a time
+    A = sparse_rows(A, chunksize=chunksize)
+    constraints = scipy.sparse.vstack([
+        # every state is at or above its target energy
+        scipy.sparse.hstack([A, scipy.sparse.csr_matrix((num_rows, num_selectors))]),
+        # the selected states are at their target energy
+        scipy.sparse.hstack([A[rows], big_m*scipy.sparse.identity(num_selectors)]),
+        # one selected state for each decision state
+        scipy.sparse.hstack([scipy.sparse.csr_matrix((len(ground), num_columns)),
+                             scipy.sparse.kron(scipy.sparse.identity(len(ground)),
+                                               np.ones((1, num_completions)))]),
+        ], format='csr')
+    lb = np.concatenate((b, np.full(num_selectors, -np.inf), np.ones(len(ground))))
+    ub = np.concatenate((np.full(num_rows, np.inf), b[rows] + big_m, np.ones(len(ground))))
+
+    lower, upper = zip(*bounds)
+    lower = np.concatenate((np.array(lower, dtype=float), np.zeros(num_selectors)))
+    upper = np.concatenate((np.array(upper, dtype=float), np.ones(num_selectors)))
+    if fix_first:
+        lower[num_columns] = 1
+
+    c = np.zeros(num_columns + num_selectors)
+    c[Index.gap()] = -1
+
+    integrality = np.zeros(num_columns + num_selectors)
+    integrality[num_columns:] = 1
+
+    res = milp(c,
+               constraints=LinearConstraint(constraints, lb, ub),
+               bounds=Bounds(np.nan_to_num(lower, nan=-np.inf), np.nan_to_num(upper, nan=np.inf)),
+               integrality=integrality,
+               options=(dict(disp=False) if time_limit is None
+                        else dict(disp=False, time_limit=time_limit)))
+
+    # milp uses the same status codes as linprog, except 4 is "other"
+    if res.x is None:
+        return LPResult(res.status, None, 0), {}
+
+    selected = res.x[num_columns:].reshape(len(ground), num_completions).argmax(axis=1)
+    auxiliary_configurations = dict(zip(ground, selected.tolist()))
+
+    return LPResult(res.status, res.x[:num_columns], 0), auxiliary_configurations
+
+
+def elimination_order(graph: nx.Graph) -> Tuple[int, List[Variable]]:
+    """Get an order in which to eliminate the nodes of ``graph`` and its
+    width.
+
+    The order comes from a tree decomposition found by
+    :func:`networkx.algorithms.approximation.treewidth_min_fill_in`: the
+    nodes of a leaf bag that are not in its neighbour appear in no other bag,
+    so they are eliminated before the leaf is removed. When a node is
+    eliminated, at most ``width`` of its neighbours remain.
+    """
+    width, decomposition = nx.algorithms.approximation.treewidth_min_fill_in(graph)
+
+    order: List[Variable] = []
+    eliminated: Set[Variable] = set()
+    while decomposition:
+        bag = next(bag for bag in decomposition if decomposition.degree(bag) <= 1)
+        kept = next(iter(decomposition[bag]), frozenset())
+        # in graph order so that the order does not depend on hashing
+        order.extend(v for v in graph.nodes if v in bag and v not in kept and v not in eliminated)
+        eliminated.update(bag - kept)
+        decomposition.remove_node(bag)
+
+    return width, order
+
+
+class TreeSeparator:
+    """Find the most violated rows of the constraint matrix for a solution
+    by minimizing its energy with variable elimination, rather than by
+    evaluating every state.
+
+    The states are split into groups that each share a right-hand side:
+    every feasible decision state, whose lowest energy over the auxiliary
+    states must be its target energy or more, and the infeasible decision
+    states, whose lowest energy must be ``M + gap`` or more where ``M`` is
+    the highest target energy. The infeasible decision states are those
+    that leave the feasible ones at some decision variable, so they are
+    split by the first decision variable at which they do.
+
+    Each group fixes a prefix of the decision variables, and the groups that
+    fix the same number are minimized together. The other variables are
+    eliminated in the order given by :func:`elimination_order`, which takes
+    time and memory exponential only in the treewidth of the graph. This
+    only removes the cost of the separation; :class:`AuxiliarySearch` still
+    enumerates the auxiliary states and :class:`LinearProgram` keeps a flag
+    for every state, so the whole search remains exponential in the number
+    of auxiliary variables.
+
+    Called with a solution, it returns the row of the lowest energy state of
+    each group and its slack, to be used as :attr:`LinearProgram.separate`.
+
+    Args:
+        graph: The graph.
+        indexer: The columns of the constraint matrix.
+        decision: The decision variables, they are the low bits of the state
+            codes and the auxiliary variables the high bits.
+        auxiliary: The auxiliary variables.
+        codes: The feasible decision state codes.
+        energies: The target energy of each feasible decision state.
+
+    """
+    def __init__(self,
+                 graph: nx.Graph,
+                 indexer: Index,
+                 decision: Sequence[Variable],
+                 auxiliary: Sequence[Variable],
+                 codes: np.ndarray,
+                 energies: np.ndarray,
+                 ):
+        variables = list(decision) + list(auxiliary)
+        position = dict((v, k) for k, v in enumerate(variables))
+        num_decision = len(decision)
+
+        self.num_variables = len(variables)
+        self.width, order = elimination_order(graph)
+        self.order = [position[v] for v in order]
+        self.rank = np.empty(self.num_variables, dtype=np.int64)
+        self.rank[self.order] = np.arange(self.num_variables)
+
+        self.columns = np.array([indexer.variable(v) for v in variables], dtype=np.int64)
+        edges = [(position[u], position[v], indexer.interaction(u, v)) for u, v in graph.edges]
+        self.edges = np.array([(u, v) for u, v, _ in edges], dtype=np.int64).reshape(len(edges), 2)
+        self.edge_columns = np.array([uv for _, _, uv in edges], dtype=np.int64)
+
+        codes = np.asarray(codes, dtype=np.int64)
+        energies = np.asarray(energies, dtype=float)
+        highest = energies.max()
+
+        # (fixed positions, their bits, target energies, gap coefficient)
+        self.groups: List[Tuple[np.ndarray, np.ndarray, np.ndarray, int]] = []
+
+        positions = np.arange(num_decision)
+        self.groups.append((positions, (codes[:, np.newaxis] >> positions) & 1, energies, 0))
+
+        # the prefixes where the infeasible states leave the feasible ones
+        prefixes: Dict[int, List[int]] = defaultdict(list)
+        stack = [(0, 0, codes)]
+        while stack:
+            k, prefix, shared = stack.pop()
+            if k == num_decision:
+                continue
+            bits = (shared >> k) & 1
+            for bit in (0, 1):
+                if (bits == bit).any():
+                    stack.append((k + 1, prefix | bit << k, shared[bits == bit]))
+                else:
+                    prefixes[k].append(prefix | bit << k)
+
+        for k, group in sorted(prefixes.items()):
+            positions = np.arange(k + 1)
+            group = np.array(sorted(group), dtype=np.int64)
+            self.groups.append((positions, (group[:, np.newaxis] >> positions) & 1,
+                                np.full(len(group), highest), -1))
+
+    def __call__(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rows = []
+        slack = []
+        for positions, bits, targets, gap_coefficient in self.groups:
+            energy, codes = self.minimize(x, positions, bits)
+            rows.append(codes)
+            slack.append(energy + gap_coefficient*x[Index.gap()] - targets)
+        return np.concatenate(rows), np.concatenate(slack)
+
+    def minimize(self,
+                 x: np.ndarray,
+                 positions: np.ndarray,
+                 bits: np.ndarray,
+                 ) -> Tuple[np.ndarray, np.ndarray]:
+        """Minimize the energy of the solution ``x`` with the variables at
+        ``positions`` fixed, once for each row of ``bits``.
+
+        Returns:
+            A 2-tuple of the lowest energy and the state code of a state
+            with that energy, for each row of ``bits``.
+
+        """
+        num = len(bits)
+        num_variables = self.num_variables
+        rank = self.rank
+
+        is_fixed = np.zeros(num_variables, dtype=bool)
+        is_fixed[positions] = True
+        spin = np.zeros((num, num_variables))
+        spin[:, positions] = 2*bits - 1
+
+        h = x[self.columns]
+        J = x[self.edge_columns]
+        u, v = self.edges.T
+
+        energy = x[Index.offset()] + spin @ h
+
+        # the interactions with fixed variables are constant or linear
+        both = is_fixed[u] & is_fixed[v]
+        energy += (spin[:, u[both]] * spin[:, v[both]]) @ J[both]
+        field = np.broadcast_to(h, (num, num_variables)).copy()
+        for fixed, free in [(u, v), (v, u)]:
+            one = is_fixed[fixed] & ~is_fixed[free]
+            np.add.at(field, (slice(None), free[one]), spin[:, fixed[one]] * J[one])
+
+        # Factors are (scope, table) with the scope in elimination order and
+        # the table indexed by the rows and then the bit of each variable in
+        # the scope. Each waits in the bucket of its first variable.
+        buckets: Dict[int, List[Tuple[Tuple[int, ...], np.ndarray]]] = defaultdict(list)
+        free = ~is_fixed[u] & ~is_fixed[v]
+        for a, b, j in zip(u[free].tolist(), v[free].tolist(), J[free]):
+            if rank[a] > rank[b]:
+                a, b = b, a
+            buckets[a].append(((a, b), j*np.array([[[+1, -1], [-1, +1]]])))
+
+        trace = []
+        for w in self.order:
+            if is_fixed[w]:
+                continue
+            factors = buckets.pop(w, [])
+            factors.append(((w,), field[:, w, np.newaxis] * np.array([-1, +1])))
+
+            scope = sorted(set().union(*(scope for scope, _ in factors)), key=rank.__getitem__)
+            total = np.zeros((num,) + (2,)*len(scope))
+            for factor_scope, table in factors:
+                shape = tuple(2 if t in factor_scope else 1 for t in scope)
+                total += table.reshape((len(table),) + shape)
+
+            # w is first in elimination order
+            rest = tuple(scope[1:])
+            trace.append((w, rest, total.argmin(axis=1)))
+            if rest:
+                buckets[rest[0]].append((rest, total.min(axis=1)))
+            else:
+                energy += total.min(axis=1)
+
+        # work back through the eliminated variables for the lowest state
+        state = np.zeros((num, num_variables), dtype=np.int64)
+        state[:, positions] = bits
+        rows = np.arange(num)
+        for w, rest, argmin in reversed(trace):
+            state[:, w] = argmin[(rows,) + tuple(state[:, t] for t in rest)]
+
+        return energy, state @ (np.int64(1) << np.arange(num_variables, dtype=np.int64))
+
+
+class EngineRule(NamedTuple):
+    """Use ``engine`` for problems within all of the given limits.
+
+    A limit of None is no limit.
+    """
+    engine: str
+    max_variables: Optional[int] = None
+    max_auxiliary: Optional[int] = None
+    max_feasible: Optional[int] = None
+    max_edges: Optional[int] = None
+
+    def matches(self, num_variables: int, num_auxiliary: int, num_feasible: int,
+                num_edges: int) -> bool:
+        return all(limit is None or value <= limit
+                   for value, limit in [(num_variables, self.max_variables),
+                                        (num_auxiliary, self.max_auxiliary),
+                                        (num_feasible, self.max_feasible),
+                                        (num_edges, self.max_edges)])
+
+
+ENGINES = ('lp', 'lazy', 'milp', 'tree')
+"""The engines that :func:`generate` can run, besides ``'auto'``."""
+
+ENGINE_RULES: List[EngineRule] = [
+    EngineRule('lp', max_variables=8, max_feasible=8),
+    EngineRule('milp', max_variables=8, max_auxiliary=2),
+    EngineRule('lp', max_variables=8),
+    EngineRule('lazy'),
+]
+"""The rules used by ``engine='auto'``, first match wins.
+
+Recalibrate them with ``benchmarks/engines.py``.
+"""
+
+
+def select_engine(num_variables: int,
+                  num_auxiliary: int,
+                  num_feasible: int,
+                  num_edges: int,
+                  *,
+                  rules: Optional[Sequence[EngineRule]] = None,
+                  ) -> str:
+    """Pick an engine from the shape of a problem with the first matching
+    rule, by default :data:`ENGINE_RULES`.
+
+    Rules for the ``'milp'`` engine are skipped if scipy is too old to have
+    :func:`scipy.optimize.milp`.
+    """
+    if rules is None:
+        rules = ENGINE_RULES
+    for rule in rules:
+        if rule.engine == 'milp' and not hasattr(scipy.optimize, 'milp'):
+            continue
+        if rule.matches(num_variables, num_auxiliary, num_feasible, num_edges):
+            return rule.engine
+    return 'lp'
+
+
+class Nogoods:
+    """Sets of rows that cannot all be fixed in a feasible assignment."""
+    def __init__(self):
+        self._nogoods: Set[FrozenSet[int]] = set()
+        self._by_row: Dict[int, List[FrozenSet[int]]] = defaultdict(list)
+
+        # for each row, its nogoods as the rows of a padded array, built as
+        # needed so that they can be checked together
+        self._arrays: Dict[int, np.ndarray] = dict()
+
+    def __len__(self) -> int:
+        return len(self._nogoods)
+
+    def add(self, rows: Iterable[int]):
+        nogood = frozenset(rows)
+        if nogood in self._nogoods:
+            return
+        self._nogoods.add(nogood)
+        for i in nogood:
+            self._by_row[i].append(nogood)
+            self._arrays.pop(i, None)
+
+    def find(self, i: int, is_fixed: np.ndarray) -> Optional[FrozenSet[int]]:
+        """Find a nogood containing row ``i`` whose other rows are all fixed."""
+        nogoods = self._by_row.get(i)
+        if not nogoods:
+            return None
+
+        array = self._arrays.get(i)
+        if array is None:
+            # pad with i itself, which is checked as though fixed
+            array = np.full((len(nogoods), max(map(len, nogoods))), i, dtype=np.int64)
+            for k, nogood in enumerate(nogoods):
+                array[k, :len(nogood)] = sorted(nogood)
+            self._arrays[i] = array
+
+        fixed = is_fixed[array]
+        fixed[array == i] = True
+        k = np.flatnonzero(fixed.all(axis=1))
+        return nogoods[k[0]] if len(k) else None
+
+
+class AuxiliarySymmetries:
+    """Symmetries of the auxiliary states that map penalty models onto
+    penalty models.
+
+    Each symmetry permutes the auxiliary variables and then flips some of
+    them. Permuting the auxiliary bits of ``code`` and flipping ``flip`` gives
+    the image ``sum(bit[k] << permutation[k]) ^ flip``.
+
+    Args:
+        permutations: Array of shape (num_symmetries, num_auxiliary) giving
+            the new bit of each auxiliary bit.
+        flips: Array of shape (num_symmetries,) of the auxiliary bits to flip.
+
+    """
+    def __init__(self, permutations: np.ndarray, flips: np.ndarray):
+        self.permutations = np.asarray(permutations, dtype=np.int64)
+        self.flips = np.asarray(flips, dtype=np.int64)
+        self.num_auxiliary = self.permutations.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.flips)
+
+    @classmethod
+    def from_graph(cls,
+                   graph: nx.Graph,
+                   decision: Sequence[Variable],
+                   auxiliaries: Sequence[Variable],
+                   *,
+                   gauge: bool = False,
+                   max_size: int = 1024,
+                   ) -> 'AuxiliarySymmetries':
+        """Find the symmetries of the auxiliary states of a graph.
+
+        Auxiliary variables are permuted by the automorphisms of ``graph``
+        that fix every decision variable. If ``gauge`` is true, which requires
+        bounds symmetric about zero, auxiliary variables can also be flipped.
+
+        At most ``max_size`` symmetries are kept. The identity is excluded.
+        """
+        decision = set(decision)
+        index = dict((v, k) for k, v in enumerate(auxiliaries))
+
+        labelled = nx.Graph()
+        labelled.add_nodes_from((v, dict(label=(v,) if v in decision else ())) for v in graph.nodes)
+        labelled.add_edges_from(graph.edges)
+        matcher = nx.algorithms.isomorphism.GraphMatcher(
+            labelled, labelled, node_match=lambda a, b: a['label'] == b['label'])
+
+        permutations = [[index[mapping[v]] for v in auxiliaries]
+                        for mapping in itertools.islice(matcher.isomorphisms_iter(), max_size + 1)]
+
+        num_auxiliary = len(auxiliaries)
+        if not gauge:
+            flips = [0]
+        elif len(permutations) << num_auxiliary <= max_size + 1:
+            flips = range(1 << num_auxiliary)
+        else:
+            # too many to keep them all, so flip one at a time
+            flips = [0] + [1 << k for k in range(num_auxiliary)]
+
+        identity = list(range(num_auxiliary))
+        symmetries = ((permutation, flip) for permutation in permutations for flip in flips
+                      if flip or permutation != identity)
+        symmetries = list(itertools.islice(symmetries, max_size))
+
+        if not symmetries:
+            return cls(np.empty((0, num_auxiliary)), [])
+        permutations, flips = zip(*symmetries)
+        return cls(permutations, flips)
+
+    def images(self, symmetries: np.ndarray, code: int) -> np.ndarray:
+        """Get the images of an auxiliary state code under the given
+        symmetries.
+        """
+        bits = (code >> np.arange(self.num_auxiliary, dtype=np.int64)) & 1
+        return (bits << self.permutations[symmetries]).sum(axis=1) ^ self.flips[symmetries]
+
+
+class Cancelled(Exception):
+    """Raised when a search is cancelled."""
+
+
+class SearchProgress(NamedTuple):
+    """The state of an auxiliary search after a linear program is solved,
+    see :class:`AuxiliarySearch`.
+    """
+    depth: int
+    """The number of decision states fixed, including the one tried."""
+
+    num_decision_states: int
+    """The number of decision states to fix."""
+
+    elapsed: float
+    """Seconds since the search started."""
+
+    decision: Tuple[int, ...]
+    """The spins of the decision state tried."""
+
+    auxiliary: Tuple[int, ...]
+    """The spins of the auxiliary state tried."""
+
+    feasible: bool
+    """Whether the linear program was feasible."""
+
+
+class AuxiliarySearch:
+    """Search for an auxiliary state for each feasible decision state such
+    that the linear program with all of their rows fixed is feasible.
+
+    The search fixes one decision state at a time, trying its auxiliary
+    states in Gray code order and backtracking when the linear program
+    becomes infeasible.
+
+    If ``learn_nogoods`` is true, each infeasible linear program is reduced to
+    the fixed rows used by the solver's certificate of infeasibility. The
+    conflict is stored as a nogood so that no later assignment containing it
+    is tried, and when every auxiliary state of a decision state fails the
+    search jumps back to the latest decision state involved in the conflicts.
+
+    If ``symmetries`` are given, only assignments that are lexicographically
+    no larger than their images are searched. The auxiliary states of the
+    ground states are compared in ``ground`` order.
+
+    The decision states are fixed in ``order``, by default ``ground``. If
+    ``most_constrained`` is true, the next decision state is instead the one
+    with the fewest auxiliary states still consistent with the fixed rows, so
+    that bad prefixes fail early. Rows the last feasible solution satisfies
+    as equalities are consistent, the others are probed by fixing them, and
+    the probes that fail are recorded as nogoods. Ties are broken by
+    ``order``. If
+    ``cancel`` is given, the search raises :exc:`Cancelled` once it is set.
+
+    If ``callback`` is given, it is called with a :class:`SearchProgress`
+    after every linear program solved, including probes. If it returns a
+    true value the search raises :exc:`Cancelled`.
+
+    If ``workers`` are given, they are further sessions over the same
+    constraints, and each time the search would solve a linear program it
+    instead solves the candidate auxiliary state and the ones following it in
+    Gray code order at once, one per worker, in threads. The search then
+    moves through the results in order, as though it had solved them one at
+    a time, so it tries the same auxiliary states and finds the same
+    assignment. The results are discarded once the earlier decision states
+    change. Solves that are never used are not passed to the callback.
+    """
+    max_probes: int = 8
+    """The maximum number of auxiliary states of each decision state probed
+    when choosing the most constrained."""
+
+    def __init__(self,
+                 lp: LinearProgram,
+                 ground: Sequence[int],
+                 num_decision: int,
+                 num_auxiliary: int,
+                 *,
+                 learn_nogoods: bool = True,
+                 symmetries: Optional[AuxiliarySymmetries] = None,
+                 order: Optional[Sequence[int]] = None,
+                 most_constrained: bool = False,
+                 cancel: Optional[multiprocessing.synchronize.Event] = None,
+                 callback: Optional[Callable[[SearchProgress], Optional[bool]]] = None,
+                 workers: Sequence[LinearProgram] = (),
+                 ):
+        self.lp = lp
+        self.workers = workers
+        self.ground = ground
+        self.order = ground if order is None else order
+        self.most_constrained = most_constrained
+        self.cancel = cancel
+        self.callback = callback
+        self.start = time.monotonic()
+        self.num_decision = num_decision
+        self.num_auxiliary = num_auxiliary
+        self.final_auxiliary = last_auxiliary(num_auxiliary)
+        self.learn_nogoods = learn_nogoods
+
+        self.c = np.zeros(lp.A.shape[1])
+
+        # the solution of the last feasible linear program
+        self.x: Optional[np.ndarray] = None
+
+        self.nogoods = Nogoods()
+
+        # the fixed auxiliary state of each decision state, in the order fixed
+        self.auxiliary_configurations: Dict[int, int] = OrderedDict()
+
+        # for each fixed decision state, the rows of earlier decision states
+        # that caused its auxiliary states to fail
+        self.culprits: Dict[int, Set[int]] = dict()
+
+        # the auxiliary states of the fixed prefix of ground and, after each,
+        # the symmetries that map the prefix so far onto itself
+        self.symmetries = symmetries
+        self._prefix: List[int] = []
+        if symmetries is not None:
+            self._tied: List[np.ndarray] = [np.arange(len(symmetries))]
+
+        # the results of the speculative solves, by row, and the other fixed
+        # rows they were solved with
+        self._speculated: Dict[int, Tuple[LPResult, Optional[FrozenSet[int]]]] = dict()
+        self._context: FrozenSet[int] = frozenset()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    def row(self, decision_code: int, auxiliary_code: int) -> int:
+        return decision_code | auxiliary_code << self.num_decision
+
+    def fix(self, decision_code: int, auxiliary_code: int):
+        self.auxiliary_configurations[decision_code] = auxiliary_code
+        self.lp.fix(self.row(decision_code, auxiliary_code))
+
+    def report(self, i: int, feasible: bool):
+        """Pass the progress after solving with row ``i`` fixed to the
+        callback.
+
+        Raises:
+            Cancelled: If the callback returns a true value.
+
+        """
+        if self.callback is None:
+            return
+        progress = SearchProgress(
+            depth=len(self.auxiliary_configurations) + (not self.lp.is_fixed[i]),
+            num_decision_states=len(self.ground),
+            elapsed=time.monotonic() - self.start,
+            decision=spins(i & ((1 << self.num_decision) - 1), self.num_decision),
+            auxiliary=spins(i >> self.num_decision, self.num_auxiliary),
+            feasible=feasible)
+        if self.callback(progress):
+            raise Cancelled
+
+    def pop(self) -> Tuple[int, int]:
+        decision_code, auxiliary_code = self.auxiliary_configurations.popitem()
+        self.lp.release(self.row(decision_code, auxiliary_code))
+        return decision_code, auxiliary_code
+
+    def run(self) -> LPResult:
+        """Run the search.
+
+        Returns:
+            The result of the feasible linear program.
+
+        Raises:
+            ImpossiblePenaltyModel: If there is no feasible assignment.
+
+        """
+        if not self.workers:
+            return self._run()
+
+        stats = self.lp.stats
+        worker_stats = []
+        for worker in self.workers:
+            worker.deadline = self.lp.deadline
+            if stats is not None:
+                # each thread records into its own
+                worker.stats = GenerationStats()
+                worker_stats.append(worker.stats)
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(len(self.workers)) as self._executor:
+                return self._run()
+        finally:
+            self._executor = None
+            for other in worker_stats:
+                stats.add(other)
+
+    def _run(self) -> LPResult:
+        while True:
+            if self.cancel is not None and self.cancel.is_set():
+                raise Cancelled
+
+            if self.auxiliary_configurations:
+                res, conflict = self.check()
+            else:
+                res, conflict = None, None
+
+            if conflict is None:
+                if len(self.auxiliary_configurations) == len(self.ground):
+                    return res
+                if res is not None:
+                    self.x = res.x
+
+                # fix a new state
+                decision_code = self.next_decision()
+                self.culprits[decision_code] = set()
+                self.fix(decision_code, 0)
+            else:
+                self.backtrack(conflict)
+
+    def next_decision(self) -> int:
+        """Get the next decision state to fix."""
+        if not self.most_constrained or self.x is None:
+            return next(code for code in self.order if code not in self.auxiliary_configurations)
+
+        candidates = [code for code in self.order if code not in self.auxiliary_configurations]
+        rows = (np.asarray(candidates)[:, np.newaxis]
+                | (np.arange(1 << self.num_auxiliary) << self.num_decision))
+
+        # the last feasible solution already satisfies these rows as
+        # equalities, so they are consistent without solving anything
+        slack = (self.lp.A[rows.ravel()] @ self.x - self.lp.b[rows.ravel()]).reshape(rows.shape)
+        consistent = np.abs(slack) <= 1e-9
+
+        # Count the consistent auxiliary states of each candidate, probing at
+        # most max_probes of the unknown ones and counting the rest as
+        # consistent. Only the fewest matters, so stop probing a candidate
+        # once it cannot beat the best so far.
+        best_count, best = None, None
+        for k, decision_code in enumerate(candidates):
+            probes = rows[k][~consistent[k]][:self.max_probes].tolist()
+            count = len(rows[k])
+            for num_probed, i in enumerate(probes):
+                if best_count is not None and count - (len(probes) - num_probed) >= best_count:
+                    break
+                if not self.probe(i):
+                    count -= 1
+            if best_count is None or count < best_count:
+                best_count, best = count, decision_code
+                if not count:
+                    # a dead end, which check() finds from the nogoods
+                    break
+
+        return best
+
+    def probe(self, i: int) -> bool:
+        """Check whether row ``i`` can be fixed along with the fixed rows.
+
+        Rows that cannot be fixed are recorded as nogoods, so they are
+        neither probed nor solved again while the conflict remains fixed.
+        """
+        if self.nogoods.find(i, self.lp.is_fixed) is not None:
+            return False
+
+        self.lp.fix(i)
+        res = self.lp.solve(self.c)
+        if not res.success:
+            if self.learn_nogoods:
+                self.nogoods.add(self.explain())
+            else:
+                self.nogoods.add(np.flatnonzero(self.lp.is_fixed).tolist())
+        self.lp.release(i)
+
+        self.report(i, res.success)
+
+        return res.success
+
+    def check(self) -> Tuple[Optional[LPResult], Optional[FrozenSet[int]]]:
+        """Check the most recently fixed row.
+
+        Returns:
+            A 2-tuple of the linear program result and, if it was infeasible,
+            a set of fixed rows that conflict.
+
+        """
+        decision_code, auxiliary_code = next(reversed(self.auxiliary_configurations.items()))
+        i = self.row(decision_code, auxiliary_code)
+
+        nogood = self.nogoods.find(i, self.lp.is_fixed)
+        if nogood is not None:
+            return None, nogood
+
+        if self.symmetries is not None:
+            conflict = self.break_symmetry()
+            if conflict is not None:
+                return None, conflict
+
+        res, conflict = self.solve(i)
+        self.report(i, res.success)
+        if res.success:
+            return res, None
+
+        if self.learn_nogoods:
+            if len(conflict) < len(self.auxiliary_configurations):
+                self.nogoods.add(conflict)
+        else:
+            conflict = frozenset(self.row(*item) for item in self.auxiliary_configurations.items())
+
+        return res, conflict
+
+    def solve(self, i: int) -> Tuple[LPResult, Optional[FrozenSet[int]]]:
+        """Solve the linear program with the fixed rows, the latest of which
+        is row ``i``.
+
+        Returns:
+            A 2-tuple of the linear program result and, if it was infeasible
+            and ``learn_nogoods`` is true, its conflict, see :meth:`explain`.
+
+        """
+        if self._executor is None:
+            res = self.lp.solve(self.c)
+            return res, self.explain() if self.learn_nogoods and not res.success else None
+
+        context = frozenset(np.flatnonzero(self.lp.is_fixed).tolist()) - {i}
+        if context != self._context:
+            self._speculated.clear()
+            self._context = context
+        if i not in self._speculated:
+            self.speculate(i)
+        return self._speculated.pop(i)
+
+    def speculate(self, i: int):
+        """Solve row ``i`` and the rows of the auxiliary states following it
+        in parallel, one per worker, each with the other fixed rows.
+
+        Rows already ruled out by a nogood are skipped.
+        """
+        decision_code = i & ((1 << self.num_decision) - 1)
+        auxiliary_code = i >> self.num_decision
+
+        rows = [i]
+        while len(rows) < len(self.workers) and auxiliary_code != self.final_auxiliary:
+            auxiliary_code = next_auxiliary(auxiliary_code)
+            j = self.row(decision_code, auxiliary_code)
+            if self.nogoods.find(j, self.lp.is_fixed) is None:
+                rows.append(j)
+
+        is_fixed = self.lp.is_fixed.copy()
+        is_fixed[i] = False
+
+        futures = [self._executor.submit(self._solve_worker, worker, is_fixed, j)
+                   for worker, j in zip(self.workers, rows)]
+        for j, future in zip(rows, futures):
+            self._speculated[j] = future.result()
+
+    def _solve_worker(self,
+                      worker: LinearProgram,
+                      is_fixed: np.ndarray,
+                      i: int,
+                      ) -> Tuple[LPResult, Optional[FrozenSet[int]]]:
+        # fix the same rows as the search, with row i in place of the latest
+        for j in np.flatnonzero(worker.is_fixed & ~is_fixed):
+            if j != i:
+                worker.release(j)
+        for j in np.flatnonzero(is_fixed & ~worker.is_fixed):
+            worker.fix(j)
+        if not worker.is_fixed[i]:
+            worker.fix(i)
+
+        res = worker.solve(self.c)
+        return res, self.explain(worker) if self.learn_nogoods and not res.success else None
+
+    def explain(self, lp: Optional[LinearProgram] = None) -> FrozenSet[int]:
+        """Get a conflicting subset of the fixed rows of an infeasible linear
+        program, by default the search's.
+
+        The rows used by the solver's certificate of infeasibility are used if
+        it provides one, otherwise all of the fixed rows.
+        """
+        if lp is None:
+            lp = self.lp
+        certificate = lp.certificate()
+        if certificate is not None and len(certificate):
+            return frozenset(certificate.tolist())
+        return frozenset(np.flatnonzero(lp.is_fixed).tolist())
+
+    def break_symmetry(self) -> Optional[FrozenSet[int]]:
+        """Check that the fixed prefix of ``ground`` is lexicographically no
+        larger than its images under the symmetries.
+
+        Returns:
+            The rows of the prefix up to where one of its images is smaller,
+            otherwise None.
+
+        """
+        configurations = self.auxiliary_configurations
+        prefix = self._prefix
+        tied = self._tied
+
+        # drop whatever has changed since the last check
+        depth = 0
+        while depth < len(prefix) and configurations.get(self.ground[depth]) == prefix[depth]:
+            depth += 1
+        del prefix[depth:]
+        del tied[depth + 1:]
+
+        while depth < len(self.ground) and self.ground[depth] in configurations:
+            auxiliary_code = configurations[self.ground[depth]]
+            images = self.symmetries.images(tied[depth], auxiliary_code)
+            if (images < auxiliary_code).any():
+                return frozenset(self.row(decision_code, configurations[decision_code])
+                                 for decision_code in self.ground[:depth + 1])
+            prefix.append(auxiliary_code)
+            tied.append(tied[depth][images == auxiliary_code])
+            depth += 1
+
+        return None
+
+    def backtrack(self, conflict: FrozenSet[int]):
+        """Move on from a conflict among the fixed rows.
+
+        Raises:
+            ImpossiblePenaltyModel: If the conflict cannot be avoided.
+
+        """
+        if not conflict:
+            raise ImpossiblePenaltyModel("There is no BQM that can encode the given constraint")
+
+        if self.lp.stats is not None:
+            self.lp.stats.num_backtracks += 1
+
+        while True:
+            decision_code, auxiliary_code = self.pop()
+            culprits = self.culprits[decision_code]
+            culprits.update(conflict)
+            culprits.discard(self.row(decision_code, auxiliary_code))
+
+            if auxiliary_code != self.final_auxiliary:
+                # iterate the auxiliary state, consecutive states differ by a
+                # single variable
+                self.fix(decision_code, next_auxiliary(auxiliary_code))
+                return
+
+            # every auxiliary state failed, so the earlier rows that caused
+            # the failures cannot all be fixed together
+            conflict = frozenset(self.culprits.pop(decision_code))
+            if not conflict:
+                raise ImpossiblePenaltyModel("There is no BQM that can encode the given constraint")
+            if self.learn_nogoods:
+                self.nogoods.add(conflict)
+
+            # jump back to the latest decision state involved
+            while self.row(*next(reversed(self.auxiliary_configurations.items()))) not in conflict:
+                self.culprits.pop(self.pop()[0])
+
+
+MAX_EXCHANGE_STATES = 1024
+"""The most feasible states for which :func:`precheck` compares every pair."""
+
+
+def precheck(graph: nx.Graph,
+             decision: Sequence[Variable],
+             table: Mapping[Tuple[int, ...], float],
+             *,
+             linear_bound: Tuple[float, float],
+             quadratic_bound: Tuple[float, float],
+             min_classical_gap: float,
+             tolerance: float = 1e-9,
+             ):
+    """Check some necessary conditions for a penalty model to exist.
+
+    The checks only look at the table and the bounds, so they are much
+    cheaper than the search. ``M`` is the highest feasible energy and ``g``
+    is ``min_classical_gap``.
+
+    *   Flipping decision variable ``v`` changes the energy by at most
+        ``2*(max|h| + degree(v)*max|J|)``, so a feasible state next to an
+        infeasible one must be within that of ``M + g``.
+    *   If the graph is disconnected, the energy is a sum over components, so
+        exchanging the part of two feasible states in a component preserves
+        their total energy. Both exchanged states can only be infeasible if
+        that leaves room for both to be at ``M + g``, and if one is, the
+        other must leave room for it.
+    *   Without auxiliary variables, ``f(x) - f(x^u) - f(x^v) + f(x^uv)`` is
+        ``4*J[u, v]*x[u]*x[v]``, which bounds the interaction of ``u`` and
+        ``v`` when ``x`` and ``x^uv`` are feasible and ``x^u`` and ``x^v`` are
+        not. This rules out parity tables such as XOR.
+
+    Raises:
+        ImpossiblePenaltyModel: If a check fails.
+
+    """
+    num_decision = len(decision)
+    states = np.asarray(list(table), dtype=np.int8).reshape(len(table), num_decision)
+    codes = state_codes(states)
+    energies = np.fromiter(table.values(), dtype=float, count=len(table))
+    highest = energies.max()
+    threshold = highest + min_classical_gap - tolerance
+
+    # the target energy of each feasible decision state, nan for infeasible
+    energy = np.full(1 << num_decision, np.nan)
+    energy[codes] = energies
+
+    max_linear = max(map(abs, linear_bound))
+    max_quadratic = max(map(abs, quadratic_bound))
+
+    for k, v in enumerate(decision):
+        infeasible = np.isnan(energy[codes ^ (1 << k)])
+        max_change = 2*(max_linear + graph.degree(v)*max_quadratic)
+        if (energies[infeasible] + max_change < threshold).any():
+            raise ImpossiblePenaltyModel(
+                f"flipping {v!r} cannot raise the energy of a feasible state by min_classical_gap")
+
+    components = [c for c in nx.connected_components(graph) if any(v in c for v in decision)]
+    if len(components) > 1 and len(table) <= MAX_EXCHANGE_STATES:
+        for component in components:
+            mask = sum(1 << k for k, v in enumerate(decision) if v in component)
+            x, y = codes[:, np.newaxis], codes[np.newaxis, :]
+            z1 = energy[(x & ~mask) | (y & mask)]
+            z2 = energy[(y & ~mask) | (x & mask)]
+            total = energies[:, np.newaxis] + energies[np.newaxis, :]
+            if ((np.isnan(z1) & np.isnan(z2) & (total < 2*threshold))
+                    | (np.isnan(z1) & (total - z2 < threshold))
+                    | (np.isnan(z2) & (total - z1 < threshold))).any():
+                raise ImpossiblePenaltyModel(
+                    "the table is not consistent with an energy that is a sum over the "
+                    "graph's components")
+
+    if len(graph) == num_decision:
+        for (i, u), (j, v) in itertools.combinations(enumerate(decision), 2):
+            # x is feasible, as is x with u and v flipped, but neither with
+            # only one flipped
+            flip_u, flip_v = codes ^ (1 << i), codes ^ (1 << j)
+            pairs = (~np.isnan(energy[flip_u ^ (1 << j)])
+                     & np.isnan(energy[flip_u]) & np.isnan(energy[flip_v]))
+            if not pairs.any():
+                continue
+
+            # so J*x[u]*x[v] <= c
+            c = (energies[pairs] + energy[flip_u[pairs] ^ (1 << j)] - 2*threshold) / 4
+            sign = states[pairs, i] * states[pairs, j]
+
+            lower, upper = quadratic_bound if graph.has_edge(u, v) else (0, 0)
+            upper = min(upper, c[sign > 0].min(initial=np.inf))
+            lower = max(lower, (-c[sign < 0]).max(initial=-np.inf))
+            if lower > upper + tolerance:
+                raise ImpossiblePenaltyModel(
+                    f"no interaction between {u!r} and {v!r} separates the feasible states without "
+                    "auxiliary variables")
+
+
+def induced_subgraph(graph: nx.Graph, nodes: Iterable[Variable]) -> nx.Graph:
+    """Copy the subgraph induced by ``nodes``, keeping the order of ``graph``.
+
+    The nodes of :meth:`networkx.Graph.subgraph` can be in set order, which
+    would change the order of the auxiliary variables.
+    """
+    nodes = set(nodes)
+    subgraph = nx.Graph()
+    subgraph.add_nodes_from(v for v in graph.nodes if v in nodes)
+    subgraph.add_edges_from((u, v) for u, v in graph.edges if u in nodes and v in nodes)
+    return subgraph
+
+
+class TableReduction:
+    """Decision variables that presolve eliminates from a table.
+
+    A decision variable with the same value in every feasible state is
+    fixed by its linear bias. A decision variable that is always equal or
+    always opposite to an earlier one it interacts with is merged into it by
+    their quadratic bias. Each bias is as strong as the bounds allow and the
+    other biases of the eliminated variables are 0.
+
+    Args:
+        decision: The decision variables.
+        fixed: The spin and linear bias of each fixed variable.
+        merged: The variable, the sign of the relation and the quadratic bias
+            of each merged variable.
+
+    """
+    def __init__(self,
+                 decision: Sequence[Variable],
+                 fixed: Mapping[Variable, Tuple[int, float]],
+                 merged: Mapping[Variable, Tuple[Variable, int, float]],
+                 ):
+        self.decision = list(decision)
+        self.fixed = dict(fixed)
+        self.merged = dict(merged)
+        self.kept = [v for v in decision if v not in fixed and v not in merged]
+
+    def __bool__(self) -> bool:
+        return bool(self.fixed or self.merged)
+
+    @classmethod
+    def from_table(cls,
+                   table: Mapping[Tuple[int, ...], float],
+                   decision: Sequence[Variable],
+                   graph: nx.Graph,
+                   linear_bound: Tuple[float, float],
+                   quadratic_bound: Tuple[float, float],
+                   ) -> 'TableReduction':
+        """Find the decision variables of a table that can be eliminated."""
+        if not (linear_bound[0] <= 0 <= linear_bound[1]
+                and quadratic_bound[0] <= 0 <= quadratic_bound[1]):
+            # the eliminated variables need biases of 0
+            return cls(decision, {}, {})
+
+        states = np.asarray(list(table), dtype=np.int8).reshape(len(table), len(decision))
+
+        fixed: Dict[Variable, Tuple[int, float]] = dict()
+        merged: Dict[Variable, Tuple[Variable, int, float]] = dict()
+        for k, v in enumerate(decision):
+            column = states[:, k]
+
+            if (column == column[0]).all():
+                spin = int(column[0])
+                bias = linear_bound[0] if spin > 0 else linear_bound[1]
+                if bias * spin < 0:
+                    fixed[v] = spin, bias
+                continue
+
+            for j, u in enumerate(decision[:k]):
+                if u in fixed or not graph.has_edge(u, v):
+                    continue
+                sign = int(column[0] * states[0, j])
+                if (column == sign * states[:, j]).all():
+                    bias = quadratic_bound[0] if sign > 0 else quadratic_bound[1]
+                    if bias * sign < 0:
+                        merged[v] = u, sign, bias
+                        break
+
+        if len(fixed) + len(merged) == len(decision):
+            # keep a decision variable, the first cannot be merged
+            del fixed[decision[0]]
+
+        return cls(decision, fixed, merged)
+
+    def penalty(self) -> float:
+        """The smallest energy added when an eliminated variable is wrong."""
+        biases = ([bias for _, bias in self.fixed.values()]
+                  + [bias for _, _, bias in self.merged.values()])
+        return 2*min(map(abs, biases), default=float('inf'))
+
+    def reduce_table(self, table: Mapping[Tuple[int, ...], float]) -> Dict[Tuple[int, ...], float]:
+        """Drop the eliminated variables from the states of a table."""
+        columns = [self.decision.index(v) for v in self.kept]
+        return {tuple(state[k] for k in columns): energy for state, energy in table.items()}
+
+    def expand_state(self, state: Tuple[int, ...]) -> Tuple[int, ...]:
+        """Get the decision state of a state of the kept variables."""
+        spin = dict(zip(self.kept, state))
+        for v in self.decision:
+            if v in self.fixed:
+                spin[v] = self.fixed[v][0]
+            elif v in self.merged:
+                u, sign, _ = self.merged[v]
+                spin[v] = sign * spin[u]
+        return tuple(spin[v] for v in self.decision)
+
+    def expand(self,
+               graph: nx.Graph,
+               bqm: dimod.BinaryQuadraticModel,
+               gap: float,
+               aux: Dict[Tuple[int, ...], Dict[Variable, int]],
+               spread: float,
+               ) -> Tuple[dimod.BinaryQuadraticModel, float,
+                          Dict[Tuple[int, ...], Dict[Variable, int]]]:
+        """Map a penalty model of the reduced table back to ``graph``.
+
+        A state with a wrong eliminated variable has at least the lowest
+        feasible energy plus :meth:`penalty`, so the gap can shrink by the
+        ``spread`` of the feasible energies.
+        """
+        linear = dict(bqm.linear)
+        quadratic = {frozenset(uv): bias for uv, bias in bqm.quadratic.items()}
+        offset = bqm.offset
+        for v, (spin, bias) in self.fixed.items():
+            linear[v] = bias
+            offset -= bias * spin
+        for v, (u, sign, bias) in self.merged.items():
+            quadratic[frozenset((u, v))] = bias
+            offset -= bias * sign
+
+        expanded = dimod.BinaryQuadraticModel('SPIN')
+        expanded.add_linear_from((v, linear.get(v, 0)) for v in graph.nodes)
+        expanded.add_quadratic_from((u, v, quadratic.get(frozenset((u, v)), 0))
+                                    for u, v in graph.edges)
+        expanded.offset = offset
+
+        gap = float(min(gap, self.penalty() - spread))
+
+        aux = dict((self.expand_state(state), configuration)
+                   for state, configuration in aux.items())
+
+        return expanded, gap, aux
+
+
+def generate(graph_like: GraphLike,
+             samples_like,
+             *,
+             linear_bound: Tuple[float, float] = (-2, 2),
+             quadratic_bound: Tuple[float, float] = (-1, 1),
+             min_classical_gap: float = 2,
+             lazy_constraints: bool = False,
+             memmap_dir: Optional[Union[str, os.PathLike]] = None,
+             learn_nogoods: bool = True,
+             symmetry_breaking: bool = True,
+             ordering: str = 'static',
+             seed: Optional[Union[int, np.random.SeedSequence]] = None,
+             portfolio: int = 1,
+             cancel: Optional[multiprocessing.synchronize.Event] = None,
+             engine: str = 'lp',
+             backend: Optional[str] = None,
+             time_limit: Optional[float] = None,
+             stats: Optional[GenerationStats] = None,
+             callback: Optional[Callable[[SearchProgress], Optional[bool]]] = None,
+             presolve: bool = False,
+             decompose: bool = True,
+             prechecks: bool = True,
+             speculate: int = 1,
+             ) -> Tuple[dimod.BinaryQuadraticModel, float, Dict[Tuple[int, ...], Tuple[int, ...]]]:
+    """Generate a penalty model.
+
+    This function is considered internal, it is recommended to use
+    :func:`~penaltymodel.get_penalty_model` with ``use_cache=False`` instead.
+
+    If ``lazy_constraints`` is true, the linear programs start with only the
+    fixed ground states and the other states are added as cutting planes when
+    a solution violates them.
+
+    If ``memmap_dir`` is given, the constraint matrix is stored in a
+    memory-mapped temporary file in that directory rather than in memory.
+    Without ``lazy_constraints`` the solver still holds every row as floats,
+    so for graphs of more than about 12 nodes both should be used.
+
+    If ``learn_nogoods`` is true, the auxiliary search records the conflicts
+    behind each failure and avoids them later, see :class:`AuxiliarySearch`.
+
+    If ``symmetry_breaking`` is true, auxiliary states that are equivalent
+    under automorphisms of the graph fixing the decision variables or, when
+    the bounds are symmetric about zero, under flipping auxiliary variables,
+    are only searched once.
+
+    The decision states are fixed in state code order or, if ``seed`` is
+    given, in a random order. If ``ordering`` is ``'most-constrained'``, the
+    next decision state is instead chosen by how constrained it is by the
+    last feasible solution, with ties broken by that order, see
+    :class:`AuxiliarySearch`.
+
+    If ``portfolio`` is greater than 1, that many searches are run in parallel
+    worker processes. The first uses ``seed`` and the rest use random orders
+    spawned from it. The result of the first search to finish is returned and
+    the others are cancelled.
+
+    If ``speculate`` is greater than 1, each time the search solves a linear
+    program it solves that many, for the auxiliary state tried and the ones
+    it would try next, in parallel threads with their own solver sessions.
+    This can speed up a single hard search where a ``portfolio`` cannot, and
+    the assignment found is the same. Without ``lazy_constraints`` each
+    session holds every row, so memory use grows accordingly.
+
+    If ``cancel`` is given, the search raises :exc:`Cancelled` once it is set.
+    If ``callback`` is given, it is called after every linear program the
+    auxiliary search solves and can cancel it by returning a true value, see
+    :class:`AuxiliarySearch`. It is not called for the other solves: the
+    linear program that maximizes the gap once the auxiliary states are
+    found, the one for a problem without auxiliary variables, or the
+    ``'milp'`` program. With a ``portfolio`` it is called in the worker
+    processes, so it must be picklable.
+
+    If ``engine`` is ``'milp'``, the search and the gap optimization are
+    replaced by a single mixed-integer program that selects the auxiliary
+    states, see :func:`solve_milp`. The gap found is then globally optimal.
+    The program has a binary variable for every auxiliary state of every
+    feasible decision state, so it suits problems with few auxiliary
+    variables. The options of the linear programming search are ignored.
+    ``engine='lazy'`` is the linear programming search with
+    ``lazy_constraints``, and ``engine='auto'`` picks one of them from the
+    shape of the problem, see :func:`select_engine`.
+
+    ``engine='tree'`` is the linear programming search with
+    ``lazy_constraints`` where the violated states are found by variable
+    elimination along a tree decomposition of the graph, see
+    :class:`TreeSeparator`, and the constraint matrix is never built, see
+    :class:`ImplicitConstraintMatrix`. Finding the violated states costs time
+    exponential in the treewidth rather than in the number of variables, but
+    the search still tries the auxiliary states one at a time, so the cost
+    remains exponential in the number of auxiliary variables. It therefore
+    suits sparse graphs such as paths, trees and grids where most variables
+    are decision variables. A few bytes are still kept for each state, which
+    limits it to around 26 variables. ``memmap_dir`` is ignored.
+
+    ``backend`` is the name of the linear programming backend, see
+    :func:`linear_program`.
+
+    If ``time_limit`` is given, generation raises
+    :exc:`~penaltymodel.PenaltyModelTimeout` once that many seconds have
+    passed. Each solve is given the time that remains. If the time runs out
+    after the auxiliary states are found but before the gap is maximized,
+    the feasible model is returned instead, with its gap, and a
+    :exc:`~penaltymodel.SuboptimalPenaltyModelWarning` is issued.
+
+    If ``prechecks`` is true, some necessary conditions are checked before
+    any linear program is built, so that many impossible problems fail
+    quickly, see :func:`precheck`.
+
+    If ``decompose`` is true and the graph is disconnected, the table is
+    split over its components when it is a product of tables over them, see
+    :func:`factorize`. Each factor is solved on its own, see
+    :func:`generate_factors`.
+
+    If ``presolve`` is true, decision variables that are constant in the
+    table, or always equal or opposite to another decision variable they
+    interact with, are first eliminated by strong biases, see
+    :class:`TableReduction`. Each one halves the number of states. The
+    reduced problem is solved and its model mapped back, and if that fails
+    or its gap is below ``min_classical_gap`` the full problem is solved
+    instead. The gap is then not necessarily the largest possible.
+
+    If ``stats`` is given, the work done is recorded in it, see
+    :class:`GenerationStats`. With a ``portfolio`` it describes the search
+    whose result is returned.
+    """
+    deadline = None if time_limit is None else time.monotonic() + time_limit
+
+    graph = as_graph(graph_like)
+    samples, decision = dimod.as_samples(samples_like)
+
+    if any(v not in graph.nodes for v in decision):
+        raise ValueError("the decision variables must be a subset of the graph nodes")
+
+    # let's make things easier for ourselves by casting the samples into -1, +1
+    if (samples == 0).any():
+        samples = 2*samples - 1
+    if not ((samples == +1) ^ (samples == -1)).all():
+        raise ValueError("given samples should be 0/1 or -1/+1")
+
+    auxiliaries = [v for v in graph.nodes if v not in decision]
+    num_samples = samples.shape[0]
+    num_variables = len(graph.nodes)
+    num_auxiliary = num_variables - len(decision)
+
+    if isinstance(samples_like, dimod.SampleSet):
+        energies = samples_like.record.energy
+    else:
+        energies = np.zeros(num_samples)
+
+    # construct the table
+    if len(energies):
+        table = {tuple(map(int, state)): energy for state, energy in zip(samples, energies)}
+    else:
+        table = {}
+
+    # some edge cases we can easily eliminate
+    if not table or not decision:
+        bqm = dimod.BinaryQuadraticModel('SPIN')
+        bqm.add_linear_from((v, 0) for v in graph.nodes)
+        bqm.add_quadratic_from((u, v, 0) for u, v in graph.edges)
+        return bqm, float('inf'), {}
+
+    if ordering not in ('static', 'most-constrained'):
+        raise ValueError(f"unknown ordering {ordering!r}, expected 'static' or 'most-constrained'")
+
+    if prechecks:
+        precheck(graph, decision, table,
+                 linear_bound=linear_bound,
+                 quadratic_bound=quadratic_bound,
+                 min_classical_gap=min_classical_gap)
+
+    factors = factorize(graph, decision, table) if decompose else []
+    if factors:
+        return generate_factors(graph, decision, factors,
+                                linear_bound=linear_bound,
+                                quadratic_bound=quadratic_bound,
+                                min_classical_gap=min_classical_gap,
+                                lazy_constraints=lazy_constraints,
+                                memmap_dir=memmap_dir,
+                                learn_nogoods=learn_nogoods,
+                                symmetry_breaking=symmetry_breaking,
+                                ordering=ordering,
+                                seed=seed,
+                                portfolio=portfolio,
+                                cancel=cancel,
+                                engine=engine,
+                                backend=backend,
+                                time_limit=(None if deadline is None
+                                            else max(deadline - time.monotonic(), 0)),
+                                stats=stats,
+                                callback=callback,
+                                presolve=presolve,
+                                prechecks=prechecks,
+                                speculate=speculate)
+
+    if presolve:
+        reduction = TableReduction.from_table(table, decision, graph, linear_bound, quadratic_bound)
+    else:
+        reduction = None
+    if reduction:
+        reduced = reduction.reduce_table(table)
+        states, energies = zip(*reduced.items())
+        eliminated = reduction.fixed.keys() | reduction.merged.keys()
+        reduced_stats = None if stats is None else GenerationStats()
+        try:
+            bqm, gap, aux = generate(
+                induced_subgraph(graph, (v for v in graph.nodes if v not in eliminated)),
+                dimod.SampleSet.from_samples((np.asarray(states, dtype=np.int8), reduction.kept),
+                                             'SPIN', energy=energies),
+                linear_bound=linear_bound,
+                quadratic_bound=quadratic_bound,
+                min_classical_gap=min_classical_gap,
+                lazy_constraints=lazy_constraints,
+                memmap_dir=memmap_dir,
+                learn_nogoods=learn_nogoods,
+                symmetry_breaking=symmetry_breaking,
+                ordering=ordering,
+                seed=seed,
+                portfolio=portfolio,
+                cancel=cancel,
+                engine=engine,
+                backend=backend,
+                time_limit=None if deadline is None else max(deadline - time.monotonic(), 0),
+                stats=reduced_stats,
+                callback=callback,
+                presolve=presolve,
+                decompose=decompose,
+                prechecks=prechecks,
+                speculate=speculate)
+        except ImpossiblePenaltyModel:
+            # the eliminated variables' biases might have been needed
+            pass
+        else:
+            spread = max(table.values()) - min(table.values())
+            bqm, gap, aux = reduction.expand(graph, bqm, gap, aux, spread)
+            if gap >= min_classical_gap:
+                if stats is not None:
+                    # the eliminated variables' penalty can bound the gap
+                    stats.unbounded_gap = gap == float('inf')
+                return bqm, gap, aux
+        finally:
+            if stats is not None:
+                # whether the gap is unbounded is decided from the gap returned
+                reduced_stats.unbounded_gap = False
+                stats.add(reduced_stats)
+
+    if engine == 'auto':
+        engine = select_engine(num_variables, num_auxiliary, len(table), len(graph.edges))
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine {engine!r}, expected 'auto' or one of {ENGINES}")
+    if engine == 'lazy':
+        engine, lazy_constraints = 'lp', True
+    elif engine == 'tree':
+        lazy_constraints = True
+
+    if portfolio > 1 and engine in ('lp', 'tree') and num_auxiliary:
+        return generate_portfolio(graph, samples_like, portfolio,
+                                  linear_bound=linear_bound,
+                                  quadratic_bound=quadratic_bound,
+                                  min_classical_gap=min_classical_gap,
+                                  lazy_constraints=lazy_constraints,
+                                  memmap_dir=memmap_dir,
+                                  learn_nogoods=learn_nogoods,
+                                  symmetry_breaking=symmetry_breaking,
+                                  ordering=ordering,
+                                  seed=seed,
+                                  cancel=cancel,
+                                  engine=engine,
+                                  backend=backend,
+                                  time_limit=time_limit,
+                                  stats=stats,
+                                  callback=callback,
+                                  speculate=speculate,
+                                  # already done for this problem
+                                  prechecks=False,
+                                  decompose=False)
+
+    # Rows of the LP matrix are indexed by state code. The decision variables
+    # are the low bits, so the row of a (decision, auxiliary) pair is
+    # decision_code | auxiliary_code << num_decision
+    num_decision = len(decision)
+
+    # the decision states that are ground states, in state code order
+    feasible_states = np.asarray(list(table), dtype=np.int8).reshape(len(table), num_decision)
+    feasible_codes = state_codes(feasible_states)
+    order = np.argsort(feasible_codes)
+    ground = feasible_codes[order].tolist()
+
+    # the target energy and gap column for every decision state code,
+    # infeasible states need to be above the highest feasible energy
+    energy = np.full(1 << num_decision, max(table.values()), dtype=float)
+    energy[feasible_codes] = list(table.values())
+    gap_column = np.full(1 << num_decision, -1, dtype=np.int8)
+    gap_column[feasible_codes] = 0
+
+    # ok, let's build our matrices for the LP, the auxiliary bits repeat the
+    # decision pattern
+
+    t = time.perf_counter()
+
+    separator = None
+    if engine == 'tree':
+        # the rows are built as the linear programs need them, and the
+        # violated ones are found without looking at the others
+        indexer = Index(decision, auxiliaries, graph.edges)
+        A = ImplicitConstraintMatrix(indexer, graph.edges, gap_column)
+        b = TiledVector(energy, 1 << num_variables)
+        separator = TreeSeparator(graph, indexer, decision, auxiliaries, feasible_codes,
+                                  np.fromiter(table.values(), dtype=float, count=len(table)))
+    else:
+        b = np.tile(energy, 1 << num_auxiliary)
+
+        if memmap_dir is None:
+            # the matrix only depends on the graph so it is shared between
+            # calls, along with the object that tracks its columns, so the
+            # gap column is set on the rows as they are used
+            A, indexer = _constraint_matrices.get(decision, auxiliaries, list(graph.edges))
+            A = GapColumnMatrix(A, gap_column)
+        else:
+            # create an object to track the columns in the LP matrix
+            indexer = Index(decision, auxiliaries, graph.edges)
+
+            # the file is deleted once A is garbage collected
+            A = np.memmap(tempfile.TemporaryFile(dir=memmap_dir), dtype=np.int8, mode='w+',
+                          shape=(1 << num_variables, len(indexer)))
+            constraint_matrix(indexer, graph.edges, out=A)
+
+            # the gap and b are how we distinguish between values in the
+            # table and not
+            A[:, indexer.gap()] = np.tile(gap_column, 1 << num_auxiliary)
+
+    if stats is not None:
+        stats.matrix_time += time.perf_counter() - t
+
+    # bounds are fixed
+    bounds = indexer.make_bounds(min_classical_gap, linear_bound, quadratic_bound)
+
+    max_gap = indexer.max_gap(linear_bound, quadratic_bound)
+    if lazy_constraints or engine == 'milp':
+        # with only some of the rows or when maximizing the gap directly, the
+        # gap can look unbounded, so we cap it above any finite gap
+        bounds[indexer.gap()] = (min_classical_gap, max(max_gap, min_classical_gap) + 1)
+
+    if engine == 'milp':
+        num_auxiliary_edges = sum(u not in decision or v not in decision for u, v in graph.edges)
+        big_m = 2*(num_auxiliary*max(map(abs, linear_bound))
+                   + num_auxiliary_edges*max(map(abs, quadratic_bound)))
+        gauge = linear_bound[0] == -linear_bound[1] and quadratic_bound[0] == -quadratic_bound[1]
+        t = time.perf_counter()
+        res, auxiliary_configurations = solve_milp(
+            A, b, bounds, ground, num_decision, num_auxiliary, big_m=big_m, fix_first=gauge,
+            time_limit=None if deadline is None else max(deadline - time.monotonic(), 0))
+        if stats is not None:
+            stats.solve_time += time.perf_counter() - t
+            stats.num_solves += 1
+        cut_off = res.status == 1 and deadline is not None
+        if res.status == 2:
+            raise ImpossiblePenaltyModel("There is no BQM that can encode the given constraint")
+        elif cut_off:
+            if res.x is None:
+                raise PenaltyModelTimeout("ran out of time")
+            warnings.warn("ran out of time before maximizing the classical gap",
+                          SuboptimalPenaltyModelWarning, stacklevel=2)
+        elif not res.success:
+            raise RuntimeError("something went wrong")
+
+        # polish, fixing the selected rows exactly, the deadline has passed
+        # if the MILP was cut off but the single LP is needed for the result
+        lp = linear_program(A, b, bounds, backend=backend)
+        lp.deadline = None if cut_off else deadline
+        lp.stats = stats
+        for decision_code, auxiliary_code in auxiliary_configurations.items():
+            lp.fix(decision_code | auxiliary_code << num_decision)
+        c = np.zeros(len(indexer))
+        c[indexer.gap()] = -1
+        res = lp.solve(c)
+        if not res.success:
+            raise RuntimeError("something went wrong")
+        gap = res.x[indexer.gap()] if res.x[indexer.gap()] <= max_gap else float('inf')
+    else:
+        # ok, we have everything in hand to start solving!
+        lp = linear_program(A, b, bounds, lazy=lazy_constraints, backend=backend)
+        lp.deadline = deadline
+        lp.stats = stats
+        lp.separate = separator
+
+        c = np.zeros(len(indexer))
+
+        if num_auxiliary:
+            if symmetry_breaking:
+                gauge = (linear_bound[0] == -linear_bound[1]
+                         and quadratic_bound[0] == -quadratic_bound[1])
+                symmetries = AuxiliarySymmetries.from_graph(graph, decision, auxiliaries,
+                                                            gauge=gauge)
+            else:
+                symmetries = None
+
+            if seed is None:
+                order = ground
+            else:
+                order = np.random.default_rng(seed).permutation(ground).tolist()
+
+            workers = [linear_program(A, b, bounds, lazy=lazy_constraints, backend=backend)
+                       for _ in range(speculate if speculate > 1 else 0)]
+            for worker in workers:
+                worker.separate = separator
+
+            search = AuxiliarySearch(lp, ground, num_decision, num_auxiliary,
+                                     learn_nogoods=learn_nogoods, symmetries=symmetries or None,
+                                     order=order, most_constrained=ordering == 'most-constrained',
+                                     cancel=cancel, callback=callback, workers=workers)
+            res = search.run()
+            auxiliary_configurations = search.auxiliary_configurations
+
+            assert res.success
+        else:
+            # each decision state is its own row, so there is nothing to
+            # search and the gap can be optimized straight away
+            for decision_code in ground:
+                lp.fix(decision_code)
+            auxiliary_configurations = dict.fromkeys(ground, 0)
+            res = None
+
+        # having found something feasible, let's do one last run, this time optimizing the gap
+        c[indexer.gap()] = -1
+        try:
+            res_opt = lp.solve(c)
+        except PenaltyModelTimeout:
+            if res is None:
+                raise
+            # the search's solution is feasible, so we fall back to it
+            warnings.warn("ran out of time before maximizing the classical gap",
+                          SuboptimalPenaltyModelWarning, stacklevel=2)
+            gap = res.x[indexer.gap()] if res.x[indexer.gap()] <= max_gap else float('inf')
+        else:
+            if res_opt.success:
+                res = res_opt
+                gap = res.x[indexer.gap()] if res.x[indexer.gap()] <= max_gap else float('inf')
+            elif res_opt.status == 3:
+                # error code 3 is unbounded objective, which can happen for a fully
+                # specified problem
+                gap = float('inf')
+                if res is None:
+                    c[indexer.gap()] = 0
+                    res = lp.solve(c)
+            elif res_opt.status == 2 and res is None:
+                raise ImpossiblePenaltyModel("There is no BQM that can encode the given constraint")
+            else:
+                raise RuntimeError("something went wrong")
+
+    if stats is not None and gap == float('inf'):
+        # either the solver found it unbounded or it reached the cap
+        stats.unbounded_gap = True
+
+    # let's make the BQM!
+    bqm = dimod.BinaryQuadraticModel('SPIN')
+    bqm.add_linear_from((v, res.x[indexer.variable(v)]) for v in graph.nodes)
+    bqm.add_quadratic_from((u, v, res.x[indexer.interaction(u, v)]) for u, v in graph.edges)
+    bqm.offset = res.x[indexer.offset()]
+
+    # return which auxiliary variables are which
+    aux = dict((spins(decision_code, num_decision),
+                dict(zip(auxiliaries, spins(auxiliary_code, num_auxiliary))))
+               for decision_code, auxiliary_code in auxiliary_configurations.items())
+
+    return bqm, gap, aux
+
+
+class Factor(NamedTuple):
+    """An independent part of a penalty model, see :func:`factorize`."""
+    graph: nx.Graph
+    decision: List[Variable]
+    table: Dict[Tuple[int, ...], float]
+
+    def spread(self) -> float:
+        """The difference between the highest and lowest feasible energies."""
+        return max(self.table.values()) - min(self.table.values()) if self.table else 0
+
+
+def factorize(graph: nx.Graph,
+              decision: Sequence[Variable],
+              table: Mapping[Tuple[int, ...], float],
+              ) -> List[Factor]:
+    """Split a penalty model over the connected components of the graph.
+
+    This is possible if the table is the Cartesian product of tables over the
+    decision variables of each component and its energies are the sums of
+    energies over those tables. The energy of a state of one component is
+    taken relative to a reference state of the others, so the factors' energies
+    add up to the table's.
+
+    Returns:
+        A factor for each component, in graph order, or an empty list if the
+        graph is connected or the table does not factorize.
+
+    """
+    components = list(nx.connected_components(graph))
+    if len(components) < 2 or not table:
+        return []
+
+    states = np.asarray(list(table), dtype=np.int8).reshape(len(table), len(decision))
+    groups = [[k for k, v in enumerate(decision) if v in component] for component in components]
+
+    # the table is a product if it is as large as the product of its projections
+    projections = [np.unique(states[:, columns], axis=0) for columns in groups]
+    if np.prod([len(projection) for projection in projections], dtype=float) != len(table):
+        return []
+
+    reference = states[0].tolist()
+    reference_energy = table[tuple(reference)]
+
+    factors = []
+    for component, columns, projection in zip(components, groups, projections):
+        subtable = dict()
+        for substate in projection.tolist():
+            state = list(reference)
+            for k, spin in zip(columns, substate):
+                state[k] = spin
+            subtable[tuple(substate)] = table[tuple(state)] - reference_energy
+        factors.append(Factor(induced_subgraph(graph, component), [decision[k] for k in columns],
+                              subtable))
+
+    # check that the energies add up
+    energy = np.full(len(table), reference_energy, dtype=float)
+    for factor, columns in zip(factors, groups):
+        energy += [factor.table[tuple(substate)] for substate in states[:, columns].tolist()]
+    if not np.allclose(energy, list(table.values())):
+        return []
+
+    # put the reference energy back into a factor with decision variables
+    base = next(factor for factor in factors if factor.decision)
+    for substate in base.table:
+        base.table[substate] += reference_energy
+
+    return factors
+
+
+PARALLEL_FACTOR_VARIABLES = 10
+"""Factors with at least this many variables are solved in parallel worker
+processes by :func:`generate_factors` when there are two or more of them."""
+
+
+def generate_factors(graph: nx.Graph,
+                     decision: Sequence[Variable],
+                     factors: Sequence[Factor],
+                     *,
+                     min_classical_gap: float = 2,
+                     time_limit: Optional[float] = None,
+                     cancel: Optional[multiprocessing.synchronize.Event] = None,
+                     stats: Optional[GenerationStats] = None,
+                     poll_interval: float = .1,
+                     **kwargs,
+                     ) -> Tuple[dimod.BinaryQuadraticModel, float,
+                                Dict[Tuple[int, ...], Tuple[int, ...]]]:
+    """Generate a penalty model from independent factors and combine them.
+
+    A state that is infeasible in one factor can have the lowest energy in the
+    others, so each factor needs a gap of ``min_classical_gap`` plus the
+    spreads of the others' energies. The combined gap is the smallest of the
+    factors' gaps less those spreads. Any factor can prove that there is no
+    penalty model.
+
+    The remaining keyword arguments are passed to :func:`generate`.
+    """
+    deadline = None if time_limit is None else time.monotonic() + time_limit
+
+    spreads = [factor.spread() for factor in factors]
+    min_gaps = [min_classical_gap + sum(spreads) - spread for spread in spreads]
+
+    def samples(factor: Factor) -> dimod.SampleSet:
+        states, energies = zip(*factor.table.items())
+        return dimod.SampleSet.from_samples((np.asarray(states, dtype=np.int8), factor.decision),
+                                            'SPIN', energy=energies)
+
+    def remaining() -> Optional[float]:
+        return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+    results: Dict[int, Tuple[dimod.BinaryQuadraticModel, float, Dict]] = dict()
+
+    # components without decision variables have nothing to encode
+    for k, factor in enumerate(factors):
+        if not factor.decision:
+            bqm = dimod.BinaryQuadraticModel('SPIN')
+            bqm.add_linear_from((v, 0) for v in factor.graph.nodes)
+            bqm.add_quadratic_from((u, v, 0) for u, v in factor.graph.edges)
+            results[k] = bqm, float('inf'), {(): dict.fromkeys(factor.graph.nodes, -1)}
+
+    large = [k for k, factor in enumerate(factors)
+             if k not in results and factor.graph.number_of_nodes() >= PARALLEL_FACTOR_VARIABLES]
+    if len(large) < 2 or kwargs.get('portfolio', 1) > 1:
+        # a portfolio already runs in worker processes
+        large = []
+
+    if large:
+        stop = multiprocessing.Event()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(large),
+                                                    initializer=_set_cancel,
+                                                    initargs=(stop,)) as executor:
+            futures = dict((executor.submit(_generate_cancellable,
+                                            factors[k].graph, samples(factors[k]),
+                                            min_classical_gap=min_gaps[k], time_limit=remaining(),
+                                            stats=None if stats is None else GenerationStats(),
+                                            **kwargs), k)
+                           for k in large)
+            try:
+                not_done = set(futures)
+                while not_done:
+                    done, not_done = concurrent.futures.wait(
+                        not_done, timeout=None if cancel is None else poll_interval,
+                        return_when=concurrent.futures.FIRST_EXCEPTION)
+                    for future in done:
+                        result, caught, worker_stats = future.result()
+                        for message, category in caught:
+                            warnings.warn(message, category, stacklevel=3)
+                        if stats is not None:
+                            stats.add(worker_stats)
+                        results[futures[future]] = result
+                    if cancel is not None and cancel.is_set():
+                        raise Cancelled
+            finally:
+                stop.set()
+                for future in futures:
+                    future.cancel()
+
+    for k, factor in enumerate(factors):
+        if k not in results:
+            factor_stats = None if stats is None else GenerationStats()
+            try:
+                results[k] = generate(factor.graph, samples(factor),
+                                      min_classical_gap=min_gaps[k], time_limit=remaining(),
+                                      cancel=cancel, stats=factor_stats, **kwargs)
+            finally:
+                if stats is not None:
+                    stats.add(factor_stats)
+
+    # let's make the BQM!
+    bqm = dimod.BinaryQuadraticModel('SPIN')
+    bqm.add_linear_from((v, 0) for v in graph.nodes)
+    bqm.add_quadratic_from((u, v, 0) for u, v in graph.edges)
+    for k in range(len(factors)):
+        bqm.update(results[k][0])
+
+    gap = min(results[k][1] - sum(spreads) + spreads[k] for k in range(len(factors)))
+
+    if stats is not None:
+        # a factor's gap can be unbounded while the combined gap is not
+        stats.unbounded_gap = gap == float('inf')
+
+    # every combination of the factors' feasible states is feasible
+    aux = dict()
+    for combination in itertools.product(*(results[k][2].items() for k in range(len(factors)))):
+        spin = dict()
+        configuration = dict()
+        for factor, (substate, subconfiguration) in zip(factors, combination):
+            spin.update(zip(factor.decision, substate))
+            configuration.update(subconfiguration)
+        aux[tuple(spin[v] for v in decision)] = configuration
+
+    return bqm, gap, aux
+
+
+def connect_all(graph: nx.Graph, v: Variable) -> Iterable[Variable]:
+    """Connect a new auxiliary variable to every node of the graph, see
+    :func:`generate_min_auxiliary`.
+    """
+    return list(graph.nodes)
+
+
+def generate_min_auxiliary(samples_like,
+                           max_auxiliary: int,
+                           *,
+                           graph_like: Optional[GraphLike] = None,
+                           connect: Callable[[nx.Graph, Variable],
+                                             Iterable[Variable]] = connect_all,
+                           labels: Optional[Iterable[Variable]] = None,
+                           time_limit: Optional[float] = None,
+                           **kwargs,
+                           ) -> Tuple[dimod.BinaryQuadraticModel, float,
+                                      Dict[Tuple[int, ...], Tuple[int, ...]]]:
+    """Generate a penalty model with as few auxiliary variables as possible.
+
+    The search starts from ``graph_like``, by default the complete graph over
+    the decision variables, and adds one auxiliary variable at a time until
+    :func:`generate` succeeds. Each new auxiliary variable ``v`` is connected
+    to the nodes returned by ``connect(graph, v)``, by default every node.
+    The new variables are taken from ``labels``, by default the smallest
+    non-negative integers not already in the graph.
+
+    The remaining keyword arguments are passed to :func:`generate`, and
+    ``time_limit`` applies to all of the rounds together. If the constraint
+    matrix of a round is cached, the next round's is extended from it with
+    :func:`extend_constraint_matrix` rather than built from scratch. The
+    auxiliary search of each round starts over, as the conflicts learned
+    with fewer auxiliary variables need not hold with more.
+
+    Returns:
+        The result of :func:`generate` for the first graph that succeeds. The
+        auxiliary variables are the nodes of the binary quadratic model that
+        are not decision variables.
+
+    Raises:
+        ImpossiblePenaltyModel: If there is no penalty model with
+            ``max_auxiliary`` or fewer auxiliary variables.
+        PenaltyModelTimeout: If the time runs out.
+
+    """
+    deadline = None if time_limit is None else time.monotonic() + time_limit
+
+    decision = dimod.as_samples(samples_like)[1]
+    if graph_like is None:
+        graph_like = decision
+    # copy so that we can add to it
+    graph = nx.Graph(as_graph(graph_like))
+
+    stats: Optional[GenerationStats] = kwargs.get('stats')
+    previous = None  # the key of the last round's constraint matrix
+
+    if labels is None:
+        labels = (v for v in itertools.count() if v not in graph)
+    labels = iter(labels)
+
+    for num_added in range(max_auxiliary + 1):
+        if num_added:
+            v = next(labels)
+            if v in graph:
+                raise ValueError(f"auxiliary variable {v!r} is already in the graph")
+            neighbours = list(connect(graph, v))
+            graph.add_node(v)
+            graph.add_edges_from((u, v) for u in neighbours)
+
+        # the key that generate() uses for the constraint matrix
+        key = (decision, [u for u in graph.nodes if u not in decision], list(graph.edges))
+        cached = None if previous is None else _constraint_matrices.lookup(*previous)
+        if cached is not None and _constraint_matrices.lookup(*key) is None:
+            t = time.perf_counter()
+            A, indexer = extend_constraint_matrix(*cached, *key)
+            A.flags.writeable = False
+            if _constraint_matrices._size(A) <= _constraint_matrices.max_bytes:
+                _constraint_matrices.put(*key, A, indexer)
+            if stats is not None:
+                stats.matrix_time += time.perf_counter() - t
+        previous = key
+
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            raise PenaltyModelTimeout("ran out of time")
+
+        try:
+            return generate(graph, samples_like, time_limit=remaining, **kwargs)
+        except ImpossiblePenaltyModel:
+            pass
+
+    raise ImpossiblePenaltyModel(f"There is no BQM that can encode the given constraint "
+                                 f"with {max_auxiliary} or fewer auxiliary variables")
+
+
+# set in each portfolio worker process
+_cancel: Optional[multiprocessing.synchronize.Event] = None
+
+
+def _set_cancel(cancel: multiprocessing.synchronize.Event):
+    global _cancel
+    _cancel = cancel
+
+
+def _generate_cancellable(*args, stats: Optional[GenerationStats] = None, **kwargs):
+    # warnings are not shown in the parent process, so we pass them back,
+    # along with the stats
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        result = generate(*args, cancel=_cancel, stats=stats, **kwargs)
+    return result, [(str(w.message), w.category) for w in caught], stats
+
+
+def generate_portfolio(graph: nx.Graph,
+                       samples_like,
+                       portfolio: int,
+                       *,
+                       seed: Optional[Union[int, np.random.SeedSequence]] = None,
+                       cancel: Optional[multiprocessing.synchronize.Event] = None,
+                       poll_interval: float = .1,
+                       stats: Optional[GenerationStats] = None,
+                       **kwargs,
+                       ) -> Tuple[dimod.BinaryQuadraticModel, float,
+                                  Dict[Tuple[int, ...], Tuple[int, ...]]]:
+    """Run :func:`generate` with differently ordered searches in parallel and
+    return the result of the first to finish.
+
+    Any search can prove that there is no penalty model, so if the first to
+    finish raises :exc:`~penaltymodel.ImpossiblePenaltyModel` it is raised.
+
+    If ``cancel`` is given, it is checked every ``poll_interval`` seconds and
+    once it is set the searches are cancelled and :exc:`Cancelled` is raised.
+
+    If ``stats`` is given, the statistics of the search whose result is
+    returned are added to it.
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        seed_sequence = seed
+    else:
+        seed_sequence = np.random.SeedSequence(seed)
+    seeds = [seed] + seed_sequence.spawn(portfolio - 1)
+
+    stop = multiprocessing.Event()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=portfolio,
+                                                initializer=_set_cancel,
+                                                initargs=(stop,)) as executor:
+        futures = [executor.submit(_generate_cancellable, graph, samples_like, seed=s,
+                                   stats=None if stats is None else GenerationStats(), **kwargs)
+                   for s in seeds]
+        try:
+            while True:
+                done, _ = concurrent.futures.wait(
+                    futures, timeout=None if cancel is None else poll_interval,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                if done:
+                    # prefer the earliest submitted if several finished
+                    first = next(future for future in futures if future in done)
+                    result, caught, worker_stats = first.result()
+                    for message, category in caught:
+                        warnings.warn(message, category, stacklevel=2)
+                    if stats is not None:
+                        stats.add(worker_stats)
+                    return result
+                if cancel.is_set():
+                    raise Cancelled
+        finally:
+            # stop the other searches so that the executor can shut down
+            stop.set()
+            for future in futures:
+                future.cancel()
@@ -14,21 +14,32 @@
 
 r"""This package implements the generation and caching of :term:`penalty model`\ s."""
 
+import concurrent.futures
 import copy
+import warnings
 
-from typing import Mapping, Optional, Sequence, Tuple
+from typing import (Dict, Hashable, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple,
+                    Union)
 
 import dimod
 import networkx as nx
+import numpy as np
 
 from dimod.typing import Variable
 
 from penaltymodel.database import PenaltyModelCache
-from penaltymodel.exceptions import MissingPenaltyModel
-from penaltymodel.generation import generate
+from penaltymodel.exceptions import (ImpossiblePenaltyModel, MissingPenaltyModel,
+                                     PenaltyModelTimeout, SuboptimalPenaltyModelWarning)
+from penaltymodel.generation import (ConstraintMatrixCache, GenerationStats,
+                                     SharedConstraintMatrices, SharedMatrixHandle,
+                                     attach_constraint_matrices, constraint_matrix_cache, generate,
+                                     generate_min_auxiliary)
 from penaltymodel.typing import GraphLike
+from penaltymodel.utils import as_graph
 
-__all__ = ['get_penalty_model']
+__all__ = ['ConstraintMatrixCache', 'GenerationStats', 'constraint_matrix_cache',
+           'generate_min_auxiliary', 'get_penalty_model', 'get_penalty_models',
+           'iter_penalty_models']
 
 
 def get_penalty_model(samples_like,
@@ -38,6 +49,8 @@ def get_penalty_model(samples_like,
                       quadratic_bound: Tuple[float, float] = (-1, 1),
                       min_classical_gap: float = 2,
                       use_cache: bool = True,
+                      time_limit: Optional[float] = None,
+                      stats: Optional[GenerationStats] = None,
                       ) -> Tuple[dimod.BinaryQuadraticModel, float]:
     """Get a penalty model for a specific graph and set of target states.
 
@@ -88,6 +101,18 @@ def get_penalty_model(samples_like,
             Whether to attempt to retrieve models from the cache. If ``False``,
             a new model will always be generated.
 
+        time_limit:
+            The maximum number of seconds to spend generating a new model.
+            If the time runs out after a model is found but before its
+            classical gap is maximized, that model is returned, a
+            :exc:`SuboptimalPenaltyModelWarning` is issued and the model is
+            not cached.
+
+        stats:
+            If given, a :class:`GenerationStats` that is filled in with
+            statistics about the generation, and with whether the model was
+            found in the cache.
+
     Returns:
         A 2-tuple of the binary quadratic model and the classical gap. Note
         that the binary quadratic model always has vartype ``'SPIN'``.
@@ -97,6 +122,9 @@ def get_penalty_model(samples_like,
             If it is not possible to construct a penalty model for the given
             structure and feasible states.
 
+        PenaltyModelTimeout:
+            If no model is found within ``time_limit`` seconds.
+
     Examples:
 
         >>> import dimod
@@ -134,24 +162,357 @@ def get_penalty_model(samples_like,
     if use_cache:
         with PenaltyModelCache() as cache:
             try:
-                return cache.retrieve(samples_like=samples_like,
-                                      graph_like=graph_like,
-                                      linear_bound=linear_bound,
-                                      quadratic_bound=quadratic_bound,
-                                      min_classical_gap=min_classical_gap,
-                                      )
+                model = cache.retrieve(samples_like=samples_like,
+                                       graph_like=graph_like,
+                                       linear_bound=linear_bound,
+                                       quadratic_bound=quadratic_bound,
+                                       min_classical_gap=min_classical_gap,
+                                       )
             except MissingPenaltyModel:
                 pass  # generate
+            else:
+                if stats is not None:
+                    stats.cache_hit = True
+                return model
+
+        if stats is not None:
+            stats.cache_hit = False
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always', SuboptimalPenaltyModelWarning)
+        bqm, gap, _ = generate(graph_like=graph_like,
+                               samples_like=samples_like,
+                               linear_bound=linear_bound,
+                               quadratic_bound=quadratic_bound,
+                               min_classical_gap=min_classical_gap,
+                               time_limit=time_limit,
+                               stats=stats,
+                               )
+
+    # pass the warnings on, noting whether the gap was maximized
+    suboptimal = False
+    for w in caught:
+        suboptimal |= issubclass(w.category, SuboptimalPenaltyModelWarning)
+        warnings.warn_explicit(w.message, w.category, w.filename, w.lineno, source=w.source)
+
+    if use_cache and not suboptimal:
+        with PenaltyModelCache() as cache:
+            cache.insert_penalty_model(bqm, samples_like, gap)
 
-    bqm, gap, _ = generate(graph_like=graph_like,
-                           samples_like=samples_like,
-                           linear_bound=linear_bound,
-                           quadratic_bound=quadratic_bound,
-                           min_classical_gap=min_classical_gap,
-                           )
+    return bqm, gap
+
+
+def _spec_key(samples_like, graph: nx.Graph) -> Hashable:
+    """Create a hashable key that identifies a (samples_like, graph) pair."""
+    samples, labels = dimod.as_samples(samples_like)
+
+    if isinstance(samples_like, dimod.SampleSet):
+        energies = np.asarray(samples_like.record.energy, dtype=float)
+    else:
+        energies = np.zeros(samples.shape[0])
+
+    # 0/1 and -1/+1 samples generate the same penalty model, see generate()
+    samples = np.asarray(samples, dtype=np.int8)
+    if (samples == 0).any():
+        samples = 2*samples - 1
+
+    # the order of the samples does not matter
+    order = np.lexsort(samples.transpose(), axis=0) if samples.size else np.arange(len(energies))
+
+    return (tuple(labels),
+            samples.shape,
+            samples[order, :].tobytes(),
+            energies[order].tobytes(),
+            tuple(graph.nodes),
+            frozenset(map(frozenset, graph.edges)),
+            )
+
+
+def iter_penalty_models(specs: Iterable[Tuple[object, Optional[GraphLike]]],
+                        *,
+                        linear_bound: Tuple[float, float] = (-2, 2),
+                        quadratic_bound: Tuple[float, float] = (-1, 1),
+                        min_classical_gap: float = 2,
+                        use_cache: bool = True,
+                        workers: Optional[int] = None,
+                        time_limit: Optional[float] = None,
+                        engine: str = 'auto',
+                        lazy_constraints: bool = False,
+                        errors: str = 'raise',
+                        ) -> Iterator[Tuple[int, Union[dimod.BinaryQuadraticModel, Exception],
+                                            Optional[float]]]:
+    """Get penalty models for many specifications, in completion order.
+
+    Duplicate specifications are only generated once. Models found in the
+    cache are yielded first, the remaining models are generated in a process
+    pool and yielded as they complete. Newly generated models are written
+    to the cache in a single transaction once generation finishes, including
+    those that finish after another specification failed.
+
+    The constraint matrix of a graph that several of the specifications
+    share is built once in shared memory, which the worker processes read
+    without copying it. Unless the linear programs add rows lazily, as with
+    ``lazy_constraints=True`` or ``engine='lazy'``, each worker's solver
+    still copies every row of the matrix as floats, so sharing it saves
+    little memory.
+
+    Args:
+        specs:
+            An iterable of 2-tuples ``(samples_like, graph_like)``. See
+            :func:`get_penalty_model` for a description of each. ``graph_like``
+            may be ``None``.
 
+        linear_bound:
+            The range allowed for the linear biases of the binary quadratic
+            models.
+
+        quadratic_bound:
+            The range allowed for the quadratic biases of the binary quadratic
+            models.
+
+        min_classical_gap:
+            The minimum classical gap of each penalty model.
+
+        use_cache:
+            Whether to attempt to retrieve models from the cache and to store
+            newly generated models in it.
+
+        workers:
+            The maximum number of worker processes used for generation.
+            If ``None``, defaults to the number of processors on the machine.
+            If ``1``, the models are generated serially in the current
+            process.
+
+        time_limit:
+            The maximum number of seconds to spend generating each new model,
+            see :func:`get_penalty_model`. Models whose classical gap was not
+            maximized are not cached.
+
+        engine:
+            The generation engine, see :func:`~penaltymodel.generation.generate`.
+
+        lazy_constraints:
+            Whether the linear programs start without rows and add the
+            violated ones as needed, see
+            :func:`~penaltymodel.generation.generate`.
+
+        errors:
+            If ``'raise'``, the first specification that fails raises its
+            exception. If ``'return'``, the exception is yielded in place of
+            the binary quadratic model, with a gap of ``None``, and the other
+            specifications carry on.
+
+    Yields:
+        3-tuples ``(index, bqm, gap)`` where ``index`` is the position of the
+        specification in ``specs``.
+
+    Raises:
+        ImpossiblePenaltyModel:
+            If it is not possible to construct a penalty model for one of the
+            specifications and ``errors`` is ``'raise'``.
+
+        PenaltyModelTimeout:
+            If no model is found for one of the specifications within
+            ``time_limit`` seconds and ``errors`` is ``'raise'``.
+
+    """
+    if errors not in ('raise', 'return'):
+        raise ValueError(f"unknown errors {errors!r}, expected 'raise' or 'return'")
+
+    kwargs = dict(linear_bound=linear_bound,
+                  quadratic_bound=quadratic_bound,
+                  min_classical_gap=min_classical_gap)
+    generate_kwargs = dict(kwargs, time_limit=time_limit, engine=engine,
+                           lazy_constraints=lazy_constraints)
+
+    # deduplicate, keeping track of which indices want which model
+    unique: Dict[Hashable, Tuple[object, nx.Graph]] = dict()
+    indices: Dict[Hashable, List[int]] = dict()
+    for i, (samples_like, graph_like) in enumerate(specs):
+        if graph_like is None:
+            samples, labels = dimod.as_samples(samples_like)
+            graph_like = nx.complete_graph(labels)
+        graph = as_graph(graph_like)
+
+        key = _spec_key(samples_like, graph)
+        unique.setdefault(key, (samples_like, graph))
+        indices.setdefault(key, []).append(i)
+
+    # check the cache for the whole batch with one connection
+    missing = list(unique)
     if use_cache:
+        missing = []
         with PenaltyModelCache() as cache:
-            cache.insert_penalty_model(bqm, samples_like, gap)
+            for key, (samples_like, graph) in unique.items():
+                try:
+                    bqm, gap = cache.retrieve(samples_like, graph, **kwargs)
+                except MissingPenaltyModel:
+                    missing.append(key)
+                    continue
+
+                for i in indices[key]:
+                    yield i, bqm.copy(), gap
+
+    if not missing:
+        return
+
+    generated = []
+    recorded = set()
+
+    def record(key: Hashable, result: Tuple[dimod.BinaryQuadraticModel, float, List]):
+        bqm, gap, caught = result
+        recorded.add(key)
+        for message, category in caught:
+            warnings.warn(message, category, stacklevel=3)
+        if not any(issubclass(category, SuboptimalPenaltyModelWarning) for _, category in caught):
+            generated.append((bqm, unique[key][0], gap))
+
+    futures: Dict[concurrent.futures.Future, Hashable] = dict()
+    try:
+        if workers == 1 or len(missing) == 1:
+            for key in missing:
+                samples_like, graph = unique[key]
+                try:
+                    result = _generate_model(graph, samples_like, **generate_kwargs)
+                except (ImpossiblePenaltyModel, PenaltyModelTimeout) as err:
+                    if errors == 'raise':
+                        raise
+                    for i in indices[key]:
+                        yield i, err, None
+                    continue
+
+                record(key, result)
+                bqm, gap, _ = result
+                for i in indices[key]:
+                    yield i, bqm.copy(), gap
+        else:
+            with SharedConstraintMatrices() as shared, \
+                    concurrent.futures.ProcessPoolExecutor(
+                        max_workers=workers,
+                        initializer=attach_constraint_matrices,
+                        initargs=(_share_matrices(shared, missing, unique),),
+                    ) as executor:
+                for key in missing:
+                    samples_like, graph = unique[key]
+                    future = executor.submit(_generate_model, graph, samples_like,
+                                             **generate_kwargs)
+                    futures[future] = key
+
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        key = futures[future]
+                        try:
+                            result = future.result()
+                        except (ImpossiblePenaltyModel, PenaltyModelTimeout) as err:
+                            if errors == 'raise':
+                                raise
+                            for i in indices[key]:
+                                yield i, err, None
+                            continue
+
+                        record(key, result)
+                        bqm, gap, _ = result
+                        for i in indices[key]:
+                            yield i, bqm.copy(), gap
+                finally:
+                    # the running ones finish before the executor shuts down
+                    for future in futures:
+                        future.cancel()
+    finally:
+        # keep the models that finished after an error or after the caller
+        # stopped iterating
+        for future, key in futures.items():
+            if (key not in recorded and future.done() and not future.cancelled()
+                    and future.exception() is None):
+                record(key, future.result())
+
+        if use_cache and generated:
+            with PenaltyModelCache() as cache:
+                cache.insert_penalty_models(generated)
+
+
+def _generate_model(graph: nx.Graph, samples_like, **kwargs,
+                    ) -> Tuple[dimod.BinaryQuadraticModel, float, List]:
+    # warnings in worker processes are not shown in the parent process, so
+    # we pass them back
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always', SuboptimalPenaltyModelWarning)
+        bqm, gap, _ = generate(graph, samples_like, **kwargs)
+    return bqm, gap, [(str(w.message), w.category) for w in caught]
+
+
+def _share_matrices(shared: SharedConstraintMatrices,
+                    keys: Iterable[Hashable],
+                    unique: Mapping[Hashable, Tuple[object, nx.Graph]],
+                    ) -> List[SharedMatrixHandle]:
+    """Publish the constraint matrices needed by more than one of the given
+    specifications and return their handles.
+    """
+    counts: Dict[Hashable, int] = dict()
+    for key in keys:
+        samples_like, graph = unique[key]
+        if not len(graph) or not nx.is_connected(graph):
+            # generate() splits these into components
+            continue
+        _, labels = dimod.as_samples(samples_like)
+        auxiliary = tuple(v for v in graph.nodes if v not in labels)
+        matrix = (tuple(labels), auxiliary, tuple(graph.edges))
+        counts[matrix] = counts.get(matrix, 0) + 1
+
+    for matrix, count in counts.items():
+        if count > 1:
+            shared.publish(*matrix)
+    return shared.handles()
+
+
+def get_penalty_models(specs: Iterable[Tuple[object, Optional[GraphLike]]],
+                       *,
+                       linear_bound: Tuple[float, float] = (-2, 2),
+                       quadratic_bound: Tuple[float, float] = (-1, 1),
+                       min_classical_gap: float = 2,
+                       use_cache: bool = True,
+                       workers: Optional[int] = None,
+                       time_limit: Optional[float] = None,
+                       engine: str = 'auto',
+                       lazy_constraints: bool = False,
+                       errors: str = 'raise',
+                       ) -> List[Union[Tuple[dimod.BinaryQuadraticModel, float], Exception]]:
+    """Get penalty models for many specifications.
+
+    This is the batch version of :func:`get_penalty_model`. See
+    :func:`iter_penalty_models` for a description of the arguments.
 
-    return bqm, gap
+    Returns:
+        A list of 2-tuples of the binary quadratic model and the classical
+        gap, in the same order as ``specs``. If ``errors`` is ``'return'``,
+        a specification that failed has its exception in place of the
+        2-tuple.
+
+    Examples:
+
+        >>> import penaltymodel
+
+        This example generates penalty models for an AND gate and an OR gate,
+        each over a fully-connected graph.
+
+        >>> AND = [[0, 0, 0], [0, 1, 0], [1, 0, 0], [1, 1, 1]]
+        >>> OR = [[0, 0, 0], [0, 1, 1], [1, 0, 1], [1, 1, 1]]
+        >>> models = penaltymodel.get_penalty_models([(AND, None), (OR, None)], workers=1)
+        >>> len(models)
+        2
+
+    """
+    results: Dict[int, Union[Tuple[dimod.BinaryQuadraticModel, float], Exception]] = dict()
+    for i, bqm, gap in iter_penalty_models(specs,
+                                           linear_bound=linear_bound,
+                                           quadratic_bound=quadratic_bound,
+                                           min_classical_gap=min_classical_gap,
+                                           use_cache=use_cache,
+                                           workers=workers,
+                                           time_limit=time_limit,
+                                           engine=engine,
+                                           lazy_constraints=lazy_constraints,
+                                           errors=errors,
+                                           ):
+        results[i] = bqm if isinstance(bqm, Exception) else (bqm, gap)
+    return [results[i] for i in range(len(results))]
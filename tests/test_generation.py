@@ -15,17 +15,39 @@
 # developer note: this combines all of the tests from maxgap and mip
 # before we merged. There is likely a lot of redundancy
 
+import concurrent.futures
 import itertools
+import tempfile
+import threading
+import time
 import unittest
+import unittest.mock
 
 import dimod
 import networkx as nx
-
-from penaltymodel.generation import generate, ImpossiblePenaltyModel
+import numpy as np
+import scipy.optimize
+import scipy.sparse
+
+import penaltymodel.generation
+
+from penaltymodel import PenaltyModelTimeout, SuboptimalPenaltyModelWarning
+from penaltymodel.generation import (generate, generate_min_auxiliary, Cancelled,
+                                     ImpossiblePenaltyModel)
+from penaltymodel.generation import (AuxiliarySearch, AuxiliarySymmetries, ConstraintMatrixCache,
+                                     EngineRule, GenerationStats, SharedConstraintMatrices,
+                                     TableReduction, ImplicitConstraintMatrix, TiledVector,
+                                     TreeSeparator, attach_constraint_matrices, elimination_order,
+                                     extend_constraint_matrix, factorize, precheck, Index, Nogoods,
+                                     constraint_matrix, linear_program, select_engine, sparse_rows)
+from penaltymodel.generation import all_possible, last_auxiliary, next_auxiliary, spins, state_codes
 from penaltymodel.utils import table_to_sampleset
 
 MAX_GAP_DELTA = 0.01
 
+# the 'milp' engine needs scipy.optimize.milp, added in scipy 1.9
+HAS_MILP = hasattr(scipy.optimize, 'milp')
+
 
 class TestGenerate(unittest.TestCase):
     def check_bqm_table(self, bqm, gap, table, decision):
@@ -400,6 +422,54 @@ class TestGenerate(unittest.TestCase):
         with self.assertRaises(ImpossiblePenaltyModel):
             generate(graph, table_to_sampleset(configurations, decision_variables))
 
+    def test_more_than_8_variables(self):
+        graph = nx.cycle_graph(10)
+        configurations = {(-1, -1, -1): 0,
+                          (+1, +1, +1): 0}
+        decision_variables = (0, 1, 5)
+
+        self.generate_and_check(graph, configurations, decision_variables)
+
+    def test_memmap(self):
+        graph = nx.complete_graph(4)
+        configurations = {(-1, -1, -1): 0,
+                          (-1, +1, -1): 0,
+                          (+1, -1, -1): 0,
+                          (+1, +1, +1): 0}
+        decision_variables = (0, 1, 2)
+
+        with tempfile.TemporaryDirectory() as d:
+            self.generate_and_check(graph, configurations, decision_variables, memmap_dir=d)
+
+    def test_memmap_lazy_14_variables(self):
+        graph = nx.cycle_graph(14)
+        configurations = {(-1, -1, -1): 0,
+                          (+1, +1, +1): 0}
+        decision_variables = (0, 1, 5)
+
+        with tempfile.TemporaryDirectory() as d:
+            self.generate_and_check(graph, configurations, decision_variables,
+                                    memmap_dir=d, lazy_constraints=True)
+
+    def test_impossible_xor_K5(self):
+        graph = nx.complete_graph(5)
+        configurations = {(-1, -1, -1): 0,
+                          (-1, +1, +1): 0,
+                          (+1, -1, +1): 0,
+                          (+1, +1, -1): 0}
+        decision_variables = (0, 1, 2)
+
+        with self.assertRaises(ImpossiblePenaltyModel):
+            generate(graph, table_to_sampleset(configurations, decision_variables),
+                     min_classical_gap=3)
+
+    def test_unknown_ordering(self):
+        graph = nx.complete_graph(3)
+        configurations = {(-1, -1): 0, (+1, +1): 0}
+
+        with self.assertRaises(ValueError):
+            generate(graph, table_to_sampleset(configurations, (0, 1)), ordering='fastest')
+
     def test_empty_no_aux(self):
         graph = nx.Graph()
         sample = {}
@@ -472,3 +542,1673 @@ class TestGenerate(unittest.TestCase):
             sample.update(aux_configs[config])
 
             self.assertAlmostEqual(bqm.energy(sample), 0.0)
+
+
+@unittest.mock.patch('penaltymodel.generation.highspy', None)
+class TestGenerateLinprog(TestGenerate):
+    """Run all of the generation tests without highspy."""
+
+
+class TestGenerateOptions(unittest.TestCase):
+    """Check a few typical problems against combinations of the options."""
+    check_bqm_table = TestGenerate.check_bqm_table
+
+    options = [dict(lazy_constraints=True),
+               dict(lazy_constraints=True, highspy=False),
+               dict(learn_nogoods=False),
+               dict(symmetry_breaking=False),
+               dict(symmetry_breaking=False, learn_nogoods=False, linear_bound=(-2, 1)),
+               dict(seed=42),
+               dict(ordering='most-constrained'),
+               dict(ordering='most-constrained', learn_nogoods=False, lazy_constraints=True),
+               ]
+
+    def test_options(self):
+        AND = {(-1, -1, -1): 0,
+               (-1, +1, -1): 0,
+               (+1, -1, -1): 0,
+               (+1, +1, +1): 0}
+        XOR = {(-1, -1, -1): 0,
+               (-1, +1, +1): 0,
+               (+1, -1, +1): 0,
+               (+1, +1, -1): 0}
+        NAE3SAT = {config: 0 for config in itertools.product((-1, 1), repeat=3)
+                   if len(set(config)) > 1}
+
+        problems = [(nx.complete_graph(4), AND, (0, 1, 2), {}),
+                    (nx.complete_graph(5), XOR, (0, 1, 2), {}),
+                    (nx.cycle_graph(4), NAE3SAT, (0, 1, 2), {}),
+                    (nx.cycle_graph(10), {(-1, -1, -1): 0, (+1, +1, +1): 0}, (0, 1, 5), {}),
+                    (nx.complete_graph(3), {(-1, -1): 0, (+1, +1): 0.5}, (0, 1),
+                     dict(min_classical_gap=1)),
+                    ]
+
+        for options in self.options:
+            options = dict(options)
+            highs = options.pop('highspy', True)
+            with self.subTest(**options, highspy=highs), \
+                    unittest.mock.patch('penaltymodel.generation.highspy',
+                                        penaltymodel.generation.highspy if highs else None):
+                for graph, table, decision, kwargs in problems:
+                    bqm, gap, aux = generate(graph, table_to_sampleset(table, decision),
+                                             **kwargs, **options)
+                    self.check_bqm_table(bqm, gap, table, decision)
+
+                with self.assertRaises(ImpossiblePenaltyModel):
+                    generate(nx.complete_graph(3), table_to_sampleset(XOR, (0, 1, 2)), **options)
+
+
+class TestNoAuxiliary(unittest.TestCase):
+    check_bqm_table = TestGenerate.check_bqm_table
+
+    def test_single_solve(self):
+        graph = nx.complete_graph(3)
+        configurations = {(-1, -1, -1): 0,
+                          (-1, +1, -1): 0,
+                          (+1, -1, -1): 0,
+                          (+1, +1, +1): 0}
+        samples = table_to_sampleset(configurations, (0, 1, 2))
+
+        for options in [dict(), dict(lazy_constraints=True), dict(portfolio=2)]:
+            with self.subTest(**options):
+                self.assertEqual(count_solves(graph, samples, **options), 1)
+
+                bqm, gap, aux = generate(graph, samples, **options)
+                self.check_bqm_table(bqm, gap, configurations, (0, 1, 2))
+                self.assertEqual(aux, {config: {} for config in configurations})
+
+    def test_impossible(self):
+        graph = nx.complete_graph(3)
+        configurations = {(-1, -1, -1): 0,
+                          (-1, +1, +1): 0,
+                          (+1, -1, +1): 0,
+                          (+1, +1, -1): 0}
+        samples = table_to_sampleset(configurations, (0, 1, 2))
+
+        # the prechecks catch XOR without solving anything
+        self.assertEqual(count_solves(graph, samples, prechecks=False), 1)
+        self.assertEqual(count_solves(graph, samples), 0)
+        for prechecks in [True, False]:
+            with self.assertRaises(ImpossiblePenaltyModel):
+                generate(graph, samples, prechecks=prechecks)
+
+    def test_unbounded_gap(self):
+        # every state is feasible, so there is no gap to optimize
+        graph = nx.complete_graph(2)
+        configurations = {config: 0 for config in itertools.product((-1, 1), repeat=2)}
+
+        bqm, gap, aux = generate(graph, table_to_sampleset(configurations, (0, 1)))
+
+        self.assertEqual(gap, float('inf'))
+        for config in configurations:
+            self.assertAlmostEqual(bqm.energy((config, (0, 1))), 0)
+
+
+class TestMinAuxiliary(unittest.TestCase):
+    check_bqm_table = TestGenerate.check_bqm_table
+
+    XOR = {(-1, -1, -1): 0,
+           (-1, +1, +1): 0,
+           (+1, -1, +1): 0,
+           (+1, +1, -1): 0}
+
+    def test_no_auxiliary(self):
+        AND = {(-1, -1, -1): 0,
+               (-1, +1, -1): 0,
+               (+1, -1, -1): 0,
+               (+1, +1, +1): 0}
+
+        bqm, gap, aux = generate_min_auxiliary(table_to_sampleset(AND, 'abc'), 2)
+
+        self.assertEqual(set(bqm.variables), set('abc'))
+        self.check_bqm_table(bqm, gap, AND, 'abc')
+
+    def test_xor(self):
+        samples = table_to_sampleset(self.XOR, (0, 1, 2))
+
+        with unittest.mock.patch('penaltymodel.generation.generate',
+                                 side_effect=penaltymodel.generation.generate) as mock:
+            bqm, gap, aux = generate_min_auxiliary(samples, 3, min_classical_gap=1)
+
+        # stops at the first graph that works
+        self.assertEqual(mock.call_count, 2)
+        self.assertEqual(set(bqm.variables), {0, 1, 2, 3})
+        self.assertEqual(len(bqm.quadratic), 6)
+        self.check_bqm_table(bqm, gap, self.XOR, (0, 1, 2))
+
+        # a larger gap needs another auxiliary variable
+        bqm, gap, aux = generate_min_auxiliary(samples, 3)
+        self.assertEqual(set(bqm.variables), {0, 1, 2, 3, 4})
+        self.check_bqm_table(bqm, gap, self.XOR, (0, 1, 2))
+
+    def test_connect(self):
+        # each auxiliary is only connected to the decision variables, which
+        # are a path
+        samples = table_to_sampleset(self.XOR, 'abc')
+
+        bqm, gap, aux = generate_min_auxiliary(samples, 3,
+                                               graph_like=nx.path_graph('abc'),
+                                               connect=lambda graph, v: 'abc',
+                                               labels=['x', 'y', 'z'])
+
+        self.assertEqual(set(bqm.variables) - set('abc'), {'x', 'y'})
+        self.assertEqual(set(map(frozenset, bqm.quadratic)),
+                         {frozenset(e) for e in ['ab', 'bc', 'ax', 'bx', 'cx', 'ay', 'by', 'cy']})
+        self.check_bqm_table(bqm, gap, self.XOR, 'abc')
+
+    def test_extends_constraint_matrix(self):
+        samples = table_to_sampleset(self.XOR, (0, 1, 2))
+        cache = ConstraintMatrixCache()
+
+        with unittest.mock.patch('penaltymodel.generation._constraint_matrices', cache):
+            bqm, gap, aux = generate_min_auxiliary(samples, 3)
+
+        # the matrix with one auxiliary variable is built, the one with two is
+        # extended from it
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(set(bqm.variables), {0, 1, 2, 3, 4})
+        self.check_bqm_table(bqm, gap, self.XOR, (0, 1, 2))
+
+        (A, indexer), = [value for key, value in cache._cache.items() if key[1] == (3, 4)]
+        graph = nx.complete_graph(5)
+        np.testing.assert_array_equal(A, constraint_matrix(indexer, graph.edges))
+
+    def test_impossible(self):
+        with self.assertRaises(ImpossiblePenaltyModel):
+            generate_min_auxiliary(table_to_sampleset(self.XOR, (0, 1, 2)), 1)
+
+    def test_label_in_graph(self):
+        with self.assertRaises(ValueError):
+            generate_min_auxiliary(table_to_sampleset(self.XOR, (0, 1, 2)), 1, labels=[2])
+
+    def test_timeout(self):
+        with self.assertRaises(PenaltyModelTimeout):
+            generate_min_auxiliary(table_to_sampleset(self.XOR, (0, 1, 2)), 3, time_limit=0)
+
+
+class TestGenerationStats(unittest.TestCase):
+    XOR = {(-1, -1, -1): 0,
+           (-1, +1, +1): 0,
+           (+1, -1, +1): 0,
+           (+1, +1, -1): 0}
+
+    def test_search(self):
+        samples = table_to_sampleset(self.XOR, (0, 1, 2))
+
+        for options in [dict(), dict(lazy_constraints=True), dict(highspy=False)]:
+            options = dict(options)
+            highs = options.pop('highspy', True)
+            with self.subTest(**options, highspy=highs), \
+                    unittest.mock.patch('penaltymodel.generation.highspy',
+                                        penaltymodel.generation.highspy if highs else None):
+                stats = GenerationStats()
+                num_solves = count_solves(nx.complete_graph(5), samples, stats=stats, **options)
+
+                if not options:
+                    self.assertEqual(stats.num_solves, num_solves)
+                else:
+                    # lazy mode re-solves after adding rows
+                    self.assertGreaterEqual(stats.num_solves, num_solves)
+                self.assertGreater(stats.num_backtracks, 0)
+                self.assertGreater(stats.matrix_time, 0)
+                self.assertGreater(stats.solve_time, 0)
+                self.assertGreater(stats.num_iterations, 0)
+                self.assertFalse(stats.unbounded_gap)
+                self.assertIsNone(stats.cache_hit)
+
+                if options.get('lazy_constraints'):
+                    self.assertLess(stats.max_rows, 1 << 5)
+                else:
+                    self.assertEqual(stats.max_rows, 1 << 5)
+
+    def test_unbounded_gap(self):
+        configurations = {config: 0 for config in itertools.product((-1, 1), repeat=2)}
+
+        stats = GenerationStats()
+        generate(nx.complete_graph(2), table_to_sampleset(configurations, (0, 1)), stats=stats)
+
+        self.assertTrue(stats.unbounded_gap)
+
+    def test_unbounded_gap_engines(self):
+        # the engines other than 'lp' cap the gap
+        configurations = {config: 0 for config in itertools.product((-1, 1), repeat=2)}
+
+        for engine in penaltymodel.generation.ENGINES:
+            with self.subTest(engine=engine):
+                if engine == 'milp' and not HAS_MILP:
+                    self.skipTest("needs scipy>=1.9")
+
+                stats = GenerationStats()
+                bqm, gap, aux = generate(nx.complete_graph(3),
+                                         table_to_sampleset(configurations, (0, 1)),
+                                         engine=engine, stats=stats)
+                self.assertEqual(gap, float('inf'))
+                self.assertTrue(stats.unbounded_gap)
+
+                stats = GenerationStats()
+                bqm, gap, aux = generate(nx.complete_graph(5),
+                                         table_to_sampleset(self.XOR, (0, 1, 2)),
+                                         engine=engine, stats=stats)
+                self.assertLess(gap, float('inf'))
+                self.assertFalse(stats.unbounded_gap)
+
+    @unittest.skipUnless(HAS_MILP, "needs scipy>=1.9")
+    def test_milp(self):
+        stats = GenerationStats()
+        generate(nx.complete_graph(5), table_to_sampleset(self.XOR, (0, 1, 2)), engine='milp',
+                 stats=stats)
+
+        # the mixed-integer program and the polishing linear program
+        self.assertEqual(stats.num_solves, 2)
+
+    def test_portfolio(self):
+        stats = GenerationStats()
+        generate(nx.complete_graph(5), table_to_sampleset(self.XOR, (0, 1, 2)), portfolio=2,
+                 stats=stats)
+
+        self.assertGreater(stats.num_solves, 0)
+        self.assertGreater(stats.matrix_time, 0)
+
+    def test_portfolio_cache_hit(self):
+        # set by get_penalty_model before generating, the workers don't know it
+        stats = GenerationStats()
+        stats.cache_hit = False
+        generate(nx.complete_graph(5), table_to_sampleset(self.XOR, (0, 1, 2)),
+                 portfolio=2, stats=stats)
+
+        self.assertIs(stats.cache_hit, False)
+        self.assertGreater(stats.num_solves, 0)
+
+    def test_repr(self):
+        self.assertIn('num_solves=0', repr(GenerationStats()))
+
+
+class TestCallback(unittest.TestCase):
+    XOR = {(-1, -1, -1): 0,
+           (-1, +1, +1): 0,
+           (+1, -1, +1): 0,
+           (+1, +1, -1): 0}
+
+    def test_progress(self):
+        samples = table_to_sampleset(self.XOR, (0, 1, 2))
+
+        for ordering in ['static', 'most-constrained']:
+            with self.subTest(ordering=ordering):
+                calls = []
+                bqm, gap, aux = generate(nx.complete_graph(5), samples, ordering=ordering,
+                                         callback=calls.append)
+
+                # every solve but the final one, which maximizes the gap
+                num_solves = count_solves(nx.complete_graph(5), samples, ordering=ordering)
+                self.assertEqual(len(calls), num_solves - 1)
+
+                for progress in calls:
+                    self.assertIn(progress.decision, self.XOR)
+                    self.assertEqual(len(progress.auxiliary), 2)
+                    self.assertGreaterEqual(progress.depth, 1)
+                    self.assertLessEqual(progress.depth, progress.num_decision_states)
+                    self.assertEqual(progress.num_decision_states, 4)
+                    self.assertGreaterEqual(progress.elapsed, 0)
+
+                self.assertTrue(calls[-1].feasible)
+                self.assertEqual(calls[-1].depth, 4)
+                self.assertEqual(dict(zip((3, 4), calls[-1].auxiliary)), aux[calls[-1].decision])
+                self.assertFalse(all(progress.feasible for progress in calls))
+
+    def test_cancel(self):
+        calls = []
+
+        def callback(progress):
+            calls.append(progress)
+            return len(calls) == 3
+
+        with self.assertRaises(Cancelled):
+            generate(nx.complete_graph(5), table_to_sampleset(self.XOR, (0, 1, 2)),
+                     callback=callback)
+        self.assertEqual(len(calls), 3)
+
+    def test_no_search(self):
+        # there is no auxiliary search without auxiliary variables
+        AND = {(-1, -1, -1): 0, (-1, +1, -1): 0, (+1, -1, -1): 0, (+1, +1, +1): 0}
+        callback = unittest.mock.Mock(return_value=True)
+
+        bqm, gap, aux = generate(nx.complete_graph(3), table_to_sampleset(AND, (0, 1, 2)),
+                                 callback=callback)
+
+        callback.assert_not_called()
+        TestGenerate.check_bqm_table(self, bqm, gap, AND, (0, 1, 2))
+
+
+class TestSpeculate(unittest.TestCase):
+    XOR = TestCallback.XOR
+
+    def test_same_search(self):
+        graph = nx.complete_graph(5)
+        samples = table_to_sampleset(self.XOR, (0, 1, 2))
+
+        for backend in ['linprog', 'highs']:
+            for lazy_constraints in [False, True]:
+                for learn_nogoods in [False, True]:
+                    with self.subTest(backend=backend, lazy_constraints=lazy_constraints,
+                                      learn_nogoods=learn_nogoods):
+                        kwargs = dict(backend=backend, lazy_constraints=lazy_constraints,
+                                      learn_nogoods=learn_nogoods)
+
+                        calls = []
+                        bqm, gap, aux = generate(graph, samples, callback=calls.append, **kwargs)
+
+                        speculative_calls = []
+                        stats = GenerationStats()
+                        speculative_bqm, speculative_gap, speculative_aux = generate(
+                            graph, samples, callback=speculative_calls.append, speculate=3,
+                            stats=stats, **kwargs)
+
+                        TestGenerate.check_bqm_table(self, speculative_bqm, speculative_gap,
+                                                     self.XOR, (0, 1, 2))
+                        self.assertEqual(speculative_aux, aux)
+                        self.assertEqual(
+                            [(p.decision, p.auxiliary, p.feasible) for p in speculative_calls],
+                            [(p.decision, p.auxiliary, p.feasible) for p in calls])
+
+                        # the unused speculative solves are counted too
+                        self.assertGreaterEqual(stats.num_solves, len(calls) + 1)
+
+    def test_impossible(self):
+        with self.assertRaises(ImpossiblePenaltyModel):
+            generate(nx.complete_graph(4), table_to_sampleset(self.XOR, (0, 1, 2)),
+                     speculate=2, prechecks=False)
+
+
+class TestPresolve(unittest.TestCase):
+    check_bqm_table = TestGenerate.check_bqm_table
+
+    # an AND gate, with a constant variable and a copy of an input
+    table = {(a, b, +1 if a > 0 and b > 0 else -1, +1, a): 0 for a in (-1, +1) for b in (-1, +1)}
+
+    def test_from_table(self):
+        reduction = TableReduction.from_table(self.table, 'abcde', nx.complete_graph('abcde'),
+                                              (-2, 2), (-1, 1))
+
+        self.assertEqual(reduction.fixed, {'d': (+1, -2)})
+        self.assertEqual(reduction.merged, {'e': ('a', +1, -1)})
+        self.assertEqual(reduction.kept, ['a', 'b', 'c'])
+        self.assertEqual(reduction.penalty(), 2)
+
+        for state in self.table:
+            self.assertEqual(reduction.expand_state(state[:3]), state)
+
+    def test_from_table_not_adjacent(self):
+        graph = nx.complete_graph('abcde')
+        graph.remove_edge('a', 'e')
+        reduction = TableReduction.from_table(self.table, 'abcde', graph, (-2, 2), (-1, 1))
+
+        self.assertEqual(reduction.merged, {})
+
+    def test_from_table_bounds(self):
+        # 0 is needed for the biases of the eliminated variables
+        graph = nx.complete_graph('abcde')
+        self.assertFalse(TableReduction.from_table(self.table, 'abcde', graph, (-2, 2), (.5, 1)))
+
+        # and fixing to +1 needs a negative bias
+        reduction = TableReduction.from_table(self.table, 'abcde', graph, (0, 2), (-1, 1))
+        self.assertEqual(reduction.fixed, {})
+
+    def test_from_table_single_state(self):
+        reduction = TableReduction.from_table({(-1, +1): 0}, 'ab', nx.complete_graph('ab'),
+                                              (-2, 2), (-1, 1))
+
+        self.assertEqual(reduction.kept, ['a'])
+
+    def test_generate(self):
+        graph = nx.complete_graph(6)
+        samples = table_to_sampleset(self.table, range(5))
+
+        stats = GenerationStats()
+        bqm, gap, aux = generate(graph, samples, presolve=True, stats=stats)
+
+        self.check_bqm_table(bqm, gap, self.table, range(5))
+        self.assertEqual(list(bqm.variables), list(graph.nodes))
+        self.assertEqual(len(bqm.quadratic), len(graph.edges))
+        self.assertEqual(set(aux), set(self.table))
+
+        # the linear programs are over 4 variables rather than 6
+        self.assertEqual(stats.max_rows, 1 << 4)
+
+    def test_bounded_by_penalty(self):
+        # the kept variable is unconstrained, so only the fixed variable's
+        # penalty bounds the gap
+        table = {(-1, +1): 0, (+1, +1): 0}
+
+        stats = GenerationStats()
+        bqm, gap, aux = generate(nx.complete_graph(2), table_to_sampleset(table, (0, 1)),
+                                 presolve=True, stats=stats)
+
+        self.check_bqm_table(bqm, gap, table, (0, 1))
+        self.assertEqual(gap, 4)
+        self.assertIsInstance(gap, float)
+        self.assertFalse(stats.unbounded_gap)
+        self.assertGreater(stats.num_solves, 0)
+
+    def test_fallback(self):
+        # the fixed variable's penalty does not cover the spread of the
+        # energies, so the full problem is solved
+        table = {(-1, +1): 0, (+1, +1): 3}
+        samples = table_to_sampleset(table, (0, 1))
+
+        with unittest.mock.patch('penaltymodel.generation.generate',
+                                 side_effect=penaltymodel.generation.generate) as mock:
+            bqm, gap, aux = generate(nx.complete_graph(2), samples, presolve=True)
+
+        self.assertEqual(mock.call_count, 1)  # the reduced problem
+        self.check_bqm_table(bqm, gap, table, (0, 1))
+        self.assertGreaterEqual(gap, 2)
+
+
+class TestFactorize(unittest.TestCase):
+    check_bqm_table = TestGenerate.check_bqm_table
+
+    AND = {(-1, -1, -1): 0,
+           (-1, +1, -1): 0,
+           (+1, -1, -1): 0,
+           (+1, +1, +1): 0}
+
+    @staticmethod
+    def product(*tables):
+        """The product of tables, with the energies added."""
+        products = itertools.product(*(t.items() for t in tables))
+        return {sum(states, ()): sum(energies)
+                for states, energies in (zip(*items) for items in products)}
+
+    def graph(self):
+        # two AND gates and an isolated auxiliary
+        graph = nx.complete_graph(3)
+        graph.add_edges_from(itertools.combinations('abc', 2))
+        graph.add_node('x')
+        return graph
+
+    def test_factorize(self):
+        table = self.product(self.AND, {(-1, -1, -1): 1, (+1, +1, +1): 1.5})
+
+        factors = factorize(self.graph(), (0, 1, 2, 'a', 'b', 'c'), table)
+
+        self.assertEqual([list(factor.graph.nodes) for factor in factors],
+                         [[0, 1, 2], ['a', 'b', 'c'], ['x']])
+        self.assertEqual([factor.decision for factor in factors], [[0, 1, 2], ['a', 'b', 'c'], []])
+        self.assertEqual([factor.spread() for factor in factors], [0, .5, 0])
+        for state, energy in table.items():
+            self.assertAlmostEqual(factors[0].table[state[:3]] + factors[1].table[state[3:]],
+                                   energy)
+
+    def test_not_product(self):
+        table = self.product(self.AND, self.AND)
+        del table[(-1, -1, -1, -1, -1, -1)]
+
+        self.assertEqual(factorize(self.graph(), (0, 1, 2, 'a', 'b', 'c'), table), [])
+
+    def test_not_additive(self):
+        table = self.product(self.AND, self.AND)
+        table[(-1, -1, -1, -1, -1, -1)] = 1
+
+        self.assertEqual(factorize(self.graph(), (0, 1, 2, 'a', 'b', 'c'), table), [])
+
+    def test_connected(self):
+        self.assertEqual(factorize(nx.complete_graph(3), (0, 1, 2), self.AND), [])
+
+    def test_generate(self):
+        table = self.product(self.AND, {(-1, -1, -1): 1, (+1, +1, +1): 1.5})
+        decision = (0, 1, 2, 'a', 'b', 'c')
+        graph = self.graph()
+
+        for options in [dict(), dict(parallel=True)]:
+            with self.subTest(**options), \
+                    unittest.mock.patch('penaltymodel.generation.PARALLEL_FACTOR_VARIABLES',
+                                        3 if options else 10):
+                stats = GenerationStats()
+                bqm, gap, aux = generate(graph, table_to_sampleset(table, decision),
+                                         min_classical_gap=1, stats=stats)
+
+                self.check_bqm_table(bqm, gap, table, decision)
+                self.assertGreaterEqual(gap, 1)
+                self.assertEqual(list(bqm.variables), list(graph.nodes))
+                self.assertEqual(len(bqm.quadratic), len(graph.edges))
+                self.assertEqual(set(aux), set(table))
+                self.assertEqual(aux[(-1,)*6], {'x': -1})
+
+                # each linear program is over a single gate
+                self.assertEqual(stats.max_rows, 8)
+
+    def test_unbounded_factor(self):
+        # the unconstrained gate has an unbounded gap, but the AND gate's
+        # gap is not
+        table = self.product(self.AND, {state: 0 for state in itertools.product((-1, 1), repeat=3)})
+        decision = (0, 1, 2, 'a', 'b', 'c')
+
+        for options in [dict(), dict(parallel=True)]:
+            with self.subTest(**options), \
+                    unittest.mock.patch('penaltymodel.generation.PARALLEL_FACTOR_VARIABLES',
+                                        3 if options else 10):
+                stats = GenerationStats()
+                bqm, gap, aux = generate(self.graph(), table_to_sampleset(table, decision),
+                                         stats=stats)
+
+                self.check_bqm_table(bqm, gap, table, decision)
+                self.assertLess(gap, float('inf'))
+                self.assertFalse(stats.unbounded_gap)
+                self.assertGreater(stats.num_solves, 0)
+
+    def test_impossible(self):
+        XOR = {(-1, -1, -1): 0,
+               (-1, +1, +1): 0,
+               (+1, -1, +1): 0,
+               (+1, +1, -1): 0}
+        table = self.product(self.AND, XOR)
+
+        with self.assertRaises(ImpossiblePenaltyModel):
+            generate(self.graph(), table_to_sampleset(table, (0, 1, 2, 'a', 'b', 'c')))
+
+        # the spread of the second gate's energies needs a larger gap from
+        # the first
+        table = self.product(self.AND, {(-1, -1, -1): 1, (+1, +1, +1): 1.5})
+        with self.assertRaises(ImpossiblePenaltyModel):
+            generate(self.graph(), table_to_sampleset(table, (0, 1, 2, 'a', 'b', 'c')))
+
+    def test_decompose_false(self):
+        table = self.product(self.AND, self.AND)
+
+        stats = GenerationStats()
+        bqm, gap, aux = generate(self.graph(), table_to_sampleset(table, (0, 1, 2, 'a', 'b', 'c')),
+                                 decompose=False, stats=stats)
+
+        self.check_bqm_table(bqm, gap, table, (0, 1, 2, 'a', 'b', 'c'))
+        self.assertEqual(stats.max_rows, 1 << 7)
+
+
+class TestPrecheck(unittest.TestCase):
+    AND = {(-1, -1, -1): 0,
+           (-1, +1, -1): 0,
+           (+1, -1, -1): 0,
+           (+1, +1, +1): 0}
+    XOR = {(-1, -1, -1): 0,
+           (-1, +1, +1): 0,
+           (+1, -1, +1): 0,
+           (+1, +1, -1): 0}
+
+    def precheck(self, graph, table, decision=(0, 1, 2), **kwargs):
+        kwargs.setdefault('linear_bound', (-2, 2))
+        kwargs.setdefault('quadratic_bound', (-1, 1))
+        kwargs.setdefault('min_classical_gap', 2)
+        precheck(graph, decision, table, **kwargs)
+
+    def test_possible(self):
+        self.precheck(nx.complete_graph(3), self.AND)
+        self.precheck(nx.complete_graph(5), self.XOR)
+        self.precheck(nx.complete_graph(4), self.XOR)  # needs the search to rule out
+
+    def test_flip(self):
+        # 1 and 2 only have one neighbour, so flipping either raises the
+        # energy by at most 2*(2 + 1)
+        graph = nx.Graph([(0, 1), (0, 2)])
+        table = {(-1, -1, -1): 0, (+1, +1, +1): 0}
+
+        self.precheck(graph, table, min_classical_gap=6)
+        with self.assertRaises(ImpossiblePenaltyModel):
+            self.precheck(graph, table, min_classical_gap=6.5)
+
+    def test_max_gap(self):
+        with self.assertRaises(ImpossiblePenaltyModel):
+            self.precheck(nx.complete_graph(3), self.AND, min_classical_gap=100)
+
+    def test_components(self):
+        # 0 and 2 are correlated but in different components
+        graph = nx.Graph([(0, 1), (2, 3)])
+        table = {(-1, -1, -1): 0, (+1, -1, +1): 0}
+
+        with self.assertRaises(ImpossiblePenaltyModel):
+            self.precheck(graph, table)
+
+        # a product over the components is fine
+        table = {(a, -1, b): 0 for a in (-1, +1) for b in (-1, +1)}
+        self.precheck(graph, table)
+
+    def test_components_nonpositive_gap(self):
+        # without a positive gap the infeasible states can be ground states
+        graph = nx.Graph()
+        graph.add_nodes_from([0, 1])
+        table = {(-1, -1): 0, (+1, +1): 0}
+
+        for min_classical_gap in [0, -1]:
+            with self.subTest(min_classical_gap=min_classical_gap):
+                self.precheck(graph, table, decision=(0, 1), min_classical_gap=min_classical_gap)
+                bqm, gap, aux = generate(graph, table_to_sampleset(table, (0, 1)),
+                                         min_classical_gap=min_classical_gap)
+                self.assertGreaterEqual(gap, min_classical_gap)
+
+        with self.assertRaises(ImpossiblePenaltyModel):
+            self.precheck(graph, table, decision=(0, 1), min_classical_gap=1)
+
+    def test_parity(self):
+        with self.assertRaises(ImpossiblePenaltyModel):
+            self.precheck(nx.complete_graph(3), self.XOR)
+
+        # the two equal variables need an interaction
+        graph = nx.Graph([(0, 1)])
+        graph.add_node(2)
+        table = {(-1, -1, -1): 0, (+1, +1, -1): 0}
+        self.precheck(graph, table)
+        with self.assertRaises(ImpossiblePenaltyModel):
+            self.precheck(graph, table, decision=(0, 2, 1))
+
+    def test_forwarded(self):
+        # the factors and the reduced problem are only checked if asked
+        factorizable = (TestFactorize().graph(), TestFactorize.product(self.AND, self.AND),
+                        (0, 1, 2, 'a', 'b', 'c'))
+        reducible = (nx.complete_graph(6), TestPresolve.table, range(5))
+
+        cases = [(factorizable, dict(), 3),
+                 (factorizable, dict(prechecks=False), 0),
+                 (reducible, dict(presolve=True), 2),
+                 (reducible, dict(presolve=True, prechecks=False), 0)]
+        for (graph, table, decision), kwargs, calls in cases:
+            with self.subTest(kwargs=kwargs), \
+                    unittest.mock.patch('penaltymodel.generation.precheck',
+                                        wraps=penaltymodel.generation.precheck) as mock:
+                generate(graph, table_to_sampleset(table, decision), **kwargs)
+                self.assertEqual(mock.call_count, calls)
+
+    def test_impossible_tests(self):
+        # the impossible problems of the generation tests fail early
+        problems = [(nx.complete_graph(3), self.XOR, dict()),
+                    (nx.path_graph(3), self.AND, dict()),
+                    ]
+        for graph, table, kwargs in problems:
+            with self.subTest(graph=graph), self.assertRaises(ImpossiblePenaltyModel):
+                samples = table_to_sampleset(table, (0, 1, 2))
+                self.assertEqual(count_solves(graph, samples, **kwargs), 0)
+                generate(graph, table_to_sampleset(table, (0, 1, 2)), **kwargs)
+
+
+class TestConstraintMatrixCache(unittest.TestCase):
+    def test_shared_between_tables(self):
+        cache = ConstraintMatrixCache()
+        graph = nx.complete_graph(4)
+        AND = {(-1, -1, -1): 0, (-1, +1, -1): 0, (+1, -1, -1): 0, (+1, +1, +1): 0}
+        OR = {(-1, -1, -1): 0, (-1, +1, +1): 0, (+1, -1, +1): 0, (+1, +1, +1): 0}
+
+        with unittest.mock.patch('penaltymodel.generation._constraint_matrices', cache):
+            for table in [AND, OR, AND]:
+                bqm, gap, aux = generate(graph, table_to_sampleset(table, (0, 1, 2)))
+                TestGenerate.check_bqm_table(self, bqm, gap, table, (0, 1, 2))
+
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 2)
+
+        # the gap column is set through a wrapper, not in the cached matrix
+        (A, indexer), = cache._cache.values()
+        self.assertFalse(A.flags.writeable)
+        self.assertFalse(A[:, indexer.gap()].any())
+
+    def test_key(self):
+        cache = ConstraintMatrixCache()
+
+        A, indexer = cache.get((0, 1), (2,), [(0, 1), (1, 2)])
+        self.assertIs(cache.get((0, 1), (2,), [(0, 1), (1, 2)])[0], A)
+
+        # different columns
+        self.assertIsNot(cache.get((1, 0), (2,), [(0, 1), (1, 2)])[0], A)
+        self.assertIsNot(cache.get((0, 1), (2,), [(1, 2), (0, 1)])[0], A)
+        self.assertIsNot(cache.get((0, 1), (2,), [(0, 1), (0, 2)])[0], A)
+
+        np.testing.assert_array_equal(A, constraint_matrix(Index((0, 1), (2,), [(0, 1), (1, 2)]),
+                                                           [(0, 1), (1, 2)]))
+
+    def test_lookup(self):
+        cache = ConstraintMatrixCache()
+
+        self.assertIsNone(cache.lookup((0, 1), (2,), [(0, 1), (1, 2)]))
+        A, indexer = cache.get((0, 1), (2,), [(0, 1), (1, 2)])
+        self.assertIs(cache.lookup((0, 1), (2,), [(0, 1), (1, 2)])[0], A)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    def test_extend(self):
+        # the new interactions are between the old ones
+        graph = nx.Graph([('a', 'b'), ('b', 'x')])
+        indexer = Index('ab', 'x', graph.edges)
+        A = constraint_matrix(indexer, graph.edges)
+        graph.add_edges_from([('a', 'y'), ('x', 'y')])
+
+        B, extended = extend_constraint_matrix(A, indexer, 'ab', 'xy', list(graph.edges),
+                                               chunksize=3)
+
+        self.assertEqual(len(extended), len(Index('ab', 'xy', graph.edges)))
+        np.testing.assert_array_equal(B, constraint_matrix(extended, graph.edges))
+
+    def test_least_recently_used(self):
+        cache = ConstraintMatrixCache(maxsize=2)
+
+        A, _ = cache.get((0,), (), [])
+        B, _ = cache.get((0, 1), (), [(0, 1)])
+        cache.get((0,), (), [])
+        cache.get((0, 1, 2), (), [(0, 1)])
+
+        self.assertEqual(len(cache), 2)
+        self.assertIs(cache.get((0,), (), [])[0], A)
+        self.assertIsNot(cache.get((0, 1), (), [(0, 1)])[0], B)
+
+    def test_max_bytes(self):
+        cache = ConstraintMatrixCache(max_bytes=100)
+
+        cache.get((0, 1), (), [(0, 1)])
+        cache.get(range(5), (), [(0, 1)])
+
+        self.assertEqual(len(cache), 1)
+
+    def test_max_bytes_total(self):
+        # each matrix fits, but not all of them together
+        cache = ConstraintMatrixCache(max_bytes=200)
+
+        A, _ = cache.get(range(3), (), [(0, 1)])
+        B, _ = cache.get(range(4), (), [(0, 1)])
+        self.assertEqual(cache.nbytes, A.nbytes + B.nbytes)
+        self.assertLessEqual(cache.nbytes, 200)
+
+        C, _ = cache.get(range(3), (), [(0, 2)])
+        self.assertLessEqual(cache.nbytes, 200)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNot(cache.get(range(3), (), [(0, 1)])[0], A)
+
+    def test_resize(self):
+        cache = ConstraintMatrixCache()
+        for n in range(2, 6):
+            cache.get(range(n), (), [])
+
+        cache.resize(maxsize=3)
+        self.assertEqual(len(cache), 3)
+
+        cache.resize(max_bytes=cache.nbytes - 1)
+        self.assertEqual(len(cache), 2)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_shared_not_counted(self):
+        cache = ConstraintMatrixCache(max_bytes=0)
+        A, indexer = cache.get(range(3), (), [(0, 1)])
+
+        # a view of memory owned elsewhere, as with shared memory
+        shared = np.frombuffer(A.tobytes(), dtype=np.int8).reshape(A.shape)
+        cache.put(range(3), (), [(0, 1)], shared, indexer)
+
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_constraint_matrix_cache(self):
+        self.assertIs(penaltymodel.constraint_matrix_cache(),
+                      penaltymodel.generation._constraint_matrices)
+
+    def test_not_copied(self):
+        # matrices too large to cache are used as built, without a copy
+        cache = ConstraintMatrixCache(max_bytes=0)
+        AND = {(-1, -1, -1): 0, (-1, +1, -1): 0, (+1, -1, -1): 0, (+1, +1, +1): 0}
+
+        built = []
+
+        def build(*args, **kwargs):
+            built.append(constraint_matrix(*args, **kwargs))
+            return built[-1]
+
+        with unittest.mock.patch('penaltymodel.generation._constraint_matrices', cache), \
+                unittest.mock.patch('penaltymodel.generation.constraint_matrix', build), \
+                unittest.mock.patch('penaltymodel.generation.linear_program',
+                                    wraps=linear_program) as lp:
+            bqm, gap, aux = generate(nx.complete_graph(4), table_to_sampleset(AND, (0, 1, 2)))
+
+        TestGenerate.check_bqm_table(self, bqm, gap, AND, (0, 1, 2))
+        self.assertEqual(len(cache), 0)
+        self.assertIs(lp.call_args.args[0].A, built[0])
+
+    def test_threads(self):
+        cache = ConstraintMatrixCache(maxsize=3)
+        graphs = [nx.complete_graph(n) for n in range(2, 8)]
+
+        def get(graph):
+            return cache.get(list(graph.nodes), [], list(graph.edges))[0]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            matrices = list(executor.map(get, graphs*10))
+
+        self.assertEqual(len(cache), 3)
+        for graph, A in zip(graphs*10, matrices):
+            np.testing.assert_array_equal(A, get(graph))
+
+
+def _shared_cache_info(graph, samples):
+    # run in a worker process
+    cache = penaltymodel.generation._constraint_matrices
+    key = ((0, 1, 2), (3,), tuple(graph.edges))
+    A, _ = cache._cache[key]
+    hits, misses = cache.hits, cache.misses
+    result = generate(graph, samples)
+    return (result, cache.hits - hits, cache.misses - misses,
+            A.flags.writeable, A.base is not None)
+
+
+class TestSharedConstraintMatrices(unittest.TestCase):
+    AND = {(-1, -1, -1): 0,
+           (-1, +1, -1): 0,
+           (+1, -1, -1): 0,
+           (+1, +1, +1): 0}
+
+    def test_attach(self):
+        graph = nx.complete_graph(4)
+
+        with SharedConstraintMatrices() as shared:
+            shared.publish([0, 1, 2], [3], list(graph.edges))
+            shared.publish([0, 1, 2], [3], list(graph.edges))  # already there
+            self.assertEqual(len(shared), 1)
+
+            cache = ConstraintMatrixCache()
+            with unittest.mock.patch('penaltymodel.generation._constraint_matrices', cache):
+                attach_constraint_matrices(shared.handles())
+
+                A, indexer = cache.get([0, 1, 2], [3], list(graph.edges))
+                self.assertEqual(cache.hits, 1)
+                self.assertFalse(A.flags.writeable)
+                np.testing.assert_array_equal(A, constraint_matrix(indexer, graph.edges))
+
+                with unittest.mock.patch('penaltymodel.generation.linear_program',
+                                         wraps=linear_program) as lp:
+                    bqm, gap, aux = generate(graph, table_to_sampleset(self.AND, (0, 1, 2)))
+                TestGenerate.check_bqm_table(self, bqm, gap, self.AND, (0, 1, 2))
+                self.assertEqual(cache.hits, 2)
+
+                # the linear program reads the shared memory, not a copy
+                self.assertIs(lp.call_args.args[0].A, A)
+                self.assertFalse(A[:, indexer.gap()].any())
+
+            # detach before the memory is unlinked
+            del A
+            cache.clear()
+            penaltymodel.generation._attached.clear()
+
+        self.assertEqual(len(shared), 0)
+
+    def test_workers(self):
+        graph = nx.complete_graph(4)
+        samples = table_to_sampleset(self.AND, (0, 1, 2))
+
+        with SharedConstraintMatrices() as shared:
+            shared.publish([0, 1, 2], [3], list(graph.edges))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1,
+                                                        initializer=attach_constraint_matrices,
+                                                        initargs=(shared.handles(),)) as executor:
+                (bqm, gap, aux), hits, misses, writeable, view = \
+                    executor.submit(_shared_cache_info, graph, samples).result()
+
+        TestGenerate.check_bqm_table(self, bqm, gap, self.AND, (0, 1, 2))
+        self.assertEqual((hits, misses), (1, 0))
+        self.assertFalse(writeable)
+        self.assertTrue(view)
+
+
+class TestLazyConstraints(unittest.TestCase):
+    def generate(self, *args, **kwargs):
+        """Generate and return the linear program as well."""
+        lps = []
+
+        def capture(*args, **kwargs):
+            lps.append(linear_program(*args, **kwargs))
+            return lps[-1]
+
+        with unittest.mock.patch('penaltymodel.generation.linear_program', capture):
+            return generate(*args, **kwargs), lps[-1]
+
+    def test_working_set(self):
+        graph = nx.cycle_graph(10)
+        configurations = {(-1, -1, -1): 0,
+                          (+1, +1, +1): 0}
+        samples = table_to_sampleset(configurations, (0, 1, 5))
+
+        for highs in [True, False]:
+            with self.subTest(highspy=highs), \
+                    unittest.mock.patch('penaltymodel.generation.highspy',
+                                        penaltymodel.generation.highspy if highs else None):
+                (bqm, gap, aux), lp = self.generate(graph, samples, lazy_constraints=True)
+
+                # only some of the rows were needed
+                self.assertLess(lp.is_active.sum(), len(lp.b) // 2)
+
+                # but the solution satisfies all of them
+                self.assertEqual(len(lp.violated(lp.solve(np.zeros(lp.A.shape[1])).x)), 0)
+                self.assertGreaterEqual(gap, 2)
+
+    def test_linprog_buffer(self):
+        # the scipy fallback only copies the active rows
+        graph = nx.cycle_graph(10)
+        configurations = {(-1, -1, -1): 0,
+                          (+1, +1, +1): 0}
+        samples = table_to_sampleset(configurations, (0, 1, 5))
+
+        with unittest.mock.patch('penaltymodel.generation.highspy', None):
+            _, lp = self.generate(graph, samples, lazy_constraints=True)
+
+        self.assertLess(len(lp.b_ub), len(lp.b) // 2)
+        self.assertEqual(lp.num_ub, lp.is_active.sum())
+        np.testing.assert_array_equal(np.unique(lp.A_ub[:lp.num_ub], axis=0),
+                                      np.unique(-lp.A[lp.is_active], axis=0))
+
+    def test_unbounded_gap(self):
+        # every decision state is feasible, so the gap is unbounded even
+        # though lazy mode caps it
+        graph = nx.complete_graph(3)
+        configurations = {config: 0 for config in itertools.product((-1, 1), repeat=2)}
+
+        bqm, gap, aux = generate(graph, table_to_sampleset(configurations, (0, 1)),
+                                 lazy_constraints=True)
+
+        self.assertEqual(gap, float('inf'))
+
+
+@unittest.skipUnless(HAS_MILP, "needs scipy>=1.9")
+class TestMILP(unittest.TestCase):
+    check_bqm_table = TestGenerate.check_bqm_table
+
+    def test_AND_K4(self):
+        graph = nx.complete_graph(4)
+        configurations = {(-1, -1, -1): 0,
+                          (-1, +1, -1): 0,
+                          (+1, -1, -1): 0,
+                          (+1, +1, +1): 0}
+        decision_variables = (0, 1, 2)
+        samples = table_to_sampleset(configurations, decision_variables)
+
+        bqm, gap, aux = generate(graph, samples, engine='milp')
+
+        self.check_bqm_table(bqm, gap, configurations, decision_variables)
+
+        # the gap is globally optimal, the search only finds a feasible one
+        self.assertGreaterEqual(gap, generate(graph, samples)[1])
+        self.assertAlmostEqual(gap, 4)
+
+    def test_exact_ground_states(self):
+        # the selected rows only hold to within the MILP tolerances, so the
+        # ground states need to be polished
+        graph = nx.Graph([(0, 1), (0, 2)])
+        configurations = {(-1, -1): 0, (+1, +1): 0, (+1, -1): 0}
+        decision_variables = (1, 2)
+
+        bqm, gap, aux = generate(graph, table_to_sampleset(configurations, decision_variables),
+                                 engine='milp')
+
+        self.assertEqual(gap, 4)
+        for config, aux_config in aux.items():
+            sample = dict(zip(decision_variables, config))
+            sample.update(aux_config)
+            self.assertEqual(bqm.energy(sample), 0)
+        self.check_bqm_table(bqm, gap, configurations, decision_variables)
+
+    def test_asymmetric_bounds(self):
+        graph = nx.cycle_graph(5)
+        configurations = {(-1, -1): 0, (+1, +1): 0}
+        decision_variables = (0, 2)
+
+        bqm, gap, aux = generate(graph, table_to_sampleset(configurations, decision_variables),
+                                 linear_bound=(-2, 1), engine='milp')
+
+        self.check_bqm_table(bqm, gap, configurations, decision_variables)
+
+    def test_impossible(self):
+        graph = nx.complete_graph(3)
+        configurations = {(-1, -1, -1): 0,
+                          (-1, +1, +1): 0,
+                          (+1, -1, +1): 0,
+                          (+1, +1, -1): 0}
+
+        with self.assertRaises(ImpossiblePenaltyModel):
+            generate(graph, table_to_sampleset(configurations, (0, 1, 2)), engine='milp')
+
+    def test_unknown_engine(self):
+        graph = nx.complete_graph(3)
+        configurations = {(-1, -1): 0, (+1, +1): 0}
+
+        with self.assertRaises(ValueError):
+            generate(graph, table_to_sampleset(configurations, (0, 1)), engine='simplex')
+
+
+class TestTreeEngine(unittest.TestCase):
+    check_bqm_table = TestGenerate.check_bqm_table
+
+    def test_elimination_order(self):
+        for graph, width in [(nx.path_graph(8), 1),
+                             (nx.cycle_graph(8), 2),
+                             (nx.complete_graph(5), 4),
+                             (nx.Graph([(0, 1), (2, 3)]), 1)]:
+            with self.subTest(graph=graph):
+                w, order = elimination_order(graph)
+                self.assertEqual(w, width)
+                self.assertEqual(sorted(order), sorted(graph.nodes))
+
+                # no more than width neighbours are left when eliminated
+                filled = graph.copy()
+                for v in order:
+                    neighbours = list(filled[v])
+                    self.assertLessEqual(len(neighbours), width)
+                    filled.add_edges_from(itertools.combinations(neighbours, 2))
+                    filled.remove_node(v)
+
+    def test_implicit_matrix(self):
+        graph = nx.cycle_graph(6)
+        indexer = Index([0, 1], [2, 3, 4, 5], graph.edges)
+        gap_column = np.array([0, -1, -1, 0], dtype=np.int8)
+        A = constraint_matrix(indexer, graph.edges)
+        A[:, indexer.gap()] = np.tile(gap_column, 16)
+
+        implicit = ImplicitConstraintMatrix(indexer, graph.edges, gap_column)
+        self.assertEqual(implicit.shape, A.shape)
+        np.testing.assert_array_equal(implicit[np.array([5, 3, 60])], A[[5, 3, 60]])
+        np.testing.assert_array_equal(implicit[7:20], A[7:20])
+        np.testing.assert_array_equal(implicit[np.int64(9)], A[9])
+        np.testing.assert_array_equal(implicit[np.array([[1, 2], [3, 4]])], A[[[1, 2], [3, 4]]])
+
+        b = TiledVector([1., 2., 3., 4.], 64)
+        np.testing.assert_array_equal(b[np.array([0, 5, 63])],
+                                      np.tile([1., 2., 3., 4.], 16)[[0, 5, 63]])
+        self.assertEqual(b[6], 3)
+        self.assertEqual(len(b), 64)
+
+    def test_separator(self):
+        rng = np.random.default_rng(42)
+
+        for _ in range(50):
+            num_variables = int(rng.integers(2, 8))
+            graph = nx.gnp_random_graph(num_variables, .5, seed=int(rng.integers(1 << 16)))
+            num_decision = int(rng.integers(1, num_variables + 1))
+            decision = list(range(num_decision))
+            auxiliary = list(range(num_decision, num_variables))
+            num_feasible = int(rng.integers(1, 1 << num_decision)) + 1
+            codes = np.unique(rng.integers(1 << num_decision, size=num_feasible))
+            energies = rng.normal(size=len(codes))
+
+            indexer = Index(decision, auxiliary, graph.edges)
+            gap_column = np.full(1 << num_decision, -1)
+            gap_column[codes] = 0
+            target = np.full(1 << num_decision, energies.max())
+            target[codes] = energies
+            A = constraint_matrix(indexer, graph.edges)
+            A[:, indexer.gap()] = np.tile(gap_column, 1 << len(auxiliary))
+            b = np.tile(target, 1 << len(auxiliary))
+
+            x = rng.normal(size=len(indexer))
+            slack = A @ x - b
+
+            rows, row_slack = TreeSeparator(graph, indexer, decision, auxiliary, codes, energies)(x)
+            np.testing.assert_allclose(row_slack, slack[rows])
+            self.assertEqual(len(set(rows.tolist())), len(rows))
+
+            # the lowest slack of each feasible decision state, and of all of
+            # the infeasible ones, is found
+            state = np.arange(len(b)) & ((1 << num_decision) - 1)
+            row_state = rows & ((1 << num_decision) - 1)
+            for code in codes:
+                self.assertAlmostEqual(row_slack[row_state == code].min(),
+                                       slack[state == code].min())
+            infeasible = ~np.isin(state, codes)
+            if infeasible.any():
+                self.assertAlmostEqual(row_slack[~np.isin(row_state, codes)].min(),
+                                       slack[infeasible].min())
+
+    def test_generate(self):
+        AND = {(-1, -1, -1): 0,
+               (-1, +1, -1): 0,
+               (+1, -1, -1): 0,
+               (+1, +1, +1): 0}
+        XOR = TestCallback.XOR
+
+        for table, graph in [(AND, nx.complete_graph(4)),
+                             (AND, nx.Graph([(0, 3), (1, 3), (2, 3), (0, 1)])),
+                             (XOR, nx.complete_graph(5))]:
+            for backend in ['linprog', 'highs']:
+                with self.subTest(table=table, graph=graph, backend=backend):
+                    samples = table_to_sampleset(table, (0, 1, 2))
+                    bqm, gap, aux = generate(graph, samples, engine='tree', backend=backend)
+                    self.check_bqm_table(bqm, gap, table, (0, 1, 2))
+                    self.assertEqual(aux, generate(graph, samples, backend=backend)[2])
+
+    def test_path(self):
+        # too many states to check every row
+        graph = nx.path_graph(18)
+        table = {(-1,)*18: 0, (+1,)*18: 0}
+
+        lps = []
+
+        def capture(*args, **kwargs):
+            lps.append(linear_program(*args, **kwargs))
+            return lps[-1]
+
+        with unittest.mock.patch('penaltymodel.generation.matvec') as matvec, \
+                unittest.mock.patch('penaltymodel.generation.linear_program', capture):
+            bqm, gap, aux = generate(graph, table_to_sampleset(table, range(18)), engine='tree')
+        matvec.assert_not_called()
+
+        # nor is a slack kept for every state
+        self.assertTrue(lps)
+        for lp in lps:
+            self.assertIsNone(lp._slack)
+
+        self.assertAlmostEqual(gap, 2)
+        self.assertEqual(set(aux), set(table))
+        for state in table:
+            self.assertAlmostEqual(bqm.energy(dict(enumerate(state))), 0)
+
+    def test_path_auxiliary(self):
+        # the auxiliary states are still searched one at a time, so keep
+        # their number small
+        graph = nx.path_graph(9)
+        table = {(-1, -1, -1): 0, (+1, +1, +1): 0}
+        samples = table_to_sampleset(table, (0, 4, 8))
+
+        bqm, gap, aux = generate(graph, samples, engine='tree')
+
+        self.check_bqm_table(bqm, gap, table, (0, 4, 8))
+        self.assertEqual(aux, generate(graph, samples, lazy_constraints=True)[2])
+
+    def test_impossible(self):
+        with self.assertRaises(ImpossiblePenaltyModel):
+            generate(nx.complete_graph(4), table_to_sampleset(TestCallback.XOR, (0, 1, 2)),
+                     engine='tree', prechecks=False)
+
+
+class TestBackends(unittest.TestCase):
+    check_bqm_table = TestGenerate.check_bqm_table
+
+    def test_registered(self):
+        graph = nx.complete_graph(4)
+        configurations = {(-1, -1, -1): 0,
+                          (-1, +1, -1): 0,
+                          (+1, -1, -1): 0,
+                          (+1, +1, +1): 0}
+        decision_variables = (0, 1, 2)
+        samples = table_to_sampleset(configurations, decision_variables)
+
+        for backend in penaltymodel.generation.BACKENDS:
+            with self.subTest(backend=backend):
+                bqm, gap, aux = generate(graph, samples, backend=backend)
+                self.check_bqm_table(bqm, gap, configurations, decision_variables)
+
+    def test_register(self):
+        factory = unittest.mock.Mock(wraps=penaltymodel.generation.LinprogSession)
+        penaltymodel.generation.register_backend('test', factory)
+        self.addCleanup(penaltymodel.generation.BACKENDS.pop, 'test')
+
+        configurations = {(-1, -1): 0, (+1, +1): 0}
+        generate(nx.complete_graph(2), table_to_sampleset(configurations, (0, 1)),
+                 backend='test', lazy_constraints=True)
+
+        factory.assert_called_once()
+        self.assertIs(factory.call_args.kwargs['lazy'], True)
+
+    def test_unknown_backend(self):
+        configurations = {(-1, -1): 0, (+1, +1): 0}
+
+        with self.assertRaises(ValueError):
+            generate(nx.complete_graph(2), table_to_sampleset(configurations, (0, 1)),
+                     backend='simplex')
+
+
+class TestEngineSelection(unittest.TestCase):
+    def test_select_engine(self):
+        rules = [EngineRule('milp', max_auxiliary=1, max_feasible=4),
+                 EngineRule('lp', max_variables=8),
+                 EngineRule('lazy')]
+
+        self.assertEqual(select_engine(5, 1, 4, 10, rules=rules), 'milp' if HAS_MILP else 'lp')
+        self.assertEqual(select_engine(5, 1, 5, 10, rules=rules), 'lp')
+        self.assertEqual(select_engine(5, 2, 4, 10, rules=rules), 'lp')
+        self.assertEqual(select_engine(9, 2, 4, 10, rules=rules), 'lazy')
+        self.assertEqual(select_engine(9, 2, 4, 10, rules=[]), 'lp')
+
+    def test_auto(self):
+        graph = nx.complete_graph(4)
+        configurations = {(-1, -1, -1): 0,
+                          (-1, +1, -1): 0,
+                          (+1, -1, -1): 0,
+                          (+1, +1, +1): 0}
+        samples = table_to_sampleset(configurations, (0, 1, 2))
+
+        for engine in penaltymodel.generation.ENGINES:
+            with self.subTest(engine=engine), \
+                    unittest.mock.patch('penaltymodel.generation.ENGINE_RULES',
+                                        [EngineRule(engine)]), \
+                    unittest.mock.patch('penaltymodel.generation.solve_milp',
+                                        wraps=penaltymodel.generation.solve_milp) as solve_milp, \
+                    unittest.mock.patch('penaltymodel.generation.linear_program',
+                                        wraps=linear_program) as lp:
+                if engine == 'milp' and not HAS_MILP:
+                    self.skipTest("needs scipy>=1.9")
+
+                bqm, gap, aux = generate(graph, samples, engine='auto')
+
+                self.assertEqual(solve_milp.called, engine == 'milp')
+                self.assertEqual(lp.call_args.kwargs.get('lazy', False), engine in ('lazy', 'tree'))
+                TestGenerate.check_bqm_table(self, bqm, gap, configurations, (0, 1, 2))
+
+    def test_auto_without_milp(self):
+        # scipy<1.9 has no scipy.optimize.milp
+        graph = nx.complete_graph(4)
+        configurations = {(-1, -1, -1): 0,
+                          (-1, +1, -1): 0,
+                          (+1, -1, -1): 0,
+                          (+1, +1, +1): 0}
+
+        with unittest.mock.patch.dict(scipy.optimize.__dict__), \
+                unittest.mock.patch('penaltymodel.generation.ENGINE_RULES',
+                                    [EngineRule('milp'), EngineRule('lazy')]):
+            scipy.optimize.__dict__.pop('milp', None)
+
+            self.assertEqual(select_engine(5, 1, 9, 10), 'lazy')
+            self.assertEqual(select_engine(5, 1, 9, 10, rules=[EngineRule('milp')]), 'lp')
+
+            bqm, gap, aux = generate(graph, table_to_sampleset(configurations, (0, 1, 2)),
+                                     engine='auto')
+            TestGenerate.check_bqm_table(self, bqm, gap, configurations, (0, 1, 2))
+
+
+class TestTimeLimit(unittest.TestCase):
+    check_bqm_table = TestGenerate.check_bqm_table
+
+    # a table that takes the linear programming search a long time on K7
+    hard = {config: 0 for k, config in enumerate(itertools.product((-1, +1), repeat=5))
+            if k in (1, 3, 4, 6, 8, 10, 11, 17, 19, 20, 21, 24, 26, 28, 30, 31)}
+
+    AND = {(-1, -1, -1): 0,
+           (-1, +1, -1): 0,
+           (+1, -1, -1): 0,
+           (+1, +1, +1): 0}
+
+    def test_timeout(self):
+        samples = table_to_sampleset(self.hard, range(5))
+
+        for options in [dict(), dict(lazy_constraints=True), dict(engine='milp'),
+                        dict(backend='linprog')]:
+            with self.subTest(**options):
+                if options.get('engine') == 'milp' and not HAS_MILP:
+                    self.skipTest("needs scipy>=1.9")
+
+                t = time.perf_counter()
+                with self.assertRaises(PenaltyModelTimeout):
+                    generate(nx.complete_graph(7), samples, time_limit=.2, **options)
+                self.assertLess(time.perf_counter() - t, 2)
+
+    def test_deadline(self):
+        indexer = penaltymodel.generation.Index((0, 1), (2,), [(0, 1), (0, 2), (1, 2)])
+        A = penaltymodel.generation.constraint_matrix(indexer, [(0, 1), (0, 2), (1, 2)])
+        bounds = indexer.make_bounds(2, (-2, 2), (-1, 1))
+        c = np.zeros(len(indexer))
+
+        for backend in penaltymodel.generation.BACKENDS:
+            with self.subTest(backend=backend):
+                lp = linear_program(A, np.zeros(len(A)), bounds, backend=backend)
+
+                # the solver is given the time remaining
+                lp.deadline = time.monotonic() + 100
+                with unittest.mock.patch('scipy.optimize.linprog',
+                                         wraps=scipy.optimize.linprog) as linprog:
+                    self.assertTrue(lp.solve(c).success)
+                if isinstance(lp, penaltymodel.generation.HighsSession):
+                    _, limit = lp.highs.getOptionValue('time_limit')
+                    self.assertLessEqual(limit, lp.highs.getRunTime() + 100)
+                else:
+                    self.assertLessEqual(linprog.call_args.kwargs['options']['time_limit'], 100)
+
+                lp.deadline = time.monotonic()
+                with self.assertRaises(PenaltyModelTimeout):
+                    lp.solve(c)
+
+    def test_anytime(self):
+        graph = nx.complete_graph(4)
+        samples = table_to_sampleset(self.AND, (0, 1, 2))
+        solve = penaltymodel.generation.LinearProgram.solve
+
+        def gap_times_out(lp, c):
+            # only the last solve maximizes the gap
+            if c[0]:
+                raise PenaltyModelTimeout
+            return solve(lp, c)
+
+        with unittest.mock.patch.object(penaltymodel.generation.LinearProgram, 'solve',
+                                        gap_times_out), \
+                self.assertWarns(SuboptimalPenaltyModelWarning):
+            bqm, gap, aux = generate(graph, samples, time_limit=10)
+
+        self.assertGreaterEqual(gap, 2)
+        self.check_bqm_table(bqm, gap, self.AND, (0, 1, 2))
+
+    @unittest.skipUnless(HAS_MILP, "needs scipy>=1.9")
+    def test_anytime_milp(self):
+        graph = nx.complete_graph(4)
+        samples = table_to_sampleset(self.AND, (0, 1, 2))
+        milp = scipy.optimize.milp
+
+        def limit_reached(*args, **kwargs):
+            # the time limit really runs out, with an incumbent
+            res = milp(*args, **kwargs)
+            time.sleep(kwargs['options']['time_limit'] + .1)
+            res.status = 1
+            return res
+
+        with unittest.mock.patch('scipy.optimize.milp', limit_reached), \
+                self.assertWarns(SuboptimalPenaltyModelWarning):
+            bqm, gap, aux = generate(graph, samples, engine='milp', time_limit=.2)
+
+        self.check_bqm_table(bqm, gap, self.AND, (0, 1, 2))
+
+    def test_portfolio(self):
+        with self.assertRaises(PenaltyModelTimeout):
+            generate(nx.complete_graph(7), table_to_sampleset(self.hard, range(5)),
+                     portfolio=2, time_limit=.2)
+
+
+class TestPortfolio(unittest.TestCase):
+    def test_AND_K4(self):
+        graph = nx.complete_graph(4)
+        configurations = {(-1, -1, -1): 0,
+                          (-1, +1, -1): 0,
+                          (+1, -1, -1): 0,
+                          (+1, +1, +1): 0}
+        decision_variables = (0, 1, 2)
+
+        bqm, gap, aux = generate(graph, table_to_sampleset(configurations, decision_variables),
+                                 portfolio=2, seed=5)
+
+        self.assertEqual(gap, 2)
+        self.assertEqual(set(aux), set(configurations))
+        for config, aux_config in aux.items():
+            sample = dict(zip(decision_variables, config))
+            sample.update(aux_config)
+            self.assertAlmostEqual(bqm.energy(sample), 0)
+
+    def test_impossible(self):
+        graph = nx.complete_graph(3)
+        configurations = {(-1, -1, -1): 0,
+                          (-1, +1, +1): 0,
+                          (+1, -1, +1): 0,
+                          (+1, +1, -1): 0}
+
+        with self.assertRaises(ImpossiblePenaltyModel):
+            generate(graph, table_to_sampleset(configurations, (0, 1, 2)), portfolio=2)
+
+    # 4-input XOR, which has no penalty model on a K7 and takes a while to
+    # prove it
+    XOR4 = {config + ((-1, +1)[config.count(+1) % 2],): 0
+            for config in itertools.product((-1, +1), repeat=4)}
+
+    def test_seed_sequence(self):
+        graph = nx.complete_graph(4)
+        configurations = {(-1, -1, -1): 0,
+                          (+1, +1, +1): 0}
+
+        bqm, gap, aux = generate(graph, table_to_sampleset(configurations, (0, 1, 2)),
+                                 portfolio=2, seed=np.random.SeedSequence(1))
+
+        self.assertEqual(set(aux), set(configurations))
+
+    def test_cancel(self):
+        graph = nx.complete_graph(4)
+        configurations = {(-1, -1, -1): 0,
+                          (+1, +1, +1): 0}
+
+        cancel = unittest.mock.Mock()
+        cancel.is_set.return_value = True
+
+        with self.assertRaises(Cancelled):
+            generate(graph, table_to_sampleset(configurations, (0, 1, 2)), cancel=cancel)
+
+    def test_cancel_portfolio(self):
+        cancel = threading.Event()
+        cancel.set()
+
+        with self.assertRaises(Cancelled):
+            generate(nx.complete_graph(7), table_to_sampleset(self.XOR4, range(5)),
+                     portfolio=2, cancel=cancel)
+
+    def test_losers_cancelled(self):
+        outcomes = []
+
+        def record(*args, **kwargs):
+            try:
+                outcomes.append(generate_cancellable(*args, **kwargs))
+            except Exception as err:
+                outcomes.append(type(err))
+                raise
+
+        # use threads so that the outcomes can be seen
+        generate_cancellable = penaltymodel.generation._generate_cancellable
+        with unittest.mock.patch('penaltymodel.generation._generate_cancellable', record), \
+                unittest.mock.patch('concurrent.futures.ProcessPoolExecutor',
+                                    concurrent.futures.ThreadPoolExecutor), \
+                unittest.mock.patch('multiprocessing.Event', threading.Event):
+            with self.assertRaises(ImpossiblePenaltyModel):
+                generate(nx.complete_graph(7), table_to_sampleset(self.XOR4, range(5)), portfolio=3)
+
+        self.assertEqual(len(outcomes), 3)
+        self.assertIn(ImpossiblePenaltyModel, outcomes)
+        self.assertIn(Cancelled, outcomes)
+
+
+def count_solves(*args, **kwargs):
+    """Generate and count the linear programs solved."""
+    original = penaltymodel.generation.LinearProgram.solve
+    with unittest.mock.patch.object(penaltymodel.generation.LinearProgram, 'solve', autospec=True,
+                                    side_effect=original) as solve:
+        try:
+            generate(*args, **kwargs)
+        except ImpossiblePenaltyModel:
+            pass
+    return solve.call_count
+
+
+class TestAuxiliarySymmetries(unittest.TestCase):
+    def test_complete(self):
+        graph = nx.complete_graph(5)
+
+        symmetries = AuxiliarySymmetries.from_graph(graph, [0, 1, 2], [3, 4])
+        self.assertEqual(len(symmetries), 1)  # swap
+        np.testing.assert_array_equal(symmetries.images([0], 0b01), [0b10])
+
+        symmetries = AuxiliarySymmetries.from_graph(graph, [0, 1, 2], [3, 4], gauge=True)
+        self.assertEqual(len(symmetries), 7)
+        images = symmetries.images(np.arange(7), 0b01)
+        self.assertEqual(set(images), {0b00, 0b01, 0b10, 0b11})
+
+    def test_path(self):
+        # the decision variables are fixed, so the auxiliaries cannot move
+        graph = nx.path_graph(4)
+        symmetries = AuxiliarySymmetries.from_graph(graph, [0, 3], [1, 2])
+        self.assertEqual(len(symmetries), 0)
+
+        # but the middle of a star can swap
+        graph = nx.star_graph(3)
+        symmetries = AuxiliarySymmetries.from_graph(graph, [0, 3], [1, 2])
+        self.assertEqual(len(symmetries), 1)
+
+    def test_prunes(self):
+        # XOR has no penalty model with a gap of 3 on a K5, but the two
+        # auxiliaries are interchangeable and can be flipped
+        graph = nx.complete_graph(5)
+        configurations = {(-1, -1, -1): 0,
+                          (-1, +1, +1): 0,
+                          (+1, -1, +1): 0,
+                          (+1, +1, -1): 0}
+        samples = table_to_sampleset(configurations, (0, 1, 2))
+
+        with_symmetry = count_solves(graph, samples, min_classical_gap=3)
+        without_symmetry = count_solves(graph, samples, min_classical_gap=3,
+                                        symmetry_breaking=False)
+
+        self.assertLessEqual(4*with_symmetry, without_symmetry)
+
+    def test_max_size(self):
+        graph = nx.complete_graph(8)
+        symmetries = AuxiliarySymmetries.from_graph(graph, [0, 1], range(2, 8), gauge=True,
+                                                    max_size=100)
+        self.assertEqual(len(symmetries), 100)
+
+
+class TestMostConstrained(unittest.TestCase):
+    def search(self):
+        # no row is satisfied as an equality by x, so every row is probed
+        lp = unittest.mock.Mock()
+        lp.A = np.zeros((16, 3), dtype=np.int8)
+        lp.b = np.ones(16)
+        lp.is_fixed = np.zeros(16, dtype=bool)
+
+        search = AuxiliarySearch(lp, [0, 1, 2, 3], 2, 2, most_constrained=True)
+        search.auxiliary_configurations[0] = 0
+        search.x = np.zeros(3)
+        return search
+
+    def test_fewest_consistent(self):
+        search = self.search()
+
+        # decision state 2 only has one auxiliary state left, 3 has two
+        counts = {1: 4, 2: 1, 3: 2}
+        search.probe = lambda i: (i >> 2) < counts[i & 3]
+        self.assertEqual(search.next_decision(), 2)
+
+        # decision state 3 is a dead end
+        search.probe = lambda i: (i & 3) != 3
+        self.assertEqual(search.next_decision(), 3)
+
+    def test_ties(self):
+        search = self.search()
+        search.probe = lambda i: True
+        self.assertEqual(search.next_decision(), 1)
+
+        search.order = [3, 2, 1, 0]
+        self.assertEqual(search.next_decision(), 3)
+
+    def test_max_probes(self):
+        search = self.search()
+        search.max_probes = 2
+
+        # only the first two auxiliary states are probed, the rest are
+        # assumed consistent
+        probed = []
+        search.probe = lambda i: probed.append(i) or (i & 3) != 2
+        self.assertEqual(search.next_decision(), 2)
+        self.assertLessEqual(sum(i & 3 == 2 for i in probed), 2)
+
+    @unittest.skipIf(penaltymodel.generation.highspy is None, "needs the certificates from highspy")
+    def test_prunes(self):
+        # a random table that has no penalty model with a gap of 4 on a K6
+        graph = nx.complete_graph(6)
+        configurations = {spins(code, 4): 0 for code in [0, 3, 4, 6, 7, 8, 9, 10, 11, 13]}
+        samples = table_to_sampleset(configurations, range(4))
+
+        static = count_solves(graph, samples, min_classical_gap=4)
+        most_constrained = count_solves(graph, samples, min_classical_gap=4,
+                                        ordering='most-constrained')
+
+        self.assertLess(2*most_constrained, static)
+
+
+class TestNogoods(unittest.TestCase):
+    @unittest.skipIf(penaltymodel.generation.highspy is None, "needs the certificates from highspy")
+    def test_prunes(self):
+        graph = nx.complete_graph(7)
+        # 4-input XOR, which has no penalty model on a K7
+        configurations = {config + ((-1, +1)[config.count(+1) % 2],): 0
+                          for config in itertools.product((-1, +1), repeat=4)}
+        samples = table_to_sampleset(configurations, range(5))
+
+        with_learning = count_solves(graph, samples, symmetry_breaking=False)
+        without_learning = count_solves(graph, samples, symmetry_breaking=False,
+                                        learn_nogoods=False)
+
+        self.assertLess(with_learning, .8*without_learning)
+
+
+    def test_find(self):
+        nogoods = Nogoods()
+        nogoods.add([1, 3, 5])
+        nogoods.add([3, 4])
+        nogoods.add([5, 3, 1])  # duplicate
+        self.assertEqual(len(nogoods), 2)
+
+        is_fixed = np.zeros(8, dtype=bool)
+        is_fixed[[1, 3]] = True
+        self.assertEqual(nogoods.find(5, is_fixed), {1, 3, 5})
+        self.assertEqual(nogoods.find(4, is_fixed), {3, 4})
+        self.assertIsNone(nogoods.find(1, is_fixed))
+        self.assertIsNone(nogoods.find(7, is_fixed))
+
+        is_fixed[5] = True
+        self.assertEqual(nogoods.find(1, is_fixed), {1, 3, 5})
+
+        # adding a nogood invalidates what was found before
+        nogoods.add([1, 2])
+        is_fixed[[3, 5]] = False
+        is_fixed[2] = True
+        self.assertEqual(nogoods.find(1, is_fixed), {1, 2})
+
+
+class TestStateCodes(unittest.TestCase):
+    def test_roundtrip(self):
+        a = all_possible(5)
+        codes = state_codes(a)
+        np.testing.assert_array_equal(codes, np.arange(32))
+        for code, row in zip(codes, a):
+            self.assertEqual(spins(code, 5), tuple(row))
+
+
+class TestAllPossible(unittest.TestCase):
+    def test_codes(self):
+        for num_variables in range(6):
+            with self.subTest(num_variables=num_variables):
+                a = all_possible(num_variables)
+                self.assertEqual(a.shape, (1 << num_variables, num_variables))
+                self.assertEqual(a.dtype, np.int8)
+                for code, row in enumerate(a):
+                    self.assertEqual(sum(1 << k for k, s in enumerate(row) if s > 0), code)
+
+    def test_range(self):
+        a = all_possible(20, 1000, 1010)
+        self.assertEqual(a.shape, (10, 20))
+        np.testing.assert_array_equal(a[:, :10], all_possible(10)[1000:1010])
+        np.testing.assert_array_equal(a[:, 10:], -1)
+
+
+class TestSparseRows(unittest.TestCase):
+    def test_rows(self):
+        graph = nx.cycle_graph(6)
+        indexer = Index([0, 1], [2, 3, 4, 5], graph.edges)
+        A = constraint_matrix(indexer, graph.edges)
+        A[:, indexer.gap()] = np.tile([0, -1, -1, 0], 16)
+
+        for rows, chunksize in [(None, 7), (np.array([5, 3, 60]), 2), (np.array([], dtype=int), 4)]:
+            with self.subTest(rows=rows, chunksize=chunksize):
+                M = sparse_rows(A, rows, chunksize=chunksize)
+                expected = A if rows is None else A[rows]
+                self.assertIsInstance(M, scipy.sparse.csr_matrix)
+                self.assertEqual(M.dtype, float)
+                np.testing.assert_array_equal(M.toarray(), expected)
+
+                # only the gap column has zeros
+                self.assertEqual(M.nnz, expected.size - (expected[:, indexer.gap()] == 0).sum())
+
+
+class TestNextAuxiliary(unittest.TestCase):
+    def test_gray_code(self):
+        for num_auxiliary in range(5):
+            with self.subTest(num_auxiliary=num_auxiliary):
+                codes = [0]
+                while codes[-1] != last_auxiliary(num_auxiliary):
+                    codes.append(next_auxiliary(codes[-1]))
+
+                # every state is visited exactly once
+                self.assertEqual(sorted(codes), list(range(1 << num_auxiliary)))
+
+                # and consecutive states differ by one variable
+                for c0, c1 in zip(codes, codes[1:]):
+                    self.assertEqual(bin(c0 ^ c1).count('1'), 1)
@@ -12,15 +12,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures
 import itertools
+import time
 import unittest
 import unittest.mock
+import warnings
 
 import dimod
 import networkx as nx
 
-from penaltymodel import get_penalty_model
+from penaltymodel import GenerationStats, get_penalty_model, get_penalty_models, iter_penalty_models
+from penaltymodel import ImpossiblePenaltyModel, PenaltyModelTimeout, SuboptimalPenaltyModelWarning
 from penaltymodel.database import isolated_cache
+from penaltymodel.generation import SharedConstraintMatrices, generate, linear_program
 
 
 class TestGetPenaltyModel(unittest.TestCase):
@@ -86,3 +91,235 @@ class TestGetPenaltyModel(unittest.TestCase):
         self.assertEqual(len(ground), 6)
         for sample in ground.samples():
             self.assertTrue(len(set(sample.values())) > 1)
+
+    @isolated_cache()
+    def test_time_limit(self):
+        AND = [[0, 0, 0], [0, 1, 0], [1, 0, 0], [1, 1, 1]]
+
+        with unittest.mock.patch('penaltymodel.interface.generate', wraps=generate) as mock:
+            bqm, gap = get_penalty_model(AND, time_limit=10)
+        self.assertEqual(mock.call_args.kwargs['time_limit'], 10)
+
+        def timeout(*args, **kwargs):
+            raise PenaltyModelTimeout
+
+        with unittest.mock.patch('penaltymodel.interface.generate', timeout):
+            with self.assertRaises(PenaltyModelTimeout):
+                get_penalty_model(AND, nx.complete_graph(4), time_limit=10)
+
+    @isolated_cache()
+    def test_suboptimal_not_cached(self):
+        AND = [[0, 0, 0], [0, 1, 0], [1, 0, 0], [1, 1, 1]]
+
+        def suboptimal(*args, **kwargs):
+            warnings.warn("ran out of time", SuboptimalPenaltyModelWarning)
+            return generate(*args, **kwargs)
+
+        with unittest.mock.patch('penaltymodel.interface.generate', suboptimal):
+            with self.assertWarns(SuboptimalPenaltyModelWarning):
+                get_penalty_model(AND, time_limit=10)
+
+        # so it is generated again
+        with unittest.mock.patch('penaltymodel.interface.generate', wraps=generate) as mock:
+            get_penalty_model(AND)
+        mock.assert_called_once()
+
+    @isolated_cache()
+    def test_stats(self):
+        XOR = [[0, 0, 0], [0, 1, 1], [1, 0, 1], [1, 1, 0]]
+
+        stats = GenerationStats()
+        get_penalty_model(XOR, nx.complete_graph(5), stats=stats)
+        self.assertIs(stats.cache_hit, False)
+        self.assertGreater(stats.num_solves, 0)
+
+        stats = GenerationStats()
+        get_penalty_model(XOR, nx.complete_graph(5), stats=stats)
+        self.assertIs(stats.cache_hit, True)
+        self.assertEqual(stats.num_solves, 0)
+
+        stats = GenerationStats()
+        get_penalty_model(XOR, nx.complete_graph(5), stats=stats, use_cache=False)
+        self.assertIsNone(stats.cache_hit)
+        self.assertGreater(stats.num_solves, 0)
+
+
+class TestGetPenaltyModels(unittest.TestCase):
+    AND = [[0, 0, 0], [0, 1, 0], [1, 0, 0], [1, 1, 1]]
+    OR = [[0, 0, 0], [0, 1, 1], [1, 0, 1], [1, 1, 1]]
+
+    def check_ground(self, bqm, samples_like):
+        samples, labels = dimod.as_samples(samples_like)
+        ground = dimod.keep_variables(dimod.ExactSolver().sample(bqm), labels).lowest().aggregate()
+        self.assertEqual({tuple(2*s - 1) for s in samples},
+                         {tuple(sample[v] for v in labels) for sample in ground.samples()})
+
+    @isolated_cache()
+    def test_batch(self):
+        specs = [(self.AND, None), (self.OR, nx.complete_graph(4)), (self.AND, None)]
+
+        models = get_penalty_models(specs, workers=2)
+
+        self.assertEqual(len(models), 3)
+        for (samples_like, _), (bqm, gap) in zip(specs, models):
+            self.assertGreaterEqual(gap, 2)
+            self.check_ground(bqm, samples_like)
+
+        # duplicates get the same model
+        self.assertEqual(models[0], models[2])
+
+        # everything should now be in the cache
+        with unittest.mock.patch('penaltymodel.interface.generate') as mock:
+            mock.side_effect = Exception('boom')
+            self.assertEqual(get_penalty_models(specs), models)
+
+    @isolated_cache()
+    def test_shared_matrices(self):
+        # AND and OR share a graph, XOR has its own
+        XOR = [[0, 0, 0], [0, 1, 1], [1, 0, 1], [1, 1, 0]]
+        specs = [(self.AND, nx.complete_graph(4)),
+                 (self.OR, nx.complete_graph(4)),
+                 (XOR, nx.complete_graph(5))]
+
+        with unittest.mock.patch.object(SharedConstraintMatrices, 'publish', autospec=True,
+                                        side_effect=SharedConstraintMatrices.publish) as publish:
+            models = get_penalty_models(specs, workers=2)
+
+        publish.assert_called_once_with(unittest.mock.ANY, (0, 1, 2), (3,),
+                                        tuple(nx.complete_graph(4).edges))
+        for (samples_like, _), (bqm, gap) in zip(specs, models):
+            self.check_ground(bqm, samples_like)
+
+    @isolated_cache()
+    def test_deduplicate(self):
+        # the same table, spin-valued and in a different order
+        specs = [(self.AND, None), ([[1, 1, 1], [-1, -1, -1], [-1, 1, -1], [1, -1, -1]], None)]
+
+        with unittest.mock.patch('penaltymodel.interface.generate', wraps=generate) as mock:
+            models = get_penalty_models(specs, workers=1)
+
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(models[0], models[1])
+
+    @isolated_cache()
+    def test_completion_order(self):
+        specs = [(self.AND, None), (self.OR, None)]
+
+        def slow_and(graph, samples_like, **kwargs):
+            if samples_like is self.AND:
+                time.sleep(.5)
+            return generate(graph, samples_like, **kwargs)
+
+        # threads so that the patched generate is used by the workers
+        with unittest.mock.patch('penaltymodel.interface.generate', slow_and), \
+                unittest.mock.patch('concurrent.futures.ProcessPoolExecutor',
+                                    concurrent.futures.ThreadPoolExecutor):
+            indices = [i for i, bqm, gap in iter_penalty_models(specs, workers=2)]
+        self.assertEqual(indices, [1, 0])
+
+        # second time they are all cached
+        indices = [i for i, bqm, gap in iter_penalty_models(specs, workers=2)]
+        self.assertEqual(sorted(indices), [0, 1])
+
+    @isolated_cache()
+    def test_impossible(self):
+        XOR = [[0, 0, 0], [0, 1, 1], [1, 0, 1], [1, 1, 0]]
+
+        with self.assertRaises(ImpossiblePenaltyModel):
+            get_penalty_models([(self.AND, None), (XOR, None)], workers=1)
+
+        # the AND gate is still written to the cache
+        with unittest.mock.patch('penaltymodel.interface.generate') as mock:
+            mock.side_effect = Exception('boom')
+            get_penalty_models([(self.AND, None)])
+
+    @isolated_cache()
+    def test_impossible_workers(self):
+        XOR = [[0, 0, 0], [0, 1, 1], [1, 0, 1], [1, 1, 0]]
+
+        with self.assertRaises(ImpossiblePenaltyModel):
+            get_penalty_models([(self.AND, None), (XOR, None), (self.OR, None)], workers=3)
+
+        # the models that finished are still written to the cache
+        with unittest.mock.patch('penaltymodel.interface.generate') as mock:
+            mock.side_effect = Exception('boom')
+            get_penalty_models([(self.AND, None), (self.OR, None)])
+
+    @isolated_cache()
+    def test_errors_return(self):
+        XOR = [[0, 0, 0], [0, 1, 1], [1, 0, 1], [1, 1, 0]]
+        specs = [(self.AND, None), (XOR, None), (self.OR, None), (XOR, None)]
+
+        # the cache is only used the first time so that every model is
+        # generated
+        for workers, use_cache in [(2, True), (1, False)]:
+            with self.subTest(workers=workers):
+                models = get_penalty_models(specs, workers=workers, use_cache=use_cache,
+                                            errors='return')
+
+                self.assertIsInstance(models[1], ImpossiblePenaltyModel)
+                self.assertIs(models[3], models[1])
+                self.check_ground(models[0][0], self.AND)
+                self.check_ground(models[2][0], self.OR)
+
+        # the successful models were cached
+        with unittest.mock.patch('penaltymodel.interface.generate') as mock:
+            mock.side_effect = Exception('boom')
+            get_penalty_models([(self.AND, None), (self.OR, None)])
+
+        with self.assertRaises(ValueError):
+            get_penalty_models(specs, errors='ignore')
+
+    @isolated_cache()
+    def test_generate_options(self):
+        specs = [(self.AND, None), (self.OR, None)]
+
+        with unittest.mock.patch('penaltymodel.interface.generate', wraps=generate) as mock:
+            get_penalty_models(specs, workers=1, min_classical_gap=1, time_limit=10,
+                               engine='lazy')
+
+        self.assertEqual(mock.call_count, 2)
+        for call in mock.call_args_list:
+            self.assertEqual(call.kwargs['min_classical_gap'], 1)
+            self.assertEqual(call.kwargs['time_limit'], 10)
+            self.assertEqual(call.kwargs['engine'], 'lazy')
+
+    @isolated_cache()
+    def test_suboptimal_not_cached(self):
+        def suboptimal(*args, **kwargs):
+            warnings.warn("ran out of time", SuboptimalPenaltyModelWarning)
+            return generate(*args, **kwargs)
+
+        with unittest.mock.patch('penaltymodel.interface.generate', suboptimal):
+            with self.assertWarns(SuboptimalPenaltyModelWarning):
+                get_penalty_models([(self.AND, None)], time_limit=10)
+
+        # so it is generated again
+        with unittest.mock.patch('penaltymodel.interface.generate', wraps=generate) as mock:
+            get_penalty_models([(self.AND, None)])
+        mock.assert_called_once()
+
+    @isolated_cache()
+    def test_lazy_constraints(self):
+        # the workers' solvers are only given some of the shared rows
+        specs = [(self.AND, nx.complete_graph(4)), (self.OR, nx.complete_graph(4))]
+
+        lps = []
+
+        def capture(*args, **kwargs):
+            lps.append(linear_program(*args, **kwargs))
+            return lps[-1]
+
+        # threads so that the linear programs can be seen
+        with unittest.mock.patch('penaltymodel.generation.linear_program', capture), \
+                unittest.mock.patch('concurrent.futures.ProcessPoolExecutor',
+                                    concurrent.futures.ThreadPoolExecutor):
+            models = get_penalty_models(specs, workers=2, engine='lp', lazy_constraints=True)
+
+        for (samples_like, _), (bqm, gap) in zip(specs, models):
+            self.check_ground(bqm, samples_like)
+
+        self.assertTrue(lps)
+        for lp in lps:
+            self.assertTrue(lp.lazy)
+            self.assertLess(lp.is_active.sum(), len(lp.is_active))